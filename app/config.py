@@ -1,21 +1,26 @@
 import os
 import logging
-import torch
+import multiprocessing
 from pathlib import Path
 from dotenv import load_dotenv
+from app.logs import setup_logging, setup_worker_logging
 
 # Carga automática del archivo .env
 load_dotenv()
 
-# Configuración del logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("qa_service.log")
-    ]
-)
+# Configuración del logging: las peticiones solo encolan, un hilo escribe
+LOG_LEVEL = os.getenv("QA_LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.getenv("QA_LOG_FILE", "qa_service.log")  # Vacío = solo consola
+LOG_SAMPLING = os.getenv("QA_LOG_SAMPLING", "")  # Fracción que se escribe por tipo, p. ej. "cache_hit=0.01,question=0.1"
+# Los procesos de inferencia (app.services.workers) también importan la configuración
+INFERENCE_PROCESS_PREFIX = "qa-inference-"
+IS_INFERENCE_PROCESS = multiprocessing.current_process().name.startswith(INFERENCE_PROCESS_PREFIX)
+if IS_INFERENCE_PROCESS:
+    # Solo consola: el listener y el archivo de log son del proceso principal
+    log_listener = None
+    setup_worker_logging(getattr(logging, LOG_LEVEL, logging.INFO))
+else:
+    log_listener = setup_logging(getattr(logging, LOG_LEVEL, logging.INFO), LOG_FILE, LOG_SAMPLING)
 logger = logging.getLogger("qa-chatbot")
 
 PROJECT_ROOT = Path(__file__).parent.parent
@@ -23,27 +28,72 @@ PROJECT_ROOT = Path(__file__).parent.parent
 # Configurar CONTEXT_PATH para que sea relativo a la raíz del proyecto
 CONTEXT_PATH = os.getenv("QA_CONTEXT_PATH", 
                          str(PROJECT_ROOT / "context" / "context.txt"))
+CORPORA_DIR = os.getenv("QA_CORPORA_DIR", str(PROJECT_ROOT / "context" / "corpora"))  # <nombre>.txt por corpus adicional
+CORPORA_MEMORY_BUDGET = int(os.getenv("QA_CORPORA_MEMORY_BUDGET", str(512 * 1024 * 1024)))  # Bytes para corpus cargados
+FEEDBACK_DB_PATH = os.getenv("QA_FEEDBACK_DB_PATH", str(PROJECT_ROOT / "data" / "feedback.db"))
+FEEDBACK_FLUSH_INTERVAL = float(os.getenv("QA_FEEDBACK_FLUSH_INTERVAL", "1"))  # Segundos entre escrituras por lotes
+FEEDBACK_RETENTION_DAYS = int(os.getenv("QA_FEEDBACK_RETENTION_DAYS", "90"))  # Días que se conservan los registros individuales
+CONTEXT_WATCH_INTERVAL = float(os.getenv("QA_CONTEXT_WATCH_INTERVAL", "2"))  # Sondeo del archivo de contexto (0 = no vigilar)
 # Cargar variables de entorno (con valores por defecto)
 MODEL_NAME = os.getenv("QA_MODEL_NAME", "distilbert-base-uncased-distilled-squad")
 ENABLE_CORS = os.getenv("QA_ENABLE_CORS", "true").lower() == "true"
 ALLOWED_ORIGINS = os.getenv("QA_ALLOWED_ORIGINS", "*").split(",")
 MAX_ANSWER_LENGTH = int(os.getenv("QA_MAX_ANSWER_LENGTH", "50"))
 CONFIDENCE_THRESHOLD = float(os.getenv("QA_CONFIDENCE_THRESHOLD", "0.01"))
-DEVICE = os.getenv("QA_DEVICE", "cuda" if torch.cuda.is_available() else "cpu")
+DEVICE = os.getenv("QA_DEVICE", "auto")  # auto = cuda si está disponible, si no cpu
+BACKEND = os.getenv("QA_BACKEND", "torch").lower()  # torch | torch-int8 | onnx
+ONNX_DIR = os.getenv("QA_ONNX_DIR", "")  # Carpeta donde reutilizar/guardar la exportación ONNX
 ADMIN_API_KEY = os.getenv("QA_ADMIN_API_KEY")
 CACHE_TIMEOUT = int(os.getenv("QA_CACHE_TIMEOUT", "3600"))  # Segundos para invalidar cache
+CACHE_MAX_ENTRIES = int(os.getenv("QA_CACHE_MAX_ENTRIES", "1000"))
+CACHE_MAX_BYTES = int(os.getenv("QA_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+CACHE_FUZZY_MATCH = os.getenv("QA_CACHE_FUZZY_MATCH", "false").lower() == "true"  # Servir preguntas casi idénticas
+CACHE_FUZZY_THRESHOLD = float(os.getenv("QA_CACHE_FUZZY_THRESHOLD", "0.75"))  # Similitud de Jaccard mínima
+CACHE_BACKEND = os.getenv("QA_CACHE_BACKEND", "memory").lower()  # memory (por proceso) | sqlite (compartida entre workers)
+CACHE_SHARED_PATH = os.getenv("QA_CACHE_SHARED_PATH", str(PROJECT_ROOT / "data" / "response_cache.db"))
+CACHE_SNAPSHOT_DIR = os.getenv("QA_CACHE_SNAPSHOT_DIR", "")  # Carpeta de snapshots de la caché (vacío = desactivado)
+CACHE_SNAPSHOT_INTERVAL = float(os.getenv("QA_CACHE_SNAPSHOT_INTERVAL", "300"))  # Segundos entre snapshots (0 = solo al apagar)
+CACHE_WARMUP_QUESTIONS = int(os.getenv("QA_CACHE_WARMUP_QUESTIONS", "0"))  # Preguntas frecuentes a recalentar tras cargar el modelo
+FAQ_DIR = os.getenv("QA_FAQ_DIR", "")  # Carpeta de las listas de preguntas frecuentes precalculadas, p. ej. data/faq (vacío = desactivado)
+FAQ_MAX_QUESTIONS = int(os.getenv("QA_FAQ_MAX_QUESTIONS", "500"))  # Preguntas por corpus
+FAQ_CHECK_INTERVAL = float(os.getenv("QA_FAQ_CHECK_INTERVAL", "30"))  # Segundos entre comprobaciones de cambios hechos por otros workers
 PORT = int(os.getenv("QA_PORT", "8000"))
 HOST = os.getenv("QA_HOST", "0.0.0.0")
 RELOAD = os.getenv("QA_RELOAD", "false").lower() == "true"
+INFERENCE_WORKERS = int(os.getenv("QA_INFERENCE_WORKERS", "1"))  # Hilos dedicados a la inferencia
+TORCH_THREADS = int(os.getenv("QA_TORCH_THREADS", "0"))  # Hilos intra-op de torch del proceso, compartidos por los hilos de inferencia (0 = por defecto)
+INFERENCE_PROCESSES = int(os.getenv("QA_INFERENCE_PROCESSES", "0"))  # Procesos de inferencia con pesos compartidos (0 = hilos)
+BATCH_MAX_SIZE = int(os.getenv("QA_BATCH_MAX_SIZE", "8"))  # Preguntas máximas por lote de inferencia
+BATCH_WAIT_MS = float(os.getenv("QA_BATCH_WAIT_MS", "10"))  # Ventana de espera para completar un lote
+INFERENCE_QUEUE_MAX = int(os.getenv("QA_INFERENCE_QUEUE_MAX", "256"))  # Preguntas esperando inferencia (0 = sin límite)
+REQUEST_DEADLINE_MS = float(os.getenv("QA_REQUEST_DEADLINE_MS", "30000"))  # Plazo para llegar al modelo (0 = sin plazo)
+RETRIEVAL_TOP_K = int(os.getenv("QA_RETRIEVAL_TOP_K", "3"))  # Pasajes que lee el modelo (0 = documento completo)
+PASSAGE_MAX_CHARS = int(os.getenv("QA_PASSAGE_MAX_CHARS", "500"))
+MAX_SEQ_LEN = int(os.getenv("QA_MAX_SEQ_LEN", "384"))  # Tokens por ventana (pregunta + contexto)
+DOC_STRIDE = int(os.getenv("QA_DOC_STRIDE", "128"))  # Solapamiento entre ventanas consecutivas
+MAX_QUESTION_LEN = int(os.getenv("QA_MAX_QUESTION_LEN", "64"))
+WINDOW_SEARCH = os.getenv("QA_WINDOW_SEARCH", "exhaustive").lower()  # exhaustive | early_exit | parity (sirve exhaustive y compara)
+EARLY_EXIT_SCORE = float(os.getenv("QA_EARLY_EXIT_SCORE", "0.5"))  # early_exit corta con un tramo >= este score (nunca menor que CONFIDENCE_THRESHOLD)
+ADAPTIVE_WINDOWS = os.getenv("QA_ADAPTIVE_WINDOWS", "false").lower() == "true"  # early_exit (y parity) alargan las ventanas si la pregunta es corta
+WARMUP_QUESTION = os.getenv("QA_WARMUP_QUESTION", "¿Dónde queda la institución?")  # Inferencia de calentamiento al arrancar
 
 #log para ver el path del contexto
-logger.info(f"Context path: {CONTEXT_PATH} : ")
+if not IS_INFERENCE_PROCESS:
+    logger.info(f"Context path: {CONTEXT_PATH} : ")
 
 # Validar configuración
 if not ADMIN_API_KEY:
-    logger.warning("No se ha configurado una API key para administración. Se usará una clave por defecto.")
+    if not IS_INFERENCE_PROCESS:
+        logger.warning("No se ha configurado una API key para administración. Se usará una clave por defecto.")
     ADMIN_API_KEY = "admin-key-change-me"
 
+def resolve_device(device: str) -> str:
+    """Resuelve QA_DEVICE=auto; torch solo se importa cuando hace falta"""
+    if device != "auto":
+        return device
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
 # Asegurar que la carpeta de contexto exista
 def ensure_context_directory():
     context_dir = Path(CONTEXT_PATH).parent
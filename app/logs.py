@@ -0,0 +1,167 @@
+import atexit
+import logging
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from typing import Any, Dict, Optional
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+class LogStats:
+    """Volumen y coste de formateo de los logs, por tipo de mensaje (extra={"log_type": ...})"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self._lock:
+            self.types: Dict[str, Dict[str, float]] = {}
+    
+    def _entry(self, log_type: str) -> Dict[str, float]:
+        entry = self.types.get(log_type)
+        if entry is None:
+            entry = self.types[log_type] = {"records": 0, "sampled_out": 0, "bytes": 0, "format_ns": 0}
+        return entry
+    
+    def record_written(self, log_type: str, size: int, format_ns: int):
+        with self._lock:
+            entry = self._entry(log_type)
+            entry["records"] += 1
+            entry["bytes"] += size
+            entry["format_ns"] += format_ns
+    
+    def record_sampled_out(self, log_type: str):
+        with self._lock:
+            self._entry(log_type)["sampled_out"] += 1
+    
+    def get_stats(self, requests: int = 0) -> Dict[str, Any]:
+        with self._lock:
+            types = {name: dict(entry) for name, entry in self.types.items()}
+        totals = {
+            key: sum(entry[key] for entry in types.values())
+            for key in ("records", "sampled_out", "bytes", "format_ns")
+        }
+        result = {
+            "records": totals["records"],
+            "sampled_out": totals["sampled_out"],
+            "bytes": totals["bytes"],
+            "format_ms": totals["format_ns"] / 1e6,
+            "types": {
+                name: {
+                    "records": entry["records"],
+                    "sampled_out": entry["sampled_out"],
+                    "bytes": entry["bytes"],
+                    "format_ms": entry["format_ns"] / 1e6
+                }
+                for name, entry in sorted(types.items())
+            }
+        }
+        # Coste medio que añade el logging a cada petición atendida
+        if requests:
+            result["per_request"] = {
+                "records": totals["records"] / requests,
+                "bytes": totals["bytes"] / requests,
+                "format_us": totals["format_ns"] / requests / 1e3
+            }
+        return result
+
+log_stats = LogStats()
+
+def parse_sampling(spec: str) -> Dict[str, float]:
+    """Convierte "cache_hit=0.01,question=0.1" en {tipo: fracción de mensajes que se escriben}"""
+    rates = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, value = item.split("=", 1)
+        try:
+            rates[name.strip()] = min(1.0, max(0.0, float(value)))
+        except ValueError:
+            continue
+    return rates
+
+class SamplingFilter(logging.Filter):
+    """
+    Descarta una fracción de los mensajes de tipos muy frecuentes antes de
+    encolarlos. Los errores nunca se descartan.
+    """
+    
+    def __init__(self, rates: Dict[str, float], stats: LogStats):
+        super().__init__()
+        self.rates = rates
+        self.stats = stats
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(getattr(record, "log_type", None))
+        if rate is None or record.levelno >= logging.ERROR or random.random() < rate:
+            return True
+        self.stats.record_sampled_out(record.log_type)
+        return False
+
+class _DeferredQueueHandler(QueueHandler):
+    """Encola el registro sin formatearlo: el mensaje se compone en el hilo del listener"""
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class _MeasuringFormatter(logging.Formatter):
+    """Formatea cada registro una sola vez para todos los handlers y mide el coste"""
+    
+    def __init__(self, stats: LogStats):
+        super().__init__(LOG_FORMAT)
+        self.stats = stats
+    
+    def format(self, record: logging.LogRecord) -> str:
+        formatted = getattr(record, "_formatted", None)
+        if formatted is None:
+            start = time.perf_counter_ns()
+            formatted = super().format(record)
+            self.stats.record_written(
+                getattr(record, "log_type", "other"),
+                len(formatted) + 1,
+                time.perf_counter_ns() - start
+            )
+            record._formatted = formatted
+        return formatted
+
+def setup_logging(level: int, log_file: Optional[str], sampling: str = "") -> QueueListener:
+    """
+    Configura el logger raíz para que las peticiones solo encolen los
+    registros; un hilo (QueueListener) los formatea y los escribe en consola
+    y en log_file.
+    """
+    formatter = _MeasuringFormatter(log_stats)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    queue = SimpleQueue()
+    queue_handler = _DeferredQueueHandler(queue)
+    queue_handler.addFilter(SamplingFilter(parse_sampling(sampling), log_stats))
+    
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    
+    listener = QueueListener(queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Se vacía la cola al salir para no perder los últimos mensajes
+    atexit.register(listener.stop)
+    return listener
+
+def setup_worker_logging(level: int):
+    """Configuración para procesos hijos: un StreamHandler sin cola, sin archivo ni muestreo"""
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root = logging.getLogger()
+    root.setLevel(level)
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
@@ -1,4 +1,6 @@
 import time
+import threading
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
@@ -10,28 +12,184 @@ from pathlib import Path
 
 # Importar configuración
 from app.config import (
-    logger, MODEL_NAME, CONTEXT_PATH, ENABLE_CORS, ALLOWED_ORIGINS,
-    CACHE_TIMEOUT, HOST, PORT, RELOAD, DEVICE, ensure_context_directory
+    logger, MODEL_NAME, CONTEXT_PATH, CORPORA_DIR, CORPORA_MEMORY_BUDGET, CONTEXT_WATCH_INTERVAL,
+    ENABLE_CORS, ALLOWED_ORIGINS,
+    FEEDBACK_DB_PATH, FEEDBACK_FLUSH_INTERVAL, FEEDBACK_RETENTION_DAYS,
+    CACHE_TIMEOUT, CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_FUZZY_MATCH, CACHE_FUZZY_THRESHOLD,
+    CACHE_BACKEND, CACHE_SHARED_PATH, CACHE_SNAPSHOT_DIR, CACHE_SNAPSHOT_INTERVAL, CACHE_WARMUP_QUESTIONS, CONFIDENCE_THRESHOLD,
+    FAQ_DIR, FAQ_MAX_QUESTIONS, FAQ_CHECK_INTERVAL,
+    HOST, PORT, RELOAD, DEVICE, BACKEND, INFERENCE_WORKERS, TORCH_THREADS, INFERENCE_PROCESSES,
+    BATCH_MAX_SIZE, BATCH_WAIT_MS, INFERENCE_QUEUE_MAX, REQUEST_DEADLINE_MS, WARMUP_QUESTION, ensure_context_directory, resolve_device,
+    WINDOW_SEARCH, EARLY_EXIT_SCORE, ADAPTIVE_WINDOWS
 )
 
 # Importar servicios
-from app.services.context import ContextManager
 from app.services.model import ModelManager
-from app.services.cache import ResponseCache
+from app.services.cache import CacheBackend, ResponseCache
+from app.services.shared_cache import SharedResponseCache
 from app.services.metrics import MetricsManager
+from app.services.batching import BatchScheduler
+from app.services.corpora import CorpusRegistry
+from app.services.feedback import FeedbackStore
+from app.services.faq import FaqTable
+from app.services.profiling import InferenceProfiler
+from app.services.snapshots import CacheSnapshots, warm_up_cache
 
 # Importar rutas
-from app.routes.qa import router as qa_router, dependencies as qa_dependencies
+from app.routes.qa import router as qa_router, dependencies as qa_dependencies, build_response
 from app.routes.admin import router as admin_router, dependencies as admin_dependencies
 
 # Asegurar que existe el directorio de contexto
 ensure_context_directory()
 
-# Crear instancias de servicios
-metrics_manager = MetricsManager()
-response_cache = ResponseCache(timeout=CACHE_TIMEOUT)
-context_manager = ContextManager(CONTEXT_PATH)
-model_manager = ModelManager(MODEL_NAME, DEVICE)
+# Dependencias compartidas con los routers (se completan durante el arranque)
+shared_dependencies = {}
+
+# Estado del arranque: el servicio está vivo de inmediato y listo tras cargar y calentar el modelo
+startup_state = {"started_at": None, "loaded_at": None, "error": None}
+
+def share(**services):
+    shared_dependencies.update(services)
+    qa_dependencies.update(services)
+    admin_dependencies.update(services)
+
+def is_ready() -> bool:
+    model_manager = shared_dependencies.get("model_manager")
+    return startup_state["loaded_at"] is not None and model_manager is not None and model_manager.is_available()
+
+def create_cache(name: str, context_manager) -> CacheBackend:
+    """Caché de respuestas de un corpus según QA_CACHE_BACKEND"""
+    if CACHE_BACKEND == "sqlite":
+        return SharedResponseCache(
+            CACHE_SHARED_PATH,
+            name,
+            context_manager,
+            model_key=f"{MODEL_NAME}:{BACKEND}",
+            timeout=CACHE_TIMEOUT,
+            max_entries=CACHE_MAX_ENTRIES,
+            max_bytes=CACHE_MAX_BYTES
+        )
+    return ResponseCache(
+        timeout=CACHE_TIMEOUT,
+        max_entries=CACHE_MAX_ENTRIES,
+        max_bytes=CACHE_MAX_BYTES,
+        fuzzy_match=CACHE_FUZZY_MATCH,
+        fuzzy_threshold=CACHE_FUZZY_THRESHOLD
+    )
+
+def load_model_resources():
+    """Carga el modelo, pre-tokeniza el contexto y hace una inferencia de calentamiento"""
+    try:
+        corpora = shared_dependencies["corpora"]
+        model_manager = ModelManager(
+            MODEL_NAME, resolve_device(DEVICE), INFERENCE_WORKERS, TORCH_THREADS, INFERENCE_PROCESSES, BACKEND,
+            profiler=shared_dependencies["profiler"],
+            window_search=WINDOW_SEARCH,
+            # Cortar por debajo del umbral podría dar un 404 habiendo ventanas sin leer con mejor respuesta
+            early_exit_score=max(CONFIDENCE_THRESHOLD, EARLY_EXIT_SCORE),
+            adaptive_windows=ADAPTIVE_WINDOWS
+        )
+        corpora.set_tokenizer(model_manager.get_tokenizer())
+        batch_scheduler = BatchScheduler(
+            model_manager, shared_dependencies["metrics_manager"], BATCH_MAX_SIZE, BATCH_WAIT_MS,
+            max_queue=INFERENCE_QUEUE_MAX, deadline_ms=REQUEST_DEADLINE_MS
+        )
+        # Se comparten antes del calentamiento: si este falla, /qa responde igualmente en vez de un 503 permanente
+        share(model_manager=model_manager, batch_scheduler=batch_scheduler)
+        
+        if model_manager.is_available():
+            # La primera inferencia paga inicializaciones perezosas: que no la pague el primer usuario
+            try:
+                warmup_start = time.time()
+                batch_scheduler.answer(WARMUP_QUESTION, corpora.get().context_manager.retrieve(WARMUP_QUESTION))
+                logger.info(f"Calentamiento del modelo completado en {time.time() - warmup_start:.3f}s")
+            except Exception as e:
+                logger.warning(f"Error en la inferencia de calentamiento (el servicio arranca sin calentar): {str(e)}")
+        else:
+            startup_state["error"] = "No se pudo cargar el modelo"
+        
+        if model_manager.is_available() and "faq" in shared_dependencies:
+            # Las preguntas frecuentes se responden en segundo plano; mientras tanto van por la caché y el modelo
+            shared_dependencies["faq"].start(batch_scheduler, build_response, CONFIDENCE_THRESHOLD)
+        startup_state["loaded_at"] = time.time()
+        logger.info(f"Arranque completado en {startup_state['loaded_at'] - startup_state['started_at']:.2f}s")
+        
+        if model_manager.is_available() and CACHE_WARMUP_QUESTIONS > 0:
+            threading.Thread(target=warm_up_caches, name="qa-cache-warmup", daemon=True).start()
+    except Exception as e:
+        startup_state["error"] = str(e)
+        logger.error(f"Error durante el arranque del modelo: {str(e)}", exc_info=True)
+
+def warm_up_caches():
+    """Recalienta la caché de los corpus cargados con las preguntas más frecuentes del historial"""
+    snapshots = shared_dependencies.get("cache_snapshots")
+    feedback_store = shared_dependencies["feedback_store"]
+    for corpus in shared_dependencies["corpora"].loaded():
+        try:
+            # Primero las más consultadas antes del reinicio y después las que más feedback recibieron
+            questions = snapshots.history(corpus.name) if snapshots else []
+            questions += feedback_store.top_questions(corpus.name, CACHE_WARMUP_QUESTIONS)
+            warmed = warm_up_cache(
+                corpus, questions, shared_dependencies["batch_scheduler"], build_response,
+                CONFIDENCE_THRESHOLD, CACHE_WARMUP_QUESTIONS
+            )
+            logger.info(f"Caché de {corpus.name} recalentada con {warmed} preguntas frecuentes")
+        except Exception as e:
+            logger.error(f"Error al recalentar la caché de {corpus.name}: {str(e)}", exc_info=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup_state["started_at"] = time.time()
+    # Cada corpus tiene su propio contexto, índices y caché; todos comparten el modelo
+    corpora = CorpusRegistry(
+        CONTEXT_PATH,
+        CORPORA_DIR,
+        CORPORA_MEMORY_BUDGET,
+        cache_factory=create_cache,
+        watch_interval=CONTEXT_WATCH_INTERVAL
+    )
+    snapshots = None
+    if CACHE_SNAPSHOT_DIR:
+        # Las respuestas guardadas solo valen para el mismo modelo (y backend) y el mismo contexto
+        snapshots = CacheSnapshots(CACHE_SNAPSHOT_DIR, f"{MODEL_NAME}:{BACKEND}", CACHE_SNAPSHOT_INTERVAL)
+        corpora.add_listener(snapshots.restore)
+        snapshots.start(corpora.loaded)
+    faq = None
+    if FAQ_DIR:
+        faq = FaqTable(FAQ_DIR, FAQ_MAX_QUESTIONS, FAQ_CHECK_INTERVAL)
+        corpora.add_listener(faq.attach)
+    # El corpus por defecto se carga de inmediato; el resto al consultarlos
+    corpora.get()
+    feedback_store = FeedbackStore(
+        FEEDBACK_DB_PATH,
+        flush_interval=FEEDBACK_FLUSH_INTERVAL,
+        retention_days=FEEDBACK_RETENTION_DAYS
+    )
+    share(
+        metrics_manager=MetricsManager(),
+        corpora=corpora,
+        feedback_store=feedback_store,
+        profiler=InferenceProfiler()
+    )
+    if snapshots is not None:
+        share(cache_snapshots=snapshots)
+    if faq is not None:
+        share(faq=faq)
+    # El modelo se carga en segundo plano: / responde mientras tanto y /ready indica cuándo enviar tráfico
+    threading.Thread(target=load_model_resources, name="qa-model-loader", daemon=True).start()
+    
+    yield
+    
+    if snapshots is not None:
+        snapshots.stop(corpora.loaded())
+    if faq is not None:
+        faq.stop()
+    corpora.close()
+    feedback_store.close()
+    if "batch_scheduler" in shared_dependencies:
+        shared_dependencies["batch_scheduler"].stop()
+    if "model_manager" in shared_dependencies:
+        shared_dependencies["model_manager"].shutdown()
 
 # Inicializar la aplicación
 app = FastAPI(
@@ -40,7 +198,8 @@ app = FastAPI(
     version="1.1.0",
     docs_url="/api/docs",
     redoc_url="/api/redoc",
-    openapi_url="/api/openapi.json"
+    openapi_url="/api/openapi.json",
+    lifespan=lifespan
 )
 
 # Manejo global de errores
@@ -56,6 +215,8 @@ async def general_exception_handler(request: Request, exc: Exception):
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
     start_time = time.time()
+    # Los endpoints miden desde aquí la etapa de validación (lectura y validación del cuerpo)
+    request.state.received_at = time.perf_counter()
     response = await call_next(request)
     process_time = time.time() - start_time
     response.headers["X-Process-Time"] = str(process_time)
@@ -72,17 +233,6 @@ if ENABLE_CORS:
     )
     logger.info(f"CORS habilitado para los orígenes: {ALLOWED_ORIGINS}")
 
-# Compartir dependencias con los routers
-shared_dependencies = {
-    "context_manager": context_manager,
-    "model_manager": model_manager,
-    "response_cache": response_cache,
-    "metrics_manager": metrics_manager
-}
-
-qa_dependencies.update(shared_dependencies)
-admin_dependencies.update(shared_dependencies)
-
 # Incluir routers
 app.include_router(qa_router)
 app.include_router(admin_router)
@@ -94,15 +244,33 @@ if static_dir.exists():
 
 @app.get("/", tags=["Estado"])
 def read_root():
-    """Devuelve el estado del servicio"""
+    """Devuelve el estado del servicio (liveness: responde aunque el modelo aún se esté cargando)"""
+    model_manager = shared_dependencies.get("model_manager")
+    corpora = shared_dependencies.get("corpora")
     return {
-        "status": "ok" if model_manager.is_available() else "error",
-        "model": model_manager.get_model_info(),
-        "context_size": len(context_manager.get_context()),
+        "status": "ok",
+        "ready": is_ready(),
+        "model": model_manager.get_model_info() if model_manager else None,
+        "context_size": len(corpora.get().context_manager.context) if corpora else 0,
+        "corpora": corpora.names() if corpora else [],
         "cors_enabled": ENABLE_CORS,
         "cache_timeout": CACHE_TIMEOUT
     }
 
+@app.get("/ready", tags=["Estado"])
+def readiness():
+    """Readiness: 200 solo cuando el modelo está cargado y calentado"""
+    if is_ready():
+        return {"status": "ready", "loaded_at": startup_state["loaded_at"]}
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={
+            "status": "error" if startup_state["error"] else "starting",
+            "detail": startup_state["error"]
+        },
+        headers={"Retry-After": "5"}
+    )
+
 # Para ejecutar directamente la aplicación
 if __name__ == "__main__":
     logger.info(f"Iniciando servidor en {HOST}:{PORT} (reload={RELOAD})")
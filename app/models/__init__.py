@@ -1,4 +1,4 @@
-from app.models.question import QuestionRequest, AnswerResponse, ContextUpdateRequest
+from app.models.question import QuestionRequest, BatchQuestionRequest, AnswerResponse, ContextUpdateRequest
 from app.models.feedback import FeedbackRequest
 
-__all__ = ['QuestionRequest', 'AnswerResponse', 'ContextUpdateRequest', 'FeedbackRequest']
\ No newline at end of file
+__all__ = ['QuestionRequest', 'BatchQuestionRequest', 'AnswerResponse', 'ContextUpdateRequest', 'FeedbackRequest']
\ No newline at end of file
@@ -7,4 +7,5 @@ class FeedbackRequest(BaseModel):
     question: str = Field(..., min_length=2)
     answer: str = Field(..., min_length=1)
     is_helpful: bool = Field(...)
-    comments: Optional[str] = Field(None)
\ No newline at end of file
+    comments: Optional[str] = Field(None, max_length=2000)
+    corpus: Optional[str] = Field(None, pattern=r"^[A-Za-z0-9_-]{1,64}$")
\ No newline at end of file
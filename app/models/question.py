@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, validator, ConfigDict
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from app.config import logger
 
 class QuestionRequest(BaseModel):
@@ -8,6 +8,9 @@ class QuestionRequest(BaseModel):
     question: str = Field(..., min_length=2, max_length=500, 
                          example="¿Qué es la inteligencia artificial?",
                          description="Pregunta en lenguaje natural")
+    corpus: Optional[str] = Field(None, pattern=r"^[A-Za-z0-9_-]{1,64}$",
+                                  example="default",
+                                  description="Corpus (contexto) en el que buscar la respuesta; por defecto el principal")
     
     @validator('question')
     def question_must_be_valid(cls, v):
@@ -18,6 +21,22 @@ class QuestionRequest(BaseModel):
             logger.warning(f"Pregunta sin signo de interrogación: {v}")
         return v
 
+class BatchQuestionRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    
+    questions: List[str] = Field(..., min_length=1, max_length=500,
+                                 example=["¿Dónde queda System Plus?", "¿Cuál es el teléfono?"],
+                                 description="Preguntas en lenguaje natural")
+    corpus: Optional[str] = Field(None, pattern=r"^[A-Za-z0-9_-]{1,64}$",
+                                  description="Corpus (contexto) en el que buscar las respuestas")
+    
+    @validator('questions', each_item=True)
+    def questions_must_be_valid(cls, v):
+        v = v.strip()
+        if len(v) < 2 or len(v) > 500:
+            raise ValueError('Cada pregunta debe tener entre 2 y 500 caracteres')
+        return v
+
 class AnswerResponse(BaseModel):
     model_config = ConfigDict(extra="forbid")
     
@@ -33,4 +52,18 @@ class ContextUpdateRequest(BaseModel):
     
     context: str = Field(..., min_length=10, 
                        example="La inteligencia artificial es un campo de la informática que...",
-                       description="Nuevo contenido para el contexto")
\ No newline at end of file
+                       description="Nuevo contenido para el contexto")
+
+class FaqUpdateRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    
+    questions: List[str] = Field(..., max_length=5000,
+                                 example=["¿Dónde queda System Plus?", "¿Cuál es el teléfono?"],
+                                 description="Preguntas frecuentes que se responden de antemano")
+    
+    @validator('questions', each_item=True)
+    def questions_must_be_valid(cls, v):
+        v = v.strip()
+        if len(v) < 2 or len(v) > 500:
+            raise ValueError('Cada pregunta debe tener entre 2 y 500 caracteres')
+        return v
\ No newline at end of file
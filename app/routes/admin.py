@@ -1,13 +1,17 @@
-from fastapi import APIRouter, HTTPException, Depends
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import PlainTextResponse
 from fastapi.security import APIKeyHeader
-from app.config import ADMIN_API_KEY
-from app.models.question import ContextUpdateRequest
-from app.services.context import ContextManager
+from app.config import ADMIN_API_KEY, WARMUP_QUESTION, FAQ_DIR
+from app.logs import log_stats
+from app.models.question import ContextUpdateRequest, FaqUpdateRequest
+from app.services.corpora import Corpus, CorpusRegistry, CORPUS_NAME_RE
 from app.services.model import ModelManager
-from app.services.cache import ResponseCache
 from app.services.metrics import MetricsManager
-
-router = APIRouter(tags=["Administración"])
+from app.services.feedback import FeedbackStore
+from app.services.faq import FaqTable
+from app.services.text import normalize_question
+from app.services.profiling import InferenceProfiler
 
 # Seguridad para endpoints de administración
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
@@ -21,43 +25,103 @@ async def get_api_key(api_key: str = Depends(api_key_header)):
         )
     return api_key
 
-@router.post("/reload")
+# La API key se comprueba antes que cualquier otra dependencia: sin ella, 401 aunque el servicio se esté iniciando
+router = APIRouter(tags=["Administración"], dependencies=[Depends(get_api_key)])
+
+def shared(name: str):
+    """Servicio compartido; 503 si aún no está disponible (arranque en curso)"""
+    def dependency():
+        service = dependencies.get(name)
+        if service is None:
+            raise HTTPException(
+                status_code=503,
+                detail="El servicio se está iniciando, inténtelo de nuevo en unos segundos",
+                headers={"Retry-After": "5"}
+            )
+        return service
+    return dependency
+
+def faq_enabled():
+    """404 si las preguntas frecuentes están desactivadas: reintentar no lo arreglaría"""
+    if not FAQ_DIR:
+        raise HTTPException(
+            status_code=404,
+            detail="Las preguntas frecuentes están desactivadas (configure QA_FAQ_DIR)"
+        )
+
+def get_corpus(corpora: CorpusRegistry, name: Optional[str]) -> Corpus:
+    try:
+        return corpora.get(name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Corpus no encontrado: {name}")
+
+# Nombre de corpus opcional en la query (?corpus=...); por defecto el principal
+corpus_query = Query(None, pattern=CORPUS_NAME_RE.pattern, description="Corpus (por defecto el principal)")
+
+@router.post("/reload", status_code=202)
 def reload_resources(
-    context_manager: ContextManager = Depends(lambda: dependencies["context_manager"]),
-    model_manager: ModelManager = Depends(lambda: dependencies["model_manager"]),
-    cache: ResponseCache = Depends(lambda: dependencies["response_cache"]),
-    api_key: str = Depends(get_api_key)
+    corpora: CorpusRegistry = Depends(shared("corpora")),
+    model_manager: ModelManager = Depends(shared("model_manager"))
 ):
     """
     Recarga el contexto y el modelo
     
     Requiere API key de administrador en el header X-API-Key
+    
+    El contexto se recarga de inmediato. El modelo nuevo se carga en segundo
+    plano y sustituye al actual solo cuando supera una comprobación; mientras
+    tanto el servicio sigue respondiendo con el modelo actual. El estado de
+    la recarga se consulta en /reload/{job_id}.
     """
-    context_reloaded = context_manager.reload_context()
-    model_reloaded = model_manager.reload_model()
+    # Se recargan todos los corpus cargados
+    context_reloaded = all([corpus.context_manager.reload_context() for corpus in corpora.loaded()])
     
     # Limpiar caché después de recargar recursos
-    cache.clear()
+    for corpus in corpora.loaded():
+        corpus.cache.clear()
     
-    if not context_reloaded and not model_reloaded:
-        raise HTTPException(
-            status_code=500,
-            detail="Error al recargar los recursos"
-        )
+    def on_swap():
+        # Los contextos se pre-tokenizan con el tokenizador del modelo nuevo
+        corpora.set_tokenizer(model_manager.get_tokenizer())
+        for corpus in corpora.loaded():
+            corpus.cache.clear()
+        # Las preguntas frecuentes se vuelven a responder con el modelo nuevo
+        if "faq" in dependencies:
+            dependencies["faq"].invalidate()
+    
+    job = model_manager.reload_model(
+        WARMUP_QUESTION, corpora.get().context_manager.retrieve(WARMUP_QUESTION), on_swap=on_swap
+    )
     
     return {
         "context_reloaded": context_reloaded,
-        "model_reloaded": model_reloaded,
         "cache_cleared": True,
-        "status": "ok"
+        "model_reload": job,
+        "status": "accepted"
     }
 
+@router.get("/reload/{job_id}")
+def get_reload_status(
+    job_id: str,
+    model_manager: ModelManager = Depends(shared("model_manager"))
+):
+    """
+    Consulta el estado de una recarga del modelo
+    
+    Requiere API key de administrador en el header X-API-Key
+    
+    Estados: loading, checking, completed, failed
+    """
+    job = model_manager.get_reload_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Recarga no encontrada")
+    return job
+
 @router.post("/context")
 def update_context(
     req: ContextUpdateRequest,
-    context_manager: ContextManager = Depends(lambda: dependencies["context_manager"]),
-    cache: ResponseCache = Depends(lambda: dependencies["response_cache"]),
-    api_key: str = Depends(get_api_key)
+    corpus: Optional[str] = corpus_query,
+    corpora: CorpusRegistry = Depends(shared("corpora"))
 ):
     """
     Actualiza el contenido del contexto
@@ -65,8 +129,14 @@ def update_context(
     Requiere API key de administrador en el header X-API-Key
     
     - **context**: Nuevo texto de contexto
+    - **corpus**: Corpus a actualizar (query, opcional); si no existe se crea
     """
-    success = context_manager.update_context(req.context)
+    if corpus and corpora.path_for(corpus) is None:
+        target = corpora.create(corpus, req.context)
+        success = target is not None
+    else:
+        target = get_corpus(corpora, corpus)
+        success = target.context_manager.update_context(req.context)
     
     if not success:
         raise HTTPException(
@@ -75,31 +145,65 @@ def update_context(
         )
     
     # Limpiar caché después de actualizar contexto
-    cache.clear()
+    target.cache.clear()
     
     return {
         "status": "ok",
         "message": "Contexto actualizado correctamente",
+        "corpus": target.name,
         "context_size": len(req.context),
         "cache_cleared": True
     }
 
 @router.get("/metrics")
 def get_metrics(
-    metrics: MetricsManager = Depends(lambda: dependencies["metrics_manager"]),
-    api_key: str = Depends(get_api_key)
+    metrics: MetricsManager = Depends(shared("metrics_manager")),
+    corpora: CorpusRegistry = Depends(shared("corpora")),
+    feedback_store: FeedbackStore = Depends(shared("feedback_store"))
 ):
     """
     Obtiene métricas de uso del servicio
     
     Requiere API key de administrador en el header X-API-Key
     """
-    return metrics.get_metrics()
+    result = metrics.get_metrics()
+    result["cache"] = corpora.get().cache.get_stats()
+    result["corpora"] = corpora.get_stats()
+    result["feedback"] = feedback_store.get_stats()
+    result["logging"] = log_stats.get_stats(metrics.total_requests)
+    if "cache_snapshots" in dependencies:
+        result["cache_snapshots"] = dependencies["cache_snapshots"].get_stats()
+    if "faq" in dependencies:
+        result["faq"] = dependencies["faq"].get_stats()
+    return result
+
+@router.get("/metrics/prometheus", response_class=PlainTextResponse)
+def get_prometheus_metrics(
+    metrics: MetricsManager = Depends(shared("metrics_manager")),
+    corpora: CorpusRegistry = Depends(shared("corpora"))
+):
+    """
+    Métricas en el formato de texto de Prometheus, para un recolector local
+    
+    Requiere API key de administrador en el header X-API-Key
+    """
+    lines = [metrics.to_prometheus().rstrip("\n")]
+    # Aciertos y fallos de caché de los corpus cargados
+    caches = [(corpus.name, corpus.cache.get_stats()) for corpus in corpora.loaded()]
+    for name, kind, help_text in (
+        ("hits", "counter", "Preguntas respondidas desde la caché"),
+        ("misses", "counter", "Consultas a la caché sin respuesta guardada"),
+        ("entries", "gauge", "Respuestas guardadas en la caché")
+    ):
+        metric = f"qa_cache_{name}_total" if kind == "counter" else f"qa_cache_{name}"
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+        lines += [f'{metric}{{corpus="{corpus}"}} {stats[name] or 0}' for corpus, stats in caches]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
 
 @router.post("/reset-metrics")
 def reset_metrics(
-    metrics: MetricsManager = Depends(lambda: dependencies["metrics_manager"]),
-    api_key: str = Depends(get_api_key)
+    metrics: MetricsManager = Depends(shared("metrics_manager")),
+    corpora: CorpusRegistry = Depends(shared("corpora"))
 ):
     """
     Reinicia las métricas del servicio
@@ -107,20 +211,211 @@ def reset_metrics(
     Requiere API key de administrador en el header X-API-Key
     """
     metrics.reset()
+    log_stats.reset()
+    for corpus in corpora.loaded():
+        corpus.cache.reset_stats()
     return {"status": "ok", "message": "Métricas reiniciadas correctamente"}
 
 @router.post("/clear-cache")
 def clear_cache(
-    cache: ResponseCache = Depends(lambda: dependencies["response_cache"]),
-    api_key: str = Depends(get_api_key)
+    corpus: Optional[str] = corpus_query,
+    corpora: CorpusRegistry = Depends(shared("corpora"))
 ):
     """
     Limpia la caché de respuestas
     
     Requiere API key de administrador en el header X-API-Key
+    
+    - **corpus**: Corpus cuya caché limpiar (query, opcional); por defecto todas
     """
-    cache.clear()
+    if corpus and corpora.path_for(corpus) is None:
+        raise HTTPException(status_code=404, detail=f"Corpus no encontrado: {corpus}")
+    # Un corpus no cargado no tiene caché que limpiar: no se carga solo para esto
+    for target in corpora.loaded():
+        if not corpus or target.name == corpus:
+            target.cache.clear()
     return {"status": "ok", "message": "Caché limpiada correctamente"}
 
+@router.get("/feedback/summary")
+def feedback_summary(
+    corpus: Optional[str] = corpus_query,
+    order: str = Query("worst", pattern="^(worst|best|most|recent)$",
+                       description="worst/best: por tasa de utilidad, most: más votadas, recent: más recientes"),
+    min_votes: int = Query(1, ge=1),
+    limit: int = Query(50, ge=1, le=1000),
+    feedback_store: FeedbackStore = Depends(shared("feedback_store"))
+):
+    """
+    Utilidad agregada de las respuestas según el feedback recibido
+    
+    Requiere API key de administrador en el header X-API-Key
+    
+    Agrupa por pregunta (normalizada) y respuesta, sin recorrer el registro completo.
+    """
+    return {
+        "items": feedback_store.summary(corpus, limit, min_votes, order),
+        "pending": feedback_store.get_stats()["pending"]
+    }
+
+@router.get("/corpora")
+def list_corpora(
+    corpora: CorpusRegistry = Depends(shared("corpora"))
+):
+    """
+    Lista los corpus disponibles y los cargados en memoria
+    
+    Requiere API key de administrador en el header X-API-Key
+    """
+    return corpora.get_stats()
+
+@router.get("/faq", dependencies=[Depends(faq_enabled)])
+def get_faq(
+    corpus: Optional[str] = corpus_query,
+    corpora: CorpusRegistry = Depends(shared("corpora")),
+    faq: FaqTable = Depends(shared("faq"))
+):
+    """
+    Preguntas frecuentes precalculadas del corpus y estado de su tabla
+    
+    Requiere API key de administrador en el header X-API-Key
+    """
+    target = get_corpus(corpora, corpus)
+    return {"questions": faq.questions(target.name), **faq.get_stats(target.name)}
+
+@router.put("/faq", dependencies=[Depends(faq_enabled)])
+def update_faq(
+    req: FaqUpdateRequest,
+    corpus: Optional[str] = corpus_query,
+    corpora: CorpusRegistry = Depends(shared("corpora")),
+    faq: FaqTable = Depends(shared("faq"))
+):
+    """
+    Reemplaza la lista de preguntas frecuentes del corpus
+    
+    Requiere API key de administrador en el header X-API-Key
+    
+    Las respuestas se recalculan en segundo plano; mientras tanto las
+    preguntas se responden por la caché y el modelo.
+    """
+    target = get_corpus(corpora, corpus)
+    questions = faq.set_questions(target.name, req.questions)
+    return {"status": "ok", "questions": len(questions)}
+
+@router.post("/faq/seed", dependencies=[Depends(faq_enabled)])
+def seed_faq(
+    corpus: Optional[str] = corpus_query,
+    limit: int = Query(50, ge=1, le=1000, description="Preguntas a añadir como máximo"),
+    replace: bool = Query(False, description="Reemplazar la lista en vez de ampliarla"),
+    corpora: CorpusRegistry = Depends(shared("corpora")),
+    feedback_store: FeedbackStore = Depends(shared("feedback_store")),
+    faq: FaqTable = Depends(shared("faq"))
+):
+    """
+    Añade a las preguntas frecuentes las más consultadas según el historial
+    
+    Requiere API key de administrador en el header X-API-Key
+    
+    Usa los aciertos de la caché, el último snapshot de la caché (si está
+    activado) y las preguntas con más feedback.
+    """
+    target = get_corpus(corpora, corpus)
+    # Las más acertadas de la caché primero
+    entries = sorted(target.cache.export_entries(), key=lambda entry: entry[3], reverse=True)
+    candidates = [entry[1] for entry in entries]
+    if "cache_snapshots" in dependencies:
+        candidates += dependencies["cache_snapshots"].history(target.name)
+    candidates += feedback_store.top_questions(target.name, limit)
+    
+    current = [] if replace else faq.questions(target.name)
+    known = {normalize_question(question) for question in current}
+    added = []
+    for question in candidates:
+        key = normalize_question(question)
+        if key and key not in known:
+            known.add(key)
+            added.append(question)
+        if len(added) >= limit:
+            break
+    questions = faq.set_questions(target.name, current + added)
+    return {"status": "ok", "added": len(added), "questions": len(questions)}
+
+@router.post("/faq/rebuild", status_code=202, dependencies=[Depends(faq_enabled)])
+def rebuild_faq(
+    corpus: Optional[str] = corpus_query,
+    corpora: CorpusRegistry = Depends(shared("corpora")),
+    faq: FaqTable = Depends(shared("faq"))
+):
+    """
+    Vuelve a responder las preguntas frecuentes del corpus en segundo plano
+    
+    Requiere API key de administrador en el header X-API-Key
+    """
+    faq.schedule(get_corpus(corpora, corpus))
+    return {"status": "accepted"}
+
+@router.post("/profiling/start")
+def start_profiling(
+    mode: str = Query("cprofile", pattern="^(cprofile|torch)$", description="cprofile: funciones de Python, torch: operadores"),
+    requests: int = Query(50, ge=0, le=100000, description="Preguntas a perfilar (0 = sin límite)"),
+    seconds: float = Query(60, ge=0, le=3600, description="Duración máxima de la sesión (0 = sin límite)"),
+    sample_rate: float = Query(1.0, gt=0, le=1, description="Fracción de los lotes que se perfilan"),
+    profiler: InferenceProfiler = Depends(shared("profiler"))
+):
+    """
+    Perfila los próximos lotes de inferencia
+    
+    Requiere API key de administrador en el header X-API-Key
+    
+    La sesión termina al perfilar **requests** preguntas o al pasar **seconds**
+    segundos (lo primero que ocurra). El resultado se consulta en /profiling
+    y se descarga en /profiling/collapsed. Solo afecta al worker que recibe
+    la petición.
+    """
+    if not requests and not seconds:
+        raise HTTPException(status_code=422, detail="Indique un número de preguntas o una duración")
+    if not profiler.start(mode, requests, seconds, sample_rate):
+        raise HTTPException(status_code=409, detail="Ya hay una sesión de perfilado en curso")
+    return profiler.get_stats()
+
+@router.post("/profiling/stop")
+def stop_profiling(
+    profiler: InferenceProfiler = Depends(shared("profiler"))
+):
+    """
+    Termina la sesión de perfilado en curso (el resultado se conserva)
+    
+    Requiere API key de administrador en el header X-API-Key
+    """
+    profiler.stop()
+    return profiler.get_stats()
+
+@router.get("/profiling")
+def get_profiling(
+    limit: int = Query(30, ge=1, le=500),
+    profiler: InferenceProfiler = Depends(shared("profiler"))
+):
+    """
+    Estado de la sesión de perfilado y funciones con más tiempo acumulado (modo cprofile)
+    
+    Requiere API key de administrador en el header X-API-Key
+    """
+    return {**profiler.get_stats(), "top_functions": profiler.top_functions(limit)}
+
+@router.get("/profiling/collapsed", response_class=PlainTextResponse)
+def download_profile(
+    profiler: InferenceProfiler = Depends(shared("profiler"))
+):
+    """
+    Descarga el perfil acumulado como pilas colapsadas (flamegraph.pl, speedscope)
+    
+    Requiere API key de administrador en el header X-API-Key
+    
+    Una línea por pila: marcos separados por ";" y el tiempo en microsegundos.
+    """
+    return PlainTextResponse(
+        profiler.collapsed(),
+        headers={"Content-Disposition": f'attachment; filename="profile-{profiler.mode or "empty"}.collapsed"'}
+    )
+
 # Variable para almacenar dependencias (se inicializa en main.py)
 dependencies = {}
\ No newline at end of file
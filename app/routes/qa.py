@@ -1,32 +1,163 @@
 import time
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
-from app.config import logger, MAX_ANSWER_LENGTH, CONFIDENCE_THRESHOLD
-from app.models.question import QuestionRequest, AnswerResponse
+import asyncio
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
+from app.config import logger, CONFIDENCE_THRESHOLD
+from app.models.question import QuestionRequest, BatchQuestionRequest, AnswerResponse
 from app.models.feedback import FeedbackRequest
-from app.services.context import ContextManager
+from app.services.corpora import Corpus, CorpusRegistry, DEFAULT_CORPUS
+from app.services.feedback import FeedbackStore
 from app.services.model import ModelManager
-from app.services.cache import ResponseCache
 from app.services.metrics import MetricsManager
+from app.services.batching import BatchScheduler, OverloadedError, DeadlineExceededError
+from app.services.cache import CacheBackend
+from app.services.serialization import FastJSONResponse, dumps, merge, with_response_time
+from app.services.text import normalize_question
 
 router = APIRouter(tags=["Pregunta-Respuesta"])
 
-def clean_cache_task(cache: ResponseCache):
-    """Tarea para limpiar la caché periódicamente"""
-    cache.clean_expired()
+# Prefijo de las líneas correctas de /qa/batch
+_STATUS_OK = dumps({"status": 200})
 
-@router.post("/qa", response_model=AnswerResponse)
-def answer_question(
+def shared(name: str):
+    """Dependencia asíncrona: evita que FastAPI la resuelva en el threadpool"""
+    async def dependency():
+        service = dependencies.get(name)
+        if service is None:
+            # El modelo se carga en segundo plano durante el arranque
+            raise HTTPException(
+                status_code=503,
+                detail="El servicio se está iniciando, inténtelo de nuevo en unos segundos",
+                headers={"Retry-After": "5"}
+            )
+        return service
+    return dependency
+
+async def get_corpus(corpora: CorpusRegistry, name: Optional[str], hold: bool = True) -> Corpus:
+    """
+    Corpus solicitado (el principal si no se indica); 404 si no existe. Con
+    hold no se cierra aunque se descargue hasta que se llame a su release.
+    """
+    fetch = corpora.acquire if hold else corpora.get
+    try:
+        if corpora.is_loaded(name):
+            return fetch(name)
+        # La primera consulta carga y pre-tokeniza el corpus: fuera del bucle de eventos
+        return await asyncio.to_thread(fetch, name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Corpus no encontrado: {name}")
+
+def record_validation(request: Request, metrics: MetricsManager):
+    """Etapa de validación: desde que llega la petición hasta que empieza el endpoint"""
+    received_at = getattr(request.state, "received_at", None)
+    if received_at is not None:
+        metrics.record_stage("validation", time.perf_counter() - received_at)
+
+async def cached_answer(cache: CacheBackend, question: str) -> Optional[bytes]:
+    """Respuesta codificada de la caché; la compartida (SQLite) se consulta en un hilo para no bloquear el bucle"""
+    if cache.blocking:
+        return await asyncio.to_thread(cache.get_encoded, question)
+    return cache.get_encoded(question)
+
+def build_response(result: Dict[str, Any], context: str, process_time: float) -> Dict[str, Any]:
+    """Construye la respuesta de la API a partir del resultado del modelo"""
+    # Crear un fragmento de contexto para mostrar
+    start, end = max(0, result["start"] - 20), min(len(context), result["end"] + 20)
+    context_snippet = f"...{context[start:end]}..." if start > 0 or end < len(context) else context[start:end]
+    
+    return {
+        "answer": result["answer"],
+        "score": result["score"],
+        "start": result["start"],
+        "end": result["end"],
+        "context_snippet": context_snippet,
+        "response_time": process_time
+    }
+
+# Inferencias en curso por (corpus, pregunta normalizada, versión del contexto)
+_in_flight: Dict[Tuple[str, str, int], "asyncio.Task"] = {}
+
+async def _infer(
+    corpus: Corpus,
+    question: str,
+    batch_scheduler: BatchScheduler,
+    metrics: MetricsManager,
+    deadline: Optional[float]
+):
+    start_time = time.time()
+    # El modelo solo lee los pasajes más relevantes del contexto
+    fetch_start = time.perf_counter()
+    retrieved = corpus.context_manager.retrieve(question)
+    metrics.record_stage("context_fetch", time.perf_counter() - fetch_start)
+    
+    # La inferencia se agrupa con otras preguntas concurrentes y corre en el ejecutor del modelo
+    result = await asyncio.wrap_future(batch_scheduler.submit(question, retrieved, deadline))
+    if result["score"] < CONFIDENCE_THRESHOLD:
+        return result, None
+    
+    response = build_response(result, retrieved.document, time.time() - start_time)
+    # Guardar en caché (se descarta si el contexto cambió mientras tanto); en la compartida se
+    # escribe en segundo plano: la respuesta no espera a SQLite
+    if corpus.cache.blocking:
+        asyncio.get_running_loop().run_in_executor(None, corpus.cache.set, question, response, retrieved.version)
+    else:
+        corpus.cache.set(question, response, retrieved.version)
+    return result, response
+
+def answer_once(
+    corpus: Corpus,
+    question: str,
+    batch_scheduler: BatchScheduler,
+    metrics: MetricsManager,
+    deadline: Optional[float] = None
+) -> "asyncio.Task":
+    """
+    Inferencia de la pregunta compartida por todas las peticiones concurrentes
+    con la misma pregunta normalizada y versión del contexto: solo la primera
+    lanza el forward y guarda en caché, el resto espera su resultado.
+    
+    La tarea devuelve (resultado del modelo, respuesta de la API o None si
+    la confianza es baja). Si la cola de inferencia está llena o el plazo
+    vence antes de llegar al modelo, lanza OverloadedError o
+    DeadlineExceededError.
+    """
+    key = (corpus.name, normalize_question(question), corpus.context_manager.version)
+    task = _in_flight.get(key)
+    if task is not None:
+        metrics.record_coalesced()
+        return task
+    
+    # Es una tarea aparte: si la petición que la lanzó se cancela, las demás siguen esperándola
+    # (y retiene el corpus hasta terminar de guardar en su caché)
+    corpus.hold()
+    task = asyncio.ensure_future(_infer(corpus, question, batch_scheduler, metrics, deadline))
+    _in_flight[key] = task
+    
+    def done(_):
+        _in_flight.pop(key, None)
+        corpus.release()
+    
+    task.add_done_callback(done)
+    return task
+
+# response_model solo documenta: se devuelve FastJSONResponse, así que FastAPI no vuelve a validar
+# ni a serializar las respuestas, que se construyen aquí o vienen ya codificadas de la caché
+@router.post("/qa", response_model=AnswerResponse, response_class=FastJSONResponse)
+async def answer_question(
     req: QuestionRequest,
-    background_tasks: BackgroundTasks,
-    context_manager: ContextManager = Depends(lambda: dependencies["context_manager"]),
-    model_manager: ModelManager = Depends(lambda: dependencies["model_manager"]),
-    cache: ResponseCache = Depends(lambda: dependencies["response_cache"]),
-    metrics: MetricsManager = Depends(lambda: dependencies["metrics_manager"])
+    request: Request,
+    corpora: CorpusRegistry = Depends(shared("corpora")),
+    model_manager: ModelManager = Depends(shared("model_manager")),
+    metrics: MetricsManager = Depends(shared("metrics_manager")),
+    batch_scheduler: BatchScheduler = Depends(shared("batch_scheduler"))
 ):
     """
     Responde a una pregunta basada en el contexto cargado
     
     - **question**: La pregunta en lenguaje natural
+    - **corpus**: Corpus en el que buscar (opcional, por defecto el principal)
     
     Devuelve:
     - **answer**: La respuesta extraída del contexto
@@ -36,88 +167,232 @@ def answer_question(
     - **context_snippet**: Fragmento del contexto que contiene la respuesta
     - **response_time**: Tiempo de procesamiento en segundos
     """
+    record_validation(request, metrics)
     start_time = time.time()
+    # El plazo cuenta desde la llegada de la petición, no desde que se encola
+    deadline = time.monotonic() + batch_scheduler.deadline if batch_scheduler.deadline else None
+    corpus = await get_corpus(corpora, req.corpus)
+    try:
+        return await _answer(req, corpus, model_manager, metrics, batch_scheduler, start_time, deadline)
+    finally:
+        corpus.release()
+
+async def _answer(
+    req: QuestionRequest,
+    corpus: Corpus,
+    model_manager: ModelManager,
+    metrics: MetricsManager,
+    batch_scheduler: BatchScheduler,
+    start_time: float,
+    deadline: Optional[float]
+):
+    cache = corpus.cache
     
-    # Limpiar la caché en segundo plano
-    background_tasks.add_task(clean_cache_task, cache)
+    # Preguntas frecuentes precalculadas y después la caché (se sirven siempre, aunque el servicio esté saturado)
+    lookup_start = time.perf_counter()
+    faq = dependencies.get("faq")
+    faq_body = faq.lookup(corpus, req.question) if faq is not None else None
+    if faq_body is not None:
+        metrics.record_stage("cache_lookup", time.perf_counter() - lookup_start)
+        logger.info("Respuesta precalculada para: %s", req.question, extra={"log_type": "faq_hit"})
+        process_time = time.time() - start_time
+        metrics.record_request(True, process_time, "faq")
+        return FastJSONResponse(with_response_time(faq_body, process_time))
     
-    # Verificar si hay respuesta en caché
-    cached_response = cache.get(req.question)
-    if cached_response:
-        logger.info(f"Respuesta encontrada en caché para: {req.question}")
+    # La entrada llega ya codificada: solo se le añade el tiempo de esta petición
+    cached_body = await cached_answer(cache, req.question)
+    metrics.record_stage("cache_lookup", time.perf_counter() - lookup_start)
+    if cached_body is not None:
+        logger.info("Respuesta encontrada en caché para: %s", req.question, extra={"log_type": "cache_hit"})
         process_time = time.time() - start_time
-        metrics.record_request(True, process_time)
-        cached_response["response_time"] = process_time
-        return cached_response
+        metrics.record_request(True, process_time, "hit")
+        return FastJSONResponse(with_response_time(cached_body, process_time))
     
-    qa_pipeline = model_manager.get_pipeline()
-    if qa_pipeline is None:
+    if not model_manager.is_available():
         logger.error("Solicitud de respuesta con modelo no disponible")
-        metrics.record_request(False, time.time() - start_time)
+        metrics.record_request(False, time.time() - start_time, "error")
         raise HTTPException(
             status_code=503,
             detail="El servicio de respuestas no está disponible en este momento"
         )
     
-    context = context_manager.get_context()
     question = req.question
     
-    logger.info(f"Pregunta recibida: {question}")
+    logger.info("Pregunta recibida: %s", question, extra={"log_type": "question"})
     
     try:
-        # Configurar parámetros adicionales del pipeline
-        result = qa_pipeline(
-            question=question, 
-            context=context,
-            handle_impossible_answer=True,
-            max_answer_len=MAX_ANSWER_LENGTH
-        )
+        # Las peticiones simultáneas con la misma pregunta comparten una sola inferencia
+        result, response = await asyncio.shield(answer_once(corpus, question, batch_scheduler, metrics, deadline))
         
         # Validar la confianza de la respuesta
-        if result["score"] < CONFIDENCE_THRESHOLD:
-            logger.warning(f"Respuesta con baja confianza: {result['score']:.4f}")
-            metrics.record_request(False, time.time() - start_time)
+        if response is None:
+            logger.warning("Respuesta con baja confianza: %.4f", result["score"], extra={"log_type": "low_confidence"})
+            metrics.record_request(False, time.time() - start_time, "low_confidence")
             raise HTTPException(
                 status_code=404,
                 detail="No se encontró una respuesta con suficiente confianza"
             )
         
-        # Crear un fragmento de contexto para mostrar
-        start, end = max(0, result["start"] - 20), min(len(context), result["end"] + 20)
-        context_snippet = f"...{context[start:end]}..." if start > 0 or end < len(context) else context[start:end]
-        
         process_time = time.time() - start_time
         
-        response = {
-            "answer": result["answer"],
-            "score": result["score"],
-            "start": result["start"],
-            "end": result["end"],
-            "context_snippet": context_snippet,
-            "response_time": process_time
-        }
-        
-        # Guardar en caché
-        cache.set(question, response)
-        
-        logger.info(f"Respuesta encontrada: '{result['answer']}' (score: {result['score']:.4f}, time: {process_time:.4f}s)")
-        metrics.record_request(True, process_time)
-        return response
+        logger.info(
+            "Respuesta encontrada: '%s' (score: %.4f, time: %.4fs)",
+            result["answer"], result["score"], process_time,
+            extra={"log_type": "answer"}
+        )
+        metrics.record_request(True, process_time, "miss")
+        return FastJSONResponse({**response, "response_time": process_time})
         
     except HTTPException:
         # Re-lanzar excepciones HTTP ya manejadas
         raise
+    except (OverloadedError, DeadlineExceededError) as e:
+        # Servicio saturado: se rechaza rápido en vez de acumular espera
+        metrics.record_request(False, time.time() - start_time, "shed")
+        logger.warning("Pregunta rechazada por sobrecarga: %s", e, extra={"log_type": "shed"})
+        raise HTTPException(
+            status_code=503,
+            detail="El servicio está saturado, inténtelo de nuevo en unos segundos",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         process_time = time.time() - start_time
-        metrics.record_request(False, process_time)
+        metrics.record_request(False, process_time, "error")
         logger.error(f"Error al procesar la pregunta: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"Error al procesar la pregunta: {str(e)}"
         )
 
+@router.post("/qa/batch")
+async def answer_questions_batch(
+    req: BatchQuestionRequest,
+    request: Request,
+    corpora: CorpusRegistry = Depends(shared("corpora")),
+    model_manager: ModelManager = Depends(shared("model_manager")),
+    metrics: MetricsManager = Depends(shared("metrics_manager")),
+    batch_scheduler: BatchScheduler = Depends(shared("batch_scheduler"))
+):
+    """
+    Responde varias preguntas en una sola petición
+    
+    - **questions**: Lista de preguntas en lenguaje natural
+    - **corpus**: Corpus en el que buscar (opcional, por defecto el principal)
+    
+    Devuelve un flujo NDJSON con una línea por pregunta, en el orden en que
+    se resuelven. Cada línea incluye **index** (posición en la lista) y
+    **status**; si es 200 trae los mismos campos que /qa y si no, **detail**
+    (y **retry_after** si el servicio está saturado, status 503). Las
+    preguntas repetidas se resuelven una sola vez.
+    """
+    record_validation(request, metrics)
+    if not model_manager.is_available():
+        logger.error("Solicitud de respuestas en lote con modelo no disponible")
+        raise HTTPException(
+            status_code=503,
+            detail="El servicio de respuestas no está disponible en este momento"
+        )
+    
+    # Solo se comprueba que exista (404 antes de empezar el flujo); se retiene al generarlo
+    await get_corpus(corpora, req.corpus, hold=False)
+    
+    # Agrupar preguntas equivalentes (misma forma normalizada)
+    groups: Dict[str, List[int]] = {}
+    for index, question in enumerate(req.questions):
+        groups.setdefault(normalize_question(question), []).append(index)
+    
+    logger.info("Lote recibido: %d preguntas (%d distintas)", len(req.questions), len(groups), extra={"log_type": "batch"})
+    
+    def lines(indexes: List[int], payload: Dict[str, Any]) -> bytes:
+        return encoded_lines(indexes, dumps(payload))
+    
+    def encoded_lines(indexes: List[int], payload: bytes) -> bytes:
+        # Las respuestas de la caché y de la tabla de preguntas frecuentes se empalman sin decodificarlas
+        return b"".join(
+            merge(dumps({"index": i, "question": req.questions[i]}), payload) + b"\n"
+            for i in indexes
+        )
+    
+    async def stream(corpus: Corpus):
+        start_time = time.time()
+        pending = {}
+        misses = deque()
+        faq = dependencies.get("faq")
+        
+        for indexes in groups.values():
+            question = req.questions[indexes[0]]
+            lookup_start = time.perf_counter()
+            faq_body = faq.lookup(corpus, question) if faq is not None else None
+            if faq_body is not None:
+                metrics.record_stage("cache_lookup", time.perf_counter() - lookup_start)
+                process_time = time.time() - start_time
+                metrics.record_request(True, process_time, "faq")
+                yield encoded_lines(indexes, merge(_STATUS_OK, with_response_time(faq_body, process_time)))
+                continue
+            
+            cached_body = await cached_answer(corpus.cache, question)
+            metrics.record_stage("cache_lookup", time.perf_counter() - lookup_start)
+            if cached_body is not None:
+                process_time = time.time() - start_time
+                metrics.record_request(True, process_time, "hit")
+                yield encoded_lines(indexes, merge(_STATUS_OK, with_response_time(cached_body, process_time)))
+                continue
+            
+            misses.append(indexes)
+        
+        # Solo unos pocos lotes en vuelo a la vez: un lote grande no llena la cola de inferencia
+        window = batch_scheduler.max_batch_size * 2
+        while misses or pending:
+            while misses and len(pending) < window:
+                indexes = misses.popleft()
+                pending[answer_once(corpus, req.questions[indexes[0]], batch_scheduler, metrics)] = indexes
+            
+            # Las respuestas del modelo se emiten a medida que terminan
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                indexes = pending.pop(task)
+                process_time = time.time() - start_time
+                try:
+                    result, response = task.result()
+                except (OverloadedError, DeadlineExceededError) as e:
+                    metrics.record_request(False, process_time, "shed")
+                    yield lines(indexes, {"status": 503, "detail": str(e), "retry_after": e.retry_after})
+                    continue
+                except Exception as e:
+                    metrics.record_request(False, process_time, "error")
+                    logger.error(f"Error al procesar la pregunta: {str(e)}", exc_info=True)
+                    yield lines(indexes, {"status": 500, "detail": f"Error al procesar la pregunta: {str(e)}"})
+                    continue
+                
+                if response is None:
+                    metrics.record_request(False, process_time, "low_confidence")
+                    yield lines(indexes, {"status": 404, "detail": "No se encontró una respuesta con suficiente confianza"})
+                    continue
+                
+                metrics.record_request(True, process_time, "miss")
+                yield lines(indexes, {"status": 200, **response, "response_time": process_time})
+    
+    async def holding_corpus():
+        # El corpus se retiene dentro del generador: si el flujo nunca llega a ejecutarse no queda retenido
+        try:
+            corpus = await get_corpus(corpora, req.corpus)
+        except HTTPException as e:
+            # Se borró entre la comprobación y el inicio del flujo
+            yield lines(list(range(len(req.questions))), {"status": e.status_code, "detail": e.detail})
+            return
+        try:
+            async for chunk in stream(corpus):
+                yield chunk
+        finally:
+            corpus.release()
+    
+    return StreamingResponse(holding_corpus(), media_type="application/x-ndjson")
+
 @router.post("/feedback")
-def submit_feedback(feedback: FeedbackRequest):
+async def submit_feedback(
+    feedback: FeedbackRequest,
+    feedback_store: FeedbackStore = Depends(shared("feedback_store"))
+):
     """
     Envía retroalimentación sobre una respuesta
     
@@ -125,20 +400,21 @@ def submit_feedback(feedback: FeedbackRequest):
     - **answer**: La respuesta proporcionada
     - **is_helpful**: Si la respuesta fue útil
     - **comments**: Comentarios adicionales (opcional)
+    - **corpus**: Corpus de la pregunta (opcional)
     """
-    try:
-        # Registrar el feedback en un archivo
-        with open("feedback.log", "a", encoding="utf-8") as f:
-            f.write(f"{time.time()},{feedback.question},{feedback.answer},{feedback.is_helpful},{feedback.comments or ''}\n")
-        
-        logger.info(f"Feedback recibido: pregunta='{feedback.question}', útil={feedback.is_helpful}")
-        return {"status": "ok", "message": "Feedback registrado correctamente"}
-    except Exception as e:
-        logger.error(f"Error al registrar feedback: {str(e)}", exc_info=True)
+    # Solo se encola: el registro se escribe por lotes en segundo plano
+    if not feedback_store.submit(
+        feedback.question, feedback.answer, feedback.is_helpful, feedback.comments, feedback.corpus or DEFAULT_CORPUS
+    ):
+        logger.warning("Cola de feedback llena, se descarta el registro")
         raise HTTPException(
-            status_code=500,
-            detail="Error al procesar el feedback"
+            status_code=503,
+            detail="No se pudo registrar el feedback en este momento",
+            headers={"Retry-After": "5"}
         )
+    
+    logger.info("Feedback recibido: pregunta='%s', útil=%s", feedback.question, feedback.is_helpful, extra={"log_type": "feedback"})
+    return {"status": "ok", "message": "Feedback registrado correctamente"}
 
 # Variable para almacenar dependencias (se inicializa en main.py)
 dependencies = {}
\ No newline at end of file
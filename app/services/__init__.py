@@ -2,5 +2,6 @@ from app.services.context import ContextManager
 from app.services.model import ModelManager
 from app.services.cache import ResponseCache
 from app.services.metrics import MetricsManager
+from app.services.batching import BatchScheduler
 
-__all__ = ['ContextManager', 'ModelManager', 'ResponseCache', 'MetricsManager']
\ No newline at end of file
+__all__ = ['ContextManager', 'ModelManager', 'ResponseCache', 'MetricsManager', 'BatchScheduler']
\ No newline at end of file
@@ -0,0 +1,57 @@
+from pathlib import Path
+from typing import Tuple
+from app.config import logger
+
+# torch: pesos originales (fp32 en CPU)
+# torch-int8: cuantización dinámica de las capas lineales (solo CPU)
+# onnx: modelo exportado a ONNX y ejecutado con ONNX Runtime (requiere optimum[onnxruntime])
+BACKENDS = ("torch", "torch-int8", "onnx")
+
+def load_qa_model(
+    model_name: str,
+    backend: str = "torch",
+    device: str = "cpu",
+    num_threads: int = 0,
+    onnx_dir: str = ""
+) -> Tuple[object, object]:
+    """Carga (modelo, tokenizador) de preguntas y respuestas para el backend indicado"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend desconocido: {backend} (opciones: {', '.join(BACKENDS)})")
+    if backend != "torch" and device != "cpu":
+        raise ValueError(f"El backend {backend} solo está disponible en CPU")
+    
+    import torch
+    from transformers import AutoModelForQuestionAnswering, AutoTokenizer
+    
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    
+    if backend == "onnx":
+        return _load_onnx(model_name, num_threads, onnx_dir), tokenizer
+    
+    model = AutoModelForQuestionAnswering.from_pretrained(model_name).eval()
+    if backend == "torch-int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        logger.info(f"Modelo cuantizado a int8 (capas lineales): {model_name}")
+    return model, tokenizer
+
+def _load_onnx(model_name: str, num_threads: int, onnx_dir: str):
+    try:
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForQuestionAnswering
+    except ImportError as e:
+        raise RuntimeError("El backend onnx requiere instalar optimum[onnxruntime]") from e
+    
+    session_options = onnxruntime.SessionOptions()
+    if num_threads > 0:
+        session_options.intra_op_num_threads = num_threads
+    
+    # Si hay una exportación previa se reutiliza; si no, se exporta (y se guarda si se indicó carpeta)
+    if onnx_dir and Path(onnx_dir, "model.onnx").exists():
+        return ORTModelForQuestionAnswering.from_pretrained(onnx_dir, session_options=session_options)
+    
+    logger.info(f"Exportando {model_name} a ONNX...")
+    model = ORTModelForQuestionAnswering.from_pretrained(model_name, export=True, session_options=session_options)
+    if onnx_dir:
+        model.save_pretrained(onnx_dir)
+        logger.info(f"Modelo ONNX guardado en {onnx_dir}")
+    return model
@@ -0,0 +1,212 @@
+import math
+import time
+import threading
+from concurrent.futures import Future
+from queue import Queue, Empty, Full
+from typing import Dict, Any, List, Optional
+from app.config import logger
+from app.services.retrieval import RetrievedContext
+
+class OverloadedError(RuntimeError):
+    """La cola de inferencia está llena: la pregunta se rechaza sin llegar al modelo"""
+    
+    def __init__(self, retry_after: int):
+        super().__init__("La cola de inferencia está llena")
+        self.retry_after = retry_after
+
+class DeadlineExceededError(RuntimeError):
+    """La pregunta caducó esperando en la cola y se descartó antes de llegar al modelo"""
+    
+    def __init__(self, retry_after: int):
+        super().__init__("La pregunta superó su tiempo máximo de espera")
+        self.retry_after = retry_after
+
+class _PendingQuestion:
+    __slots__ = ("question", "context", "future", "enqueued_at", "deadline")
+    
+    def __init__(self, question: str, context: RetrievedContext, deadline: Optional[float]):
+        self.question = question
+        self.context = context
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+        self.deadline = deadline
+
+class BatchScheduler:
+    """
+    Agrupa preguntas concurrentes y las ejecuta en el modelo como un único lote.
+    
+    La cola admite como mucho max_queue preguntas (0 = sin límite): con la
+    cola llena submit lanza OverloadedError de inmediato. Las preguntas cuyo
+    plazo vence mientras esperan se descartan con DeadlineExceededError sin
+    gastar inferencia en ellas.
+    """
+    
+    def __init__(
+        self,
+        model_manager,
+        metrics_manager,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        max_queue: int = 0,
+        deadline_ms: float = 0
+    ):
+        self.model_manager = model_manager
+        self.metrics_manager = metrics_manager
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.max_queue = max(0, max_queue)
+        self.deadline = max(0.0, deadline_ms) / 1000
+        # Duración media de un lote (media móvil), para estimar Retry-After
+        self._batch_seconds = 0.0
+        self._queue: "Queue[_PendingQuestion]" = Queue(maxsize=self.max_queue)
+        # Un lote en vuelo por hilo de inferencia; mientras tanto las preguntas se acumulan en la cola
+        self._free_workers = threading.Semaphore(model_manager.inference_workers)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="qa-batch-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Planificador de lotes iniciado (max_batch_size={self.max_batch_size}, max_wait_ms={max_wait_ms}, "
+            f"max_queue={self.max_queue or 'sin límite'}, deadline_ms={deadline_ms or 'sin plazo'})"
+        )
+    
+    def submit(self, question: str, context: RetrievedContext, deadline: Optional[float] = None) -> Future:
+        """
+        Encola una pregunta y devuelve un Future con su resultado.
+        
+        deadline es el instante (time.monotonic) a partir del cual ya no vale
+        la pena responder; por defecto, ahora más el plazo configurado.
+        """
+        if self._stopped.is_set():
+            raise RuntimeError("El planificador de lotes está detenido")
+        if deadline is None and self.deadline:
+            deadline = time.monotonic() + self.deadline
+        item = _PendingQuestion(question, context, deadline)
+        try:
+            self._queue.put_nowait(item)
+        except Full:
+            self.metrics_manager.record_shed("queue_full")
+            raise OverloadedError(self.retry_after())
+        self.metrics_manager.record_queue_depth(self._queue.qsize())
+        return item.future
+    
+    def submit_when_free(self, question: str, context: RetrievedContext, attempts: int = 3) -> Future:
+        """
+        submit para tareas en segundo plano (recalentamiento, preguntas
+        frecuentes): si la cola está llena espera lo estimado y lo reintenta;
+        tras attempts intentos lanza OverloadedError. Bloquea el hilo que la llama.
+        """
+        for attempt in range(attempts):
+            try:
+                return self.submit(question, context)
+            except OverloadedError as e:
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(e.retry_after)
+    
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+    
+    def retry_after(self) -> int:
+        """Segundos estimados hasta que se vacíe la cola actual"""
+        batches = self._queue.qsize() / self.max_batch_size / max(1, self.model_manager.inference_workers)
+        return max(1, math.ceil(batches * self._batch_seconds))
+    
+    def answer(self, question: str, context: RetrievedContext) -> Dict[str, Any]:
+        """Encola una pregunta y espera su resultado"""
+        return self.submit(question, context).result()
+    
+    def stop(self):
+        self._stopped.set()
+        self._thread.join(timeout=5)
+    
+    def _collect_batch(self) -> List[_PendingQuestion]:
+        try:
+            first = self._queue.get(timeout=0.5)
+        except Empty:
+            return []
+        
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    # La ventana terminó: solo se toman las preguntas que ya esperan
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        self.metrics_manager.record_queue_depth(self._queue.qsize())
+        return self._drop_expired(batch)
+    
+    def _drop_expired(self, batch: List[_PendingQuestion]) -> List[_PendingQuestion]:
+        # El cliente ya no espera estas respuestas: no se gasta inferencia en ellas
+        now = time.monotonic()
+        alive = []
+        for item in batch:
+            if item.deadline is not None and now >= item.deadline:
+                self.metrics_manager.record_shed("deadline")
+                item.future.set_exception(DeadlineExceededError(self.retry_after()))
+            else:
+                alive.append(item)
+        return alive
+    
+    def _run(self):
+        while not self._stopped.is_set():
+            if not self._free_workers.acquire(timeout=0.5):
+                continue
+            batch = self._collect_batch()
+            if batch:
+                self._dispatch(batch)
+            else:
+                self._free_workers.release()
+        
+        # Rechazar lo que haya quedado pendiente al detenerse
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except Empty:
+                break
+            item.future.set_exception(RuntimeError("El planificador de lotes está detenido"))
+    
+    def _dispatch(self, batch: List[_PendingQuestion]):
+        started = time.monotonic()
+        self.metrics_manager.record_batch(
+            len(batch), [started - item.enqueued_at for item in batch]
+        )
+        
+        # Segundos de cada etapa del modelo (tokenization, forward, postprocess) para este lote
+        timings: Dict[str, float] = {}
+        try:
+            future = self.model_manager.submit_batch(
+                [item.question for item in batch],
+                [item.context for item in batch],
+                timings
+            )
+        except Exception as e:
+            self._free_workers.release()
+            self._fail(batch, e)
+            return
+        future.add_done_callback(lambda done: self._complete(batch, done, started, timings))
+    
+    def _complete(self, batch: List[_PendingQuestion], done: Future, started: float, timings: Dict[str, float]):
+        self._free_workers.release()
+        elapsed = time.monotonic() - started
+        self._batch_seconds = elapsed if not self._batch_seconds else 0.8 * self._batch_seconds + 0.2 * elapsed
+        try:
+            results = done.result()
+        except Exception as e:
+            self._fail(batch, e)
+            return
+        
+        for stage, seconds in timings.items():
+            self.metrics_manager.record_stage(stage, seconds)
+        for item, result in zip(batch, results):
+            item.future.set_result(result)
+        logger.debug("Lote de %d preguntas procesado en %.4fs", len(batch), time.monotonic() - started, extra={"log_type": "inference_batch"})
+    
+    def _fail(self, batch: List[_PendingQuestion], error: Exception):
+        logger.error(f"Error al procesar un lote de {len(batch)} preguntas: {str(error)}", exc_info=error)
+        for item in batch:
+            item.future.set_exception(error)
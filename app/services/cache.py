@@ -1,33 +1,331 @@
 import time
-from typing import Dict, Any, Optional
+import random
+import threading
+import zlib
+from collections import OrderedDict, defaultdict
+from typing import Dict, Any, List, Optional, Set, Tuple
+from app.services.serialization import encode_response, loads
+from app.services.text import normalize_question
 
-class ResponseCache:
-    def __init__(self, timeout: int = 3600):
-        self.cache = {}
-        self.timeout = timeout
+_MERSENNE_PRIME = (1 << 61) - 1
+
+class MinHashIndex:
+    """Índice LSH (MinHash sobre n-gramas de caracteres) para encontrar preguntas casi idénticas"""
+    
+    def __init__(self, threshold: float = 0.75, num_perm: int = 32, bands: int = 8, ngram: int = 3):
+        self.threshold = threshold
+        self.ngram = ngram
+        self.rows = num_perm // bands
+        # Semilla fija: las firmas deben ser estables entre procesos
+        rng = random.Random(1994)
+        self._permutations = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(self.rows * bands)
+        ]
+        self._buckets: List[Dict[Tuple[int, ...], Set[str]]] = [defaultdict(set) for _ in range(bands)]
+        self._entries: Dict[str, Tuple[Set[int], List[Tuple[int, ...]]]] = {}
+    
+    def _shingles(self, text: str) -> Set[int]:
+        padded = f" {text} "
+        return {
+            zlib.crc32(padded[i:i + self.ngram].encode("utf-8"))
+            for i in range(max(1, len(padded) - self.ngram + 1))
+        }
+    
+    def _bands(self, shingles: Set[int]) -> List[Tuple[int, ...]]:
+        signature = [min((a * s + b) % _MERSENNE_PRIME for s in shingles) for a, b in self._permutations]
+        return [tuple(signature[i:i + self.rows]) for i in range(0, len(signature), self.rows)]
+    
+    def add(self, key: str):
+        if key in self._entries:
+            return
+        shingles = self._shingles(key)
+        bands = self._bands(shingles)
+        self._entries[key] = (shingles, bands)
+        for buckets, band in zip(self._buckets, bands):
+            buckets[band].add(key)
+    
+    def remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for buckets, band in zip(self._buckets, entry[1]):
+            bucket = buckets[band]
+            bucket.discard(key)
+            if not bucket:
+                del buckets[band]
+    
+    def clear(self):
+        for buckets in self._buckets:
+            buckets.clear()
+        self._entries.clear()
+    
+    def query(self, key: str) -> Optional[str]:
+        """Devuelve la clave indexada más parecida si su similitud de Jaccard supera el umbral"""
+        shingles = self._shingles(key)
+        candidates: Set[str] = set()
+        for buckets, band in zip(self._buckets, self._bands(shingles)):
+            candidates.update(buckets.get(band, ()))
+        
+        best_key, best_similarity = None, self.threshold
+        for candidate in candidates:
+            other = self._entries[candidate][0]
+            similarity = len(shingles & other) / len(shingles | other)
+            if similarity >= best_similarity:
+                best_key, best_similarity = candidate, similarity
+        return best_key
+
+class CacheBackend:
+    """
+    Interfaz de las cachés de respuestas de un corpus.
+    
+    ResponseCache la implementa en la memoria del proceso y
+    SharedResponseCache en un almacén compartido por todos los workers del
+    nodo. invalidate se llama cada vez que cambia el contexto del corpus.
+    
+    Las respuestas se guardan ya codificadas en JSON (sin response_time):
+    get_encoded las devuelve tal cual para enviarlas sin volver a
+    serializarlas, y get devuelve una copia decodificada, de modo que quien
+    la modifique no altera la entrada guardada.
+    """
+    
+    # Versión del contexto de las respuestas guardadas
+    version = 0
+    # Bytes que ocupa la caché en la memoria de este proceso
+    size_bytes = 0
+    # Si sus operaciones pueden bloquear (disco, locks entre procesos): desde el bucle de eventos
+    # se llaman en un hilo
+    blocking = False
+    
+    def get_encoded(self, question: str) -> Optional[bytes]:
+        raise NotImplementedError
     
     def get(self, question: str) -> Optional[Dict[str, Any]]:
-        if question in self.cache:
-            timestamp, response = self.cache[question]
-            if time.time() - timestamp < self.timeout:
-                return response
-            else:
-                # Caché expirado
-                del self.cache[question]
-        return None
-    
-    def set(self, question: str, response: Dict[str, Any]):
-        self.cache[question] = (time.time(), response)
+        body = self.get_encoded(question)
+        return loads(body) if body is not None else None
+    
+    def set(self, question: str, response: Dict[str, Any], version: Optional[int] = None):
+        raise NotImplementedError
+    
+    def contains(self, question: str) -> bool:
+        raise NotImplementedError
+    
+    def clear(self):
+        raise NotImplementedError
+    
+    def invalidate(self, version: int):
+        raise NotImplementedError
+    
+    def clean_expired(self):
+        pass
+    
+    def export_entries(self) -> List[Tuple[str, str, float, int, Dict[str, Any]]]:
+        raise NotImplementedError
+    
+    def import_entries(self, entries: List[Tuple[str, str, float, int, Dict[str, Any]]]) -> int:
+        raise NotImplementedError
+    
+    def reset_stats(self):
+        raise NotImplementedError
+    
+    def get_stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+    
+    def close(self):
+        """Libera los recursos locales (al descargar el corpus); no borra lo compartido"""
+        pass
+
+class ResponseCache(CacheBackend):
+    """
+    Caché de respuestas acotada por número de entradas y por bytes,
+    con expulsión LRU y expiración por TTL.
+    
+    Las preguntas se normalizan (tildes, mayúsculas, puntuación y espacios)
+    antes de usarse como clave; opcionalmente se sirven también preguntas
+    casi idénticas a una ya cacheada.
+    """
+    
+    def __init__(
+        self,
+        timeout: int = 3600,
+        max_entries: int = 1000,
+        max_bytes: int = 16 * 1024 * 1024,
+        fuzzy_match: bool = False,
+        fuzzy_threshold: float = 0.75
+    ):
+        # Orden LRU: la entrada menos usada recientemente está al principio
+        # clave -> (timestamp, respuesta codificada, bytes, pregunta original)
+        self.cache: "OrderedDict[str, Tuple[float, bytes, int, str]]" = OrderedDict()
+        # Aciertos por entrada: con ellos se eligen las preguntas a recalentar tras un reinicio
+        self._hit_counts: Dict[str, int] = {}
+        # Orden de inserción: como todas comparten el mismo TTL, también es el orden de expiración
+        self._expiry_order: "OrderedDict[str, float]" = OrderedDict()
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        # Versión del contexto de las respuestas guardadas; las de versiones anteriores se descartan
+        self.version = 0
+        self._similar = MinHashIndex(fuzzy_threshold) if fuzzy_match else None
+        self._lock = threading.Lock()
+        self.reset_stats()
+    
+    def get_encoded(self, question: str) -> Optional[bytes]:
+        key = normalize_question(question)
+        with self._lock:
+            self._evict_expired(time.time())
+            entry = self.cache.get(key)
+            if entry is None and self._similar is not None:
+                similar_key = self._similar.query(key)
+                if similar_key is not None:
+                    key, entry = similar_key, self.cache[similar_key]
+                    self.fuzzy_hits += 1
+            if entry is None:
+                self.misses += 1
+                return None
+            self.cache.move_to_end(key)
+            self.hits += 1
+            self._hit_counts[key] += 1
+            return entry[1]
+    
+    def set(self, question: str, response: Dict[str, Any], version: Optional[int] = None):
+        key = normalize_question(question)
+        body = encode_response(response)
+        size = self._estimate_size(key, body)
+        if size > self.max_bytes:
+            return
+        
+        with self._lock:
+            if version is not None and version < self.version:
+                # Respuesta calculada con un contexto que ya cambió
+                return
+            now = time.time()
+            self._evict_expired(now)
+            self._add(key, now, body, size, question, self._hit_counts.get(key, 0))
+    
+    def contains(self, question: str) -> bool:
+        """Si la pregunta exacta (normalizada) está en caché, sin contar acierto ni fallo"""
+        key = normalize_question(question)
+        with self._lock:
+            entry = self.cache.get(key)
+            return entry is not None and time.time() - entry[0] < self.timeout
+    
+    def export_entries(self) -> List[Tuple[str, str, float, int, Dict[str, Any]]]:
+        """Entradas vigentes (clave, pregunta, timestamp, aciertos, respuesta) de la menos a la más usada"""
+        with self._lock:
+            self._evict_expired(time.time())
+            entries = [
+                (key, question, timestamp, self._hit_counts[key], body)
+                for key, (timestamp, body, _, question) in self.cache.items()
+            ]
+        # Se decodifican fuera del lock
+        return [(key, question, timestamp, hits, loads(body)) for key, question, timestamp, hits, body in entries]
+    
+    def import_entries(self, entries: List[Tuple[str, str, float, int, Dict[str, Any]]]) -> int:
+        """Restaura entradas exportadas con export_entries; se descartan las ya expiradas"""
+        now = time.time()
+        restored = 0
+        with self._lock:
+            for key, question, timestamp, hits, response in entries:
+                if now - timestamp >= self.timeout:
+                    continue
+                body = encode_response(response)
+                self._add(key, timestamp, body, self._estimate_size(key, body), question, hits)
+                restored += 1
+            # Se restauran en orden de inserción: el orden de expiración se rehace por timestamp
+            self._expiry_order = OrderedDict(sorted(self._expiry_order.items(), key=lambda item: item[1]))
+        return restored
     
     def clear(self):
-        self.cache.clear()
+        with self._lock:
+            self.cache.clear()
+            self._hit_counts.clear()
+            self._expiry_order.clear()
+            self.size_bytes = 0
+            if self._similar is not None:
+                self._similar.clear()
+    
+    def invalidate(self, version: int):
+        """Descarta las respuestas calculadas con versiones del contexto anteriores a version"""
+        with self._lock:
+            if version <= self.version:
+                return
+            self.version = version
+            self.invalidations += 1
+            self.cache.clear()
+            self._hit_counts.clear()
+            self._expiry_order.clear()
+            self.size_bytes = 0
+            if self._similar is not None:
+                self._similar.clear()
     
     def clean_expired(self):
         """Elimina entradas expiradas de la caché"""
-        current_time = time.time()
-        expired_keys = [
-            key for key, (timestamp, _) in self.cache.items() 
-            if current_time - timestamp >= self.timeout
-        ]
-        for key in expired_keys:
-            del self.cache[key]
\ No newline at end of file
+        with self._lock:
+            self._evict_expired(time.time())
+    
+    def close(self):
+        self.clear()
+    
+    def reset_stats(self):
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": "memory",
+                "entries": len(self.cache),
+                "size_bytes": self.size_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "fuzzy_hits": self.fuzzy_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "context_version": self.version
+            }
+    
+    def _evict_expired(self, now: float):
+        # Solo se recorren las entradas vencidas, que están al principio del orden de expiración
+        while self._expiry_order:
+            question, timestamp = next(iter(self._expiry_order.items()))
+            if now - timestamp < self.timeout:
+                break
+            self._remove(question)
+            self.expirations += 1
+    
+    def _add(self, key: str, timestamp: float, body: bytes, size: int, question: str, hits: int):
+        self._remove(key)
+        self.cache[key] = (timestamp, body, size, question)
+        self._hit_counts[key] = hits
+        self._expiry_order[key] = timestamp
+        self.size_bytes += size
+        if self._similar is not None:
+            self._similar.add(key)
+        
+        while len(self.cache) > self.max_entries or self.size_bytes > self.max_bytes:
+            oldest = next(iter(self.cache))
+            self._remove(oldest)
+            self.evictions += 1
+    
+    def _remove(self, question: str):
+        entry = self.cache.pop(question, None)
+        if entry is not None:
+            self.size_bytes -= entry[2]
+            del self._expiry_order[question]
+            del self._hit_counts[question]
+            if self._similar is not None:
+                self._similar.remove(question)
+    
+    @staticmethod
+    def _estimate_size(question: str, body: bytes) -> int:
+        return len(question.encode("utf-8")) + len(body)
@@ -1,12 +1,29 @@
+import sys
 import time
+import threading
 from pathlib import Path
-from app.config import logger
+from typing import Callable, List
+from app.config import (
+    logger, RETRIEVAL_TOP_K, PASSAGE_MAX_CHARS, MAX_SEQ_LEN, DOC_STRIDE, MAX_QUESTION_LEN
+)
+from app.services.retrieval import PassageIndex, RetrievedContext
+from app.services.encoding import ContextEncoding
+
+# Estimación de memoria por token: ids, offsets y tramos reutilizables como listas de enteros
+_BYTES_PER_TOKEN = 250
 
 class ContextManager:
     def __init__(self, context_path: str):
         self.context_path = context_path
+        self.version = 0
+        self.tokenizer = None
+        self.passage_index = None
+        self._lock = threading.RLock()
+        # Funciones a las que se avisa con la nueva versión cada vez que cambia el contexto
+        self._listeners: List[Callable[[int], None]] = []
         self.context = self._load_context()
         self.last_updated = time.time()
+        self._build_index()
         logger.info(f"Contexto cargado: {len(self.context)} caracteres")
     
     def _load_context(self) -> str:
@@ -28,21 +45,93 @@ class ContextManager:
             logger.error(f"Error al cargar el contexto: {str(e)}", exc_info=True)
             return "Error al cargar el contexto."
     
+    def _build_index(self) -> int:
+        """Reconstruye el índice y devuelve la nueva versión; quien lo llama avisa después con _notify"""
+        with self._lock:
+            self.version += 1
+            # Solo se reanalizan y re-tokenizan los pasajes que cambiaron respecto al índice anterior
+            index = PassageIndex(self.context, PASSAGE_MAX_CHARS, version=self.version, previous=self.passage_index)
+            self._build_encoding(index)
+            self.passage_index = index
+            version = self.version
+        logger.info(f"Índice de pasajes construido: {len(index.passages)} pasajes (versión {version})")
+        return version
+    
+    def _notify(self, version: int):
+        # Fuera del lock: los listeners toman los locks de la caché y de las preguntas frecuentes
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(version)
+            except Exception as e:
+                logger.error(f"Error al notificar el cambio de contexto: {str(e)}", exc_info=True)
+    
+    def _build_encoding(self, index: PassageIndex):
+        if self.tokenizer is None:
+            index.encoding = None
+            return
+        previous = self.passage_index.encoding if self.passage_index is not None else None
+        try:
+            index.encoding = ContextEncoding(
+                index.version, index.document, index.passages, self.tokenizer,
+                MAX_SEQ_LEN, DOC_STRIDE, MAX_QUESTION_LEN, previous
+            )
+            logger.info(f"Contexto pre-tokenizado: {len(index.encoding.input_ids)} tokens, "
+                        f"{len(index.encoding.document_windows)} ventanas")
+        except Exception as e:
+            logger.error(f"Error al pre-tokenizar el contexto: {str(e)}", exc_info=True)
+            index.encoding = None
+    
+    def set_tokenizer(self, tokenizer):
+        """Asocia el tokenizador del modelo y pre-tokeniza el contexto actual"""
+        with self._lock:
+            self.tokenizer = tokenizer
+            self._build_encoding(self.passage_index)
+    
+    def memory_usage(self) -> int:
+        """Estimación aproximada de la memoria que ocupan el contexto y sus índices"""
+        index = self.passage_index
+        tokens = len(index.encoding.input_ids) if index is not None and index.encoding is not None else 0
+        # El texto está en el documento y, otra vez, en los pasajes
+        return 2 * sys.getsizeof(self.context) + tokens * _BYTES_PER_TOKEN
+    
+    def add_listener(self, listener: Callable[[int], None]):
+        """Registra una función que recibe la nueva versión cada vez que cambia el contexto"""
+        with self._lock:
+            self._listeners.append(listener)
+    
     def get_context(self) -> str:
-        # Verificar si el contexto debe recargarse (si el archivo ha cambiado)
-        path = Path(self.context_path)
-        if path.exists():
-            mtime = path.stat().st_mtime
-            if mtime > self.last_updated:
-                logger.info("Detectado cambio en el archivo de contexto, recargando...")
-                self.context = self._load_context()
-                self.last_updated = time.time()
+        # Los cambios en el archivo los detecta ContextWatcher en segundo plano
         return self.context
     
+    def retrieve(self, question: str, top_k: int = RETRIEVAL_TOP_K) -> RetrievedContext:
+        """Devuelve solo los pasajes del contexto más relevantes para la pregunta"""
+        return self.passage_index.retrieve(question, top_k)
+    
+    def refresh(self) -> bool:
+        """Relee el archivo de contexto y reconstruye el índice solo si su contenido cambió"""
+        if not Path(self.context_path).exists():
+            # Puede faltar un instante mientras un editor lo reemplaza
+            return False
+        context = self._load_context()
+        with self._lock:
+            if context == self.context:
+                return False
+            logger.info("Detectado cambio en el archivo de contexto, recargando...")
+            self.context = context
+            self.last_updated = time.time()
+            version = self._build_index()
+        self._notify(version)
+        return True
+    
     def reload_context(self) -> bool:
         try:
-            self.context = self._load_context()
-            self.last_updated = time.time()
+            with self._lock:
+                self.context = self._load_context()
+                self.last_updated = time.time()
+                version = self._build_index()
+            self._notify(version)
             return True
         except Exception as e:
             logger.error(f"Error al recargar el contexto: {str(e)}", exc_info=True)
@@ -54,11 +143,14 @@ class ContextManager:
             # Asegurar que el directorio exista
             path.parent.mkdir(parents=True, exist_ok=True)
             
-            with open(path, "w", encoding="utf-8") as f:
-                f.write(new_context)
-            
-            self.context = new_context
-            self.last_updated = time.time()
+            with self._lock:
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(new_context)
+                
+                self.context = new_context
+                self.last_updated = time.time()
+                version = self._build_index()
+            self._notify(version)
             logger.info(f"Contexto actualizado: {len(new_context)} caracteres")
             return True
         except Exception as e:
@@ -0,0 +1,245 @@
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from app.config import logger
+from app.services.cache import CacheBackend
+from app.services.context import ContextManager
+from app.services.watcher import ContextWatcher
+
+DEFAULT_CORPUS = "default"
+CORPUS_NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+class Corpus:
+    """Contexto de una institución o departamento, con su propia caché e índices"""
+    
+    def __init__(self, name: str, context_manager: ContextManager, cache: CacheBackend, watcher: Optional[ContextWatcher]):
+        self.name = name
+        self.context_manager = context_manager
+        self.cache = cache
+        self.watcher = watcher
+        # Peticiones que lo están usando: un corpus descargado no se cierra hasta que terminen
+        self._users = 0
+        self._retired = False
+        self._lock = threading.Lock()
+    
+    def memory_usage(self) -> int:
+        return self.context_manager.memory_usage() + self.cache.size_bytes
+    
+    def hold(self):
+        with self._lock:
+            self._users += 1
+    
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            close = self._retired and self._users == 0
+        if close:
+            # Se suele soltar desde el bucle de eventos: cerrar espera al hilo de vigilancia
+            threading.Thread(target=self.close, name=f"qa-corpus-close-{self.name}", daemon=True).start()
+    
+    def retire(self):
+        """Se llama al descargarlo: se cierra ahora o cuando lo suelte su último usuario"""
+        with self._lock:
+            self._retired = True
+            close = self._users == 0
+        if close:
+            self.close()
+    
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+        self.cache.close()
+
+class CorpusRegistry:
+    """
+    Registro de corpus con nombre que comparten un único modelo.
+    
+    El corpus por defecto es el archivo CONTEXT_PATH; el resto son los
+    archivos <nombre>.txt de corpora_dir. Cada corpus se carga la primera vez
+    que se consulta y, si la memoria estimada supera memory_budget, se
+    descargan los menos usados recientemente (nunca el corpus por defecto).
+    """
+    
+    def __init__(
+        self,
+        default_path: str,
+        corpora_dir: str,
+        memory_budget: int,
+        cache_factory: Callable[[str, ContextManager], CacheBackend],
+        watch_interval: float = 0
+    ):
+        self.default_path = default_path
+        self.corpora_dir = Path(corpora_dir)
+        self.memory_budget = memory_budget
+        self.cache_factory = cache_factory
+        self.watch_interval = watch_interval
+        self.tokenizer = None
+        self.unloads = 0
+        self._listeners: List[Callable[[Corpus], None]] = []
+        # Orden LRU: el corpus menos usado recientemente está al principio
+        self._loaded: "OrderedDict[str, Corpus]" = OrderedDict()
+        self._lock = threading.RLock()
+    
+    def path_for(self, name: str) -> Optional[Path]:
+        if name == DEFAULT_CORPUS:
+            return Path(self.default_path)
+        if not CORPUS_NAME_RE.match(name):
+            return None
+        path = self.corpora_dir / f"{name}.txt"
+        return path if path.exists() else None
+    
+    def names(self) -> List[str]:
+        """Corpus disponibles (cargados o no)"""
+        names = [DEFAULT_CORPUS]
+        if self.corpora_dir.is_dir():
+            names.extend(sorted(
+                path.stem for path in self.corpora_dir.glob("*.txt")
+                if CORPUS_NAME_RE.match(path.stem) and path.stem != DEFAULT_CORPUS
+            ))
+        return names
+    
+    def get(self, name: Optional[str] = None) -> Corpus:
+        """Devuelve el corpus (cargándolo si hace falta); KeyError si no existe"""
+        with self._lock:
+            corpus, evicted = self._get_locked(name)
+        self._retire(evicted)
+        return corpus
+    
+    def acquire(self, name: Optional[str] = None) -> Corpus:
+        """Como get, pero si el corpus se descarga no se cierra hasta que se llame a su release"""
+        with self._lock:
+            corpus, evicted = self._get_locked(name)
+            corpus.hold()
+        self._retire(evicted)
+        return corpus
+    
+    def _get_locked(self, name: Optional[str]) -> Tuple[Corpus, List[Corpus]]:
+        name = name or DEFAULT_CORPUS
+        corpus = self._loaded.get(name)
+        if corpus is not None:
+            self._loaded.move_to_end(name)
+            return corpus, []
+        
+        path = self.path_for(name)
+        if path is None:
+            raise KeyError(name)
+        corpus = self._load(name, path)
+        self._loaded[name] = corpus
+        return corpus, self._enforce_budget()
+    
+    @staticmethod
+    def _retire(evicted: List[Corpus]):
+        # Fuera del lock del registro: cerrar espera a que termine el hilo de vigilancia
+        for corpus in evicted:
+            corpus.retire()
+            logger.info(f"Corpus descargado por presupuesto de memoria: {corpus.name}")
+    
+    def create(self, name: str, context: str) -> Optional[Corpus]:
+        """Crea un corpus nuevo en corpora_dir con el texto indicado y lo carga"""
+        if not CORPUS_NAME_RE.match(name):
+            return None
+        try:
+            self.corpora_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.corpora_dir / f"{name}.txt", "w", encoding="utf-8") as f:
+                f.write(context)
+        except Exception as e:
+            logger.error(f"Error al crear el corpus {name}: {str(e)}", exc_info=True)
+            return None
+        return self.get(name)
+    
+    def add_listener(self, callback: Callable[[Corpus], None]):
+        """Registra una función que se llama con cada corpus recién cargado"""
+        self._listeners.append(callback)
+    
+    def is_loaded(self, name: Optional[str] = None) -> bool:
+        return (name or DEFAULT_CORPUS) in self._loaded
+    
+    def loaded(self) -> List[Corpus]:
+        with self._lock:
+            return list(self._loaded.values())
+    
+    def set_tokenizer(self, tokenizer):
+        """Pre-tokeniza los corpus cargados (y los que se carguen después) con el tokenizador del modelo"""
+        with self._lock:
+            self.tokenizer = tokenizer
+            for corpus in self._loaded.values():
+                corpus.context_manager.set_tokenizer(tokenizer)
+    
+    def unload(self, name: str) -> bool:
+        with self._lock:
+            corpus = self._loaded.pop(name, None)
+        if corpus is None:
+            return False
+        corpus.retire()
+        logger.info(f"Corpus descargado: {name}")
+        return True
+    
+    def close(self):
+        with self._lock:
+            corpora = list(self._loaded.values())
+            self._loaded.clear()
+        for corpus in corpora:
+            corpus.close()
+    
+    def memory_usage(self) -> int:
+        with self._lock:
+            return sum(corpus.memory_usage() for corpus in self._loaded.values())
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "available": self.names(),
+                "loaded": {
+                    name: {
+                        "version": corpus.context_manager.version,
+                        "context_size": len(corpus.context_manager.context),
+                        "memory_bytes": corpus.memory_usage(),
+                        "cache": corpus.cache.get_stats()
+                    }
+                    for name, corpus in self._loaded.items()
+                },
+                "memory_bytes": self.memory_usage(),
+                "memory_budget": self.memory_budget,
+                "unloads": self.unloads
+            }
+    
+    def _load(self, name: str, path: Path) -> Corpus:
+        context_manager = ContextManager(str(path))
+        if self.tokenizer is not None:
+            context_manager.set_tokenizer(self.tokenizer)
+        
+        # Las respuestas cacheadas del corpus dejan de valer cuando cambia su contexto
+        cache = self.cache_factory(name, context_manager)
+        cache.invalidate(context_manager.version)
+        context_manager.add_listener(cache.invalidate)
+        
+        watcher = None
+        if self.watch_interval > 0:
+            watcher = ContextWatcher(context_manager, self.watch_interval)
+            watcher.start()
+        
+        logger.info(f"Corpus cargado: {name} ({path})")
+        corpus = Corpus(name, context_manager, cache, watcher)
+        for callback in self._listeners:
+            try:
+                callback(corpus)
+            except Exception as e:
+                logger.error(f"Error al preparar el corpus {name}: {str(e)}", exc_info=True)
+        return corpus
+    
+    def _enforce_budget(self) -> List[Corpus]:
+        """Saca del registro los corpus fríos que no caben y los devuelve para cerrarlos fuera del lock"""
+        # Se descartan los corpus fríos, pero nunca el por defecto ni el recién usado
+        evicted = []
+        while self.memory_usage() > self.memory_budget:
+            victim = next(
+                (name for name in list(self._loaded)[:-1] if name != DEFAULT_CORPUS),
+                None
+            )
+            if victim is None:
+                break
+            evicted.append(self._loaded.pop(victim))
+            self.unloads += 1
+        return evicted
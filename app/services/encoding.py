@@ -0,0 +1,126 @@
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+from app.services.retrieval import Passage
+
+# (input_ids, inicio y fin de la palabra de cada token, inicio de cada token), relativos al tramo
+_Segment = Tuple[List[int], List[int], List[int], List[int]]
+
+def _segment_bounds(document: str, passages: List[Passage]) -> List[Tuple[int, int]]:
+    # Solo se corta donde empieza un pasaje precedido de espacio: la tokenización
+    # por tramos coincide así con la del documento completo
+    cuts = [passage.start for passage in passages if passage.start > 0 and document[passage.start - 1].isspace()]
+    bounds = [0] + cuts + [len(document)]
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+def _tokenize_segment(tokenizer, text: str) -> _Segment:
+    encoded = tokenizer(
+        text,
+        add_special_tokens=False,
+        return_offsets_mapping=True,
+        verbose=False
+    )
+    offsets: List[Tuple[int, int]] = encoded["offset_mapping"]
+    
+    # Las respuestas se alinean a palabras completas, como hace el pipeline
+    word_spans = {}
+    word_ids = encoded.word_ids()
+    for token, word in enumerate(word_ids):
+        if word is None:
+            continue
+        start, end = word_spans.get(word, offsets[token])
+        word_spans[word] = (min(start, offsets[token][0]), max(end, offsets[token][1]))
+    char_starts = []
+    char_ends = []
+    for token, word in enumerate(word_ids):
+        start, end = word_spans[word] if word is not None else offsets[token]
+        char_starts.append(start)
+        char_ends.append(end)
+    return encoded["input_ids"], char_starts, char_ends, [start for start, _ in offsets]
+
+class ContextEncoding:
+    """Tokenización del contexto calculada una sola vez por versión del contexto"""
+    
+    def __init__(
+        self,
+        version: int,
+        document: str,
+        passages: List[Passage],
+        tokenizer,
+        max_seq_len: int = 384,
+        doc_stride: int = 128,
+        max_question_len: int = 64,
+        previous: Optional["ContextEncoding"] = None
+    ):
+        self.version = version
+        self.document = document
+        self.tokenizer = tokenizer
+        self.max_seq_len = min(max_seq_len, tokenizer.model_max_length)
+        self.max_question_len = max_question_len
+        
+        # El documento se tokeniza por tramos que empiezan en cada pasaje: al cambiar
+        # el contexto solo se vuelven a tokenizar los tramos cuyo texto cambió
+        reusable = previous._segments if previous is not None and previous.tokenizer is tokenizer else {}
+        self._segments: Dict[str, _Segment] = {}
+        self.input_ids: List[int] = []
+        self.char_starts: List[int] = []
+        self.char_ends: List[int] = []
+        token_starts: List[int] = []
+        for start, end in _segment_bounds(document, passages):
+            text = document[start:end]
+            segment = self._segments.get(text) or reusable.get(text) or _tokenize_segment(tokenizer, text)
+            self._segments[text] = segment
+            self.input_ids.extend(segment[0])
+            self.char_starts.extend(start + position for position in segment[1])
+            self.char_ends.extend(start + position for position in segment[2])
+            token_starts.extend(start + position for position in segment[3])
+        
+        # Ventanas con solapamiento de doc_stride tokens, dejando sitio para la pregunta
+        self.special_tokens = tokenizer.num_special_tokens_to_add(pair=True)
+        self.doc_stride = doc_stride
+        self.window_length = max(1, self.max_seq_len - max_question_len - self.special_tokens)
+        self.window_step = max(1, self.window_length - doc_stride)
+        self.document_windows = self._windows(0, len(self.input_ids))
+        
+        # Tramo de tokens de cada pasaje
+        self.passage_ranges = [
+            (bisect_left(token_starts, passage.start), bisect_left(token_starts, passage.end))
+            for passage in passages
+        ]
+        self.passage_windows = [self._windows(first, last) for first, last in self.passage_ranges]
+    
+    def _windows(self, first_token: int, last_token: int, length: int = 0, step: int = 0) -> List[Tuple[int, int]]:
+        length = length or self.window_length
+        step = step or self.window_step
+        windows = []
+        start = first_token
+        while start < last_token:
+            windows.append((start, min(start + length, last_token)))
+            if start + length >= last_token:
+                break
+            start += step
+        return windows
+    
+    def windows_for(self, passages: List[Passage], question_len: Optional[int] = None) -> List[Tuple[int, int]]:
+        """
+        Ventanas de tokens a leer para los pasajes recuperados.
+        
+        Con question_len, las ventanas se alargan con el espacio que la
+        pregunta no usa (el solapamiento crece en la misma proporción): las
+        preguntas cortas se leen en menos ventanas.
+        """
+        full = len(passages) >= len(self.passage_windows)
+        if question_len is None:
+            if full:
+                return self.document_windows
+            windows = []
+            for passage in passages:
+                windows.extend(self.passage_windows[passage.index])
+            return windows
+        
+        length = max(self.window_length, self.max_seq_len - question_len - self.special_tokens)
+        step = max(1, length - self.doc_stride * length // self.window_length)
+        ranges = [(0, len(self.input_ids))] if full else [self.passage_ranges[passage.index] for passage in passages]
+        windows = []
+        for first, last in ranges:
+            windows.extend(self._windows(first, last, length, step))
+        return windows
@@ -0,0 +1,272 @@
+import json
+import os
+import threading
+import time
+import weakref
+from pathlib import Path
+from queue import Queue, Empty
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from app.config import logger
+from app.services.corpora import Corpus
+from app.services.serialization import encode_response
+from app.services.text import normalize_question
+
+class _CorpusAnswers:
+    """Respuestas precalculadas de un corpus para una versión concreta de su contexto"""
+    
+    def __init__(self, context_manager, version: int, generation: int, answers: Dict[str, bytes], unanswered: int, seconds: float):
+        # Referencia débil: la tabla no retiene el contexto de un corpus descargado
+        self.context_manager = weakref.ref(context_manager)
+        self.version = version
+        self.generation = generation
+        self.answers = answers
+        self.unanswered = unanswered
+        self.build_seconds = seconds
+        self.built_at = time.time()
+
+class FaqTable:
+    """
+    Preguntas frecuentes de cada corpus, respondidas de antemano.
+    
+    La lista de preguntas se administra por corpus y se guarda en
+    <directory>/<corpus>.json. Un hilo en segundo plano las responde con el
+    modelo cada vez que el contexto del corpus cambia de versión (o cambia el
+    modelo) y las guarda en una tabla de búsqueda exacta por pregunta
+    normalizada, que se consulta antes que la caché de respuestas. Las
+    respuestas no caducan por tiempo: solo dejan de servirse cuando cambia
+    el contexto o el modelo, hasta que termina la siguiente reconstrucción.
+    
+    Cada worker tiene su propia tabla; los cambios de la lista hechos en
+    otro worker se detectan por la fecha del archivo cada check_interval
+    segundos.
+    """
+    
+    def __init__(self, directory: str, max_questions: int = 500, check_interval: float = 30):
+        self.directory = Path(directory)
+        self.max_questions = max_questions
+        self.check_interval = check_interval
+        # Sube con cada cambio de modelo: las tablas de generaciones anteriores no se sirven
+        self.generation = 0
+        self.hits = 0
+        self.builds = 0
+        self._tables: Dict[str, _CorpusAnswers] = {}
+        # Corpus cargados; los que el registro descarga desaparecen solos
+        self._corpora: "weakref.WeakValueDictionary[str, Corpus]" = weakref.WeakValueDictionary()
+        self._mtimes: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._queue: "Queue[Optional[str]]" = Queue()
+        self._batch_scheduler = None
+        self._build_response: Optional[Callable[[Dict[str, Any], str, float], Dict[str, Any]]] = None
+        self._min_score = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self.directory.mkdir(parents=True, exist_ok=True)
+    
+    def path_for(self, name: str) -> Path:
+        return self.directory / f"{name}.json"
+    
+    def questions(self, name: str) -> List[str]:
+        path = self.path_for(name)
+        if not path.exists():
+            return []
+        try:
+            with open(path, encoding="utf-8") as f:
+                return list(json.load(f).get("questions", []))
+        except Exception as e:
+            logger.warning(f"No se pudo leer la lista de preguntas frecuentes {path}: {str(e)}")
+            return []
+    
+    def set_questions(self, name: str, questions: Iterable[str]) -> List[str]:
+        """Reemplaza la lista de preguntas del corpus (sin duplicados) y programa su reconstrucción"""
+        unique, seen = [], set()
+        for question in questions:
+            key = normalize_question(question)
+            if key and key not in seen:
+                seen.add(key)
+                unique.append(question.strip())
+            if len(unique) >= self.max_questions:
+                break
+        
+        path = self.path_for(name)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"questions": unique, "updated_at": time.time()}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        
+        corpus = self._corpora.get(name)
+        if corpus is not None:
+            self.schedule(corpus)
+        return unique
+    
+    def add_questions(self, name: str, questions: Iterable[str]) -> List[str]:
+        """Añade preguntas al final de la lista del corpus"""
+        return self.set_questions(name, self.questions(name) + list(questions))
+    
+    def attach(self, corpus: Corpus):
+        """Se registra como listener del registro: reconstruye la tabla del corpus con cada versión del contexto"""
+        with self._lock:
+            self._corpora[corpus.name] = corpus
+            self._tables.pop(corpus.name, None)
+        corpus.context_manager.add_listener(lambda version: self.schedule(corpus))
+        self.schedule(corpus)
+    
+    def schedule(self, corpus: Corpus):
+        """Programa la reconstrucción de la tabla del corpus (se hace cuando el modelo esté cargado)"""
+        if self._corpora.get(corpus.name) is corpus:
+            self._queue.put(corpus.name)
+    
+    def start(self, batch_scheduler, build_response: Callable[[Dict[str, Any], str, float], Dict[str, Any]], min_score: float):
+        """Empieza a construir las tablas con el modelo ya cargado"""
+        self._batch_scheduler = batch_scheduler
+        self._build_response = build_response
+        self._min_score = min_score
+        self._thread = threading.Thread(target=self._run, name="qa-faq-builder", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+    
+    def invalidate(self):
+        """Deja de servir las respuestas del modelo anterior y reconstruye todas las tablas"""
+        with self._lock:
+            self.generation += 1
+            corpora = list(self._corpora.values())
+        for corpus in corpora:
+            self.schedule(corpus)
+    
+    def lookup(self, corpus: Corpus, question: str) -> Optional[bytes]:
+        """Respuesta precalculada (codificada, sin response_time) si la tabla está al día con el contexto y el modelo"""
+        table = self._tables.get(corpus.name)
+        if (
+            table is None
+            or table.context_manager() is not corpus.context_manager
+            or table.version != corpus.context_manager.version
+            or table.generation != self.generation
+        ):
+            return None
+        response = table.answers.get(normalize_question(question))
+        if response is not None:
+            self.hits += 1
+        return response
+    
+    def _run(self):
+        while True:
+            try:
+                name = self._queue.get(timeout=self.check_interval)
+            except Empty:
+                self._check_files()
+                continue
+            if name is None:
+                return
+            
+            # Varias peticiones seguidas para el mismo corpus se resuelven con una sola reconstrucción
+            pending = {name}
+            while True:
+                try:
+                    name = self._queue.get_nowait()
+                except Empty:
+                    break
+                if name is None:
+                    return
+                pending.add(name)
+            for name in pending:
+                corpus = self._corpora.get(name)
+                if corpus is not None:
+                    try:
+                        self._build(corpus)
+                    except Exception as e:
+                        logger.error(f"Error al precalcular las preguntas frecuentes de {name}: {str(e)}", exc_info=True)
+    
+    def _check_files(self):
+        # La lista pudo cambiarse desde otro worker
+        for name, corpus in list(self._corpora.items()):
+            path = self.path_for(name)
+            mtime = path.stat().st_mtime if path.exists() else 0.0
+            if mtime != self._mtimes.get(name, 0.0):
+                self.schedule(corpus)
+    
+    def _build(self, corpus: Corpus):
+        path = self.path_for(corpus.name)
+        self._mtimes[corpus.name] = path.stat().st_mtime if path.exists() else 0.0
+        questions = self.questions(corpus.name)
+        version = corpus.context_manager.version
+        generation = self.generation
+        start_time = time.time()
+        
+        answers: Dict[str, bytes] = {}
+        unanswered = 0
+        batch_size = self._batch_scheduler.max_batch_size
+        # Por tandas del tamaño de un lote: el tráfico real no espera detrás de toda la tabla
+        for i in range(0, len(questions), batch_size):
+            chunk = questions[i:i + batch_size]
+            chunk_start = time.time()
+            contexts = [corpus.context_manager.retrieve(question) for question in chunk]
+            if any(context.version != version for context in contexts):
+                # El contexto cambió durante la reconstrucción: ya hay otra programada
+                return
+            futures = []
+            for question, context in zip(chunk, contexts):
+                try:
+                    futures.append(self._batch_scheduler.submit_when_free(question, context))
+                except Exception as e:
+                    # Con la cola llena se omite la pregunta, no el resto de la tabla
+                    logger.warning(f"No se pudo precalcular la pregunta frecuente '{question}': {str(e)}")
+                    futures.append(None)
+            for question, context, future in zip(chunk, contexts, futures):
+                if future is None:
+                    unanswered += 1
+                    continue
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.warning(f"No se pudo precalcular la pregunta frecuente '{question}': {str(e)}")
+                    unanswered += 1
+                    continue
+                if result["score"] < self._min_score:
+                    unanswered += 1
+                    continue
+                response = self._build_response(result, context.document, time.time() - chunk_start)
+                answers[normalize_question(question)] = encode_response(response)
+        
+        with self._lock:
+            if generation != self.generation or self._corpora.get(corpus.name) is not corpus:
+                return
+            self._tables[corpus.name] = _CorpusAnswers(
+                corpus.context_manager, version, generation, answers, unanswered, time.time() - start_time
+            )
+            self.builds += 1
+        logger.info(
+            f"Preguntas frecuentes de {corpus.name} precalculadas: {len(answers)} respuestas, "
+            f"{unanswered} sin respuesta confiable ({time.time() - start_time:.2f}s, versión {version})"
+        )
+    
+    def get_stats(self, name: Optional[str] = None) -> Dict[str, Any]:
+        def table_stats(table: Optional[_CorpusAnswers], corpus: Corpus) -> Dict[str, Any]:
+            if table is None:
+                return {"ready": False}
+            return {
+                "ready": table.version == corpus.context_manager.version and table.generation == self.generation,
+                "answers": len(table.answers),
+                "unanswered": table.unanswered,
+                "context_version": table.version,
+                "built_at": table.built_at,
+                "build_seconds": table.build_seconds
+            }
+        
+        with self._lock:
+            corpora = dict(self._corpora)
+            # Se olvidan las tablas de los corpus descargados
+            for stale in set(self._tables) - set(corpora):
+                del self._tables[stale]
+            tables = dict(self._tables)
+        if name is not None:
+            corpus = corpora.get(name)
+            return table_stats(tables.get(name), corpus) if corpus else {"ready": False}
+        return {
+            "directory": str(self.directory),
+            "hits": self.hits,
+            "builds": self.builds,
+            "pending": self._queue.qsize(),
+            "corpora": {name: table_stats(tables.get(name), corpus) for name, corpus in corpora.items()}
+        }
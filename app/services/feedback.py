@@ -0,0 +1,237 @@
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from queue import Queue, Empty, Full
+from typing import Any, Dict, List, Optional, Tuple
+from app.config import logger
+from app.services.text import normalize_question
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS feedback (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    corpus TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    is_helpful INTEGER NOT NULL,
+    comments TEXT
+);
+CREATE INDEX IF NOT EXISTS feedback_created_at ON feedback (created_at);
+CREATE TABLE IF NOT EXISTS feedback_summary (
+    corpus TEXT NOT NULL,
+    question_key TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    question TEXT NOT NULL,
+    helpful INTEGER NOT NULL DEFAULT 0,
+    not_helpful INTEGER NOT NULL DEFAULT 0,
+    last_at REAL NOT NULL,
+    PRIMARY KEY (corpus, question_key, answer)
+);
+"""
+
+_UPSERT_SUMMARY = """
+INSERT INTO feedback_summary (corpus, question_key, answer, question, helpful, not_helpful, last_at)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (corpus, question_key, answer) DO UPDATE SET
+    question = excluded.question,
+    helpful = helpful + excluded.helpful,
+    not_helpful = not_helpful + excluded.not_helpful,
+    last_at = MAX(last_at, excluded.last_at)
+"""
+
+# (created_at, corpus, question, answer, is_helpful, comments)
+_Feedback = Tuple[float, str, str, str, int, Optional[str]]
+
+class FeedbackStore:
+    """
+    Registro de feedback en SQLite (modo WAL) escrito por un hilo en segundo plano.
+    
+    Las peticiones solo encolan en memoria; el hilo escribe por lotes y
+    mantiene en la misma transacción un resumen agregado por pregunta y
+    respuesta, de modo que las consultas no recorren el registro completo.
+    Las filas individuales se conservan retention_days días.
+    """
+    
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 200,
+        flush_interval: float = 1.0,
+        max_pending: int = 10000,
+        retention_days: int = 90
+    ):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.received = 0
+        self.written = 0
+        self.dropped = 0
+        self._queue: "Queue[_Feedback]" = Queue(maxsize=max_pending)
+        self._stopped = threading.Event()
+        self._last_prune = 0.0
+        
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = self._connect()
+        connection.executescript(_SCHEMA)
+        connection.close()
+        
+        self._thread = threading.Thread(target=self._run, name="qa-feedback-writer", daemon=True)
+        self._thread.start()
+        logger.info(f"Registro de feedback en {self.path}")
+    
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(str(self.path), timeout=10, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+    
+    def submit(
+        self,
+        question: str,
+        answer: str,
+        is_helpful: bool,
+        comments: Optional[str] = None,
+        corpus: str = "default"
+    ) -> bool:
+        """Encola un feedback sin tocar el disco; False si la cola está llena"""
+        try:
+            self._queue.put_nowait((time.time(), corpus, question, answer, int(is_helpful), comments))
+        except Full:
+            self.dropped += 1
+            return False
+        self.received += 1
+        return True
+    
+    def close(self):
+        """Detiene el hilo escritor tras guardar lo que quede en la cola"""
+        self._stopped.set()
+        self._thread.join(timeout=10)
+    
+    def summary(
+        self,
+        corpus: Optional[str] = None,
+        limit: int = 50,
+        min_votes: int = 1,
+        order: str = "worst"
+    ) -> List[Dict[str, Any]]:
+        """Utilidad agregada por pregunta y respuesta (las peores o las más votadas primero)"""
+        order_by = {
+            "worst": "CAST(helpful AS REAL) / (helpful + not_helpful) ASC, (helpful + not_helpful) DESC",
+            "best": "CAST(helpful AS REAL) / (helpful + not_helpful) DESC, (helpful + not_helpful) DESC",
+            "most": "(helpful + not_helpful) DESC",
+            "recent": "last_at DESC"
+        }[order]
+        query = "SELECT corpus, question, answer, helpful, not_helpful, last_at FROM feedback_summary WHERE helpful + not_helpful >= ?"
+        params: List[Any] = [min_votes]
+        if corpus:
+            query += " AND corpus = ?"
+            params.append(corpus)
+        query += f" ORDER BY {order_by} LIMIT ?"
+        params.append(limit)
+        
+        connection = self._connect()
+        try:
+            rows = connection.execute(query, params).fetchall()
+        finally:
+            connection.close()
+        return [
+            {
+                "corpus": corpus,
+                "question": question,
+                "answer": answer,
+                "helpful": helpful,
+                "not_helpful": not_helpful,
+                "total": helpful + not_helpful,
+                "helpful_rate": helpful / (helpful + not_helpful),
+                "last_at": last_at
+            }
+            for corpus, question, answer, helpful, not_helpful, last_at in rows
+        ]
+    
+    def top_questions(self, corpus: str, limit: int) -> List[str]:
+        """Preguntas con más feedback del corpus (las que más se repiten en el historial)"""
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT MAX(question) FROM feedback_summary WHERE corpus = ? GROUP BY question_key "
+                "ORDER BY SUM(helpful + not_helpful) DESC LIMIT ?",
+                (corpus, limit)
+            ).fetchall()
+        finally:
+            connection.close()
+        return [question for question, in rows]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "received": self.received,
+            "written": self.written,
+            "dropped": self.dropped,
+            "pending": self._queue.qsize()
+        }
+    
+    def _run(self):
+        connection = self._connect()
+        try:
+            while not self._stopped.is_set() or not self._queue.empty():
+                batch = self._collect_batch()
+                if batch:
+                    self._write(connection, batch)
+                if time.time() - self._last_prune > 3600:
+                    self._prune(connection)
+        finally:
+            connection.close()
+    
+    def _collect_batch(self) -> List[_Feedback]:
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except Empty:
+            return []
+        # Se acumula lo que llegue durante la ventana para escribir en una sola transacción
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stopped.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except Empty:
+                break
+        return batch
+    
+    def _write(self, connection: sqlite3.Connection, batch: List[_Feedback]):
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT INTO feedback (created_at, corpus, question, answer, is_helpful, comments) VALUES (?, ?, ?, ?, ?, ?)",
+                    batch
+                )
+                connection.executemany(_UPSERT_SUMMARY, [
+                    (corpus, normalize_question(question), answer.strip(), question, is_helpful, 1 - is_helpful, created_at)
+                    for created_at, corpus, question, answer, is_helpful, _ in batch
+                ])
+            self.written += len(batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.error(f"Error al guardar {len(batch)} registros de feedback: {str(e)}", exc_info=True)
+    
+    def _prune(self, connection: sqlite3.Connection):
+        self._last_prune = time.time()
+        if self.retention_days <= 0:
+            return
+        try:
+            with connection:
+                deleted = connection.execute(
+                    "DELETE FROM feedback WHERE created_at < ?",
+                    (time.time() - self.retention_days * 86400,)
+                ).rowcount
+            if deleted:
+                logger.info(f"Eliminados {deleted} registros de feedback con más de {self.retention_days} días")
+        except Exception as e:
+            logger.error(f"Error al depurar el registro de feedback: {str(e)}", exc_info=True)
@@ -1,36 +1,231 @@
 import time
-from typing import Dict, Any
+import threading
+from bisect import bisect_left
+from typing import Dict, Any, List, Optional, Sequence
+
+# Límites (ms) de los histogramas de latencia
+LATENCY_BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# Etapas de una pregunta, en orden; las del modelo (tokenization, forward, postprocess) se miden por lote
+STAGES = ("validation", "cache_lookup", "context_fetch", "queue", "tokenization", "forward", "postprocess")
+
+# Resultado de cada petición: faq (tabla de preguntas frecuentes), hit (caché), miss (respondida por
+# el modelo), low_confidence (404), shed (rechazada por sobrecarga) y error
+OUTCOMES = ("faq", "hit", "miss", "low_confidence", "shed", "error")
+
+class Histogram:
+    """Histograma de cubetas fijas (cada cubeta cuenta los valores <= su límite)"""
+    
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = sorted(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+    
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+    
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.count, self.total, self.max
+    
+    def percentile(self, fraction: float, counts: Optional[List[int]] = None, count: Optional[int] = None,
+                   maximum: Optional[float] = None) -> float:
+        """Percentil estimado interpolando dentro de la cubeta que lo contiene"""
+        if counts is None:
+            counts, count, _, maximum = self.snapshot()
+        if not count:
+            return 0.0
+        rank = fraction * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                # La última cubeta no tiene límite superior: se acota con el máximo observado
+                upper = self.buckets[index] if index < len(self.buckets) else maximum
+                return min(maximum, lower + (upper - lower) * (rank - cumulative) / bucket_count)
+            cumulative += bucket_count
+        return maximum
+    
+    def to_dict(self) -> Dict[str, Any]:
+        counts, count, total, maximum = self.snapshot()
+        buckets = {f"<={bound:g}": bucket_count for bound, bucket_count in zip(self.buckets, counts)}
+        buckets[f">{self.buckets[-1]:g}"] = counts[-1]
+        return {
+            "count": count,
+            "mean": total / count if count else 0,
+            "p50": self.percentile(0.5, counts, count, maximum),
+            "p95": self.percentile(0.95, counts, count, maximum),
+            "p99": self.percentile(0.99, counts, count, maximum),
+            "max": maximum,
+            "buckets": buckets
+        }
+    
+    def to_prometheus(self, name: str, labels: str = "", scale: float = 1.0) -> List[str]:
+        """Líneas del histograma en formato de exposición de Prometheus (cubetas acumuladas)"""
+        counts, count, total, _ = self.snapshot()
+        separator = "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{labels}{separator}le="{bound * scale:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{separator}le="+Inf"}} {count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {total * scale:g}")
+        lines.append(f"{name}_count{suffix} {count}")
+        return lines
 
 class MetricsManager:
+    """
+    Métricas del servicio. Los contadores se actualizan bajo un lock porque
+    se registran desde el bucle de eventos, el planificador de lotes y los
+    hilos de inferencia a la vez.
+    """
+    
     def __init__(self):
-        self.total_requests = 0
-        self.successful_requests = 0
-        self.failed_requests = 0
-        self.avg_response_time = 0
-        self.last_reset = time.time()
-    
-    def record_request(self, success: bool, response_time: float):
-        self.total_requests += 1
-        if success:
-            self.successful_requests += 1
-        else:
-            self.failed_requests += 1
+        self._lock = threading.Lock()
+        self.batch_size_histogram = Histogram([1, 2, 4, 8, 16, 32, 64])
+        self.batch_wait_histogram = Histogram([1, 2, 5, 10, 20, 50, 100, 250, 500, 1000])  # ms
+        self.stage_histograms = {stage: Histogram(LATENCY_BUCKETS_MS) for stage in STAGES}
+        self.outcome_histograms = {outcome: Histogram(LATENCY_BUCKETS_MS) for outcome in OUTCOMES}
+        self.queue_depth = 0
+        self.reset()
+    
+    def record_request(self, success: bool, response_time: float, outcome: Optional[str] = None):
+        """Registra una petición terminada; outcome es uno de OUTCOMES (por defecto miss o error)"""
+        with self._lock:
+            self.total_requests += 1
+            if success:
+                self.successful_requests += 1
+            else:
+                self.failed_requests += 1
+            
+            # Actualizar tiempo promedio de respuesta
+            self.avg_response_time = ((self.avg_response_time * (self.total_requests - 1)) + response_time) / self.total_requests
         
-        # Actualizar tiempo promedio de respuesta
-        self.avg_response_time = ((self.avg_response_time * (self.total_requests - 1)) + response_time) / self.total_requests
+        outcome = outcome or ("miss" if success else "error")
+        self.outcome_histograms[outcome].observe(response_time * 1000)
+    
+    def record_stage(self, stage: str, seconds: float):
+        """Duración de una etapa de STAGES"""
+        self.stage_histograms[stage].observe(seconds * 1000)
+    
+    def record_coalesced(self):
+        """Pregunta que esperó a una inferencia idéntica ya en curso en vez de lanzar otra"""
+        with self._lock:
+            self.coalesced_requests += 1
+    
+    def record_queue_depth(self, depth: int):
+        with self._lock:
+            self.queue_depth = depth
+            if depth > self.max_queue_depth:
+                self.max_queue_depth = depth
+    
+    def record_shed(self, reason: str):
+        """Pregunta rechazada sin llegar al modelo (queue_full: cola llena, deadline: plazo vencido)"""
+        with self._lock:
+            self.shed_requests[reason] = self.shed_requests.get(reason, 0) + 1
+    
+    def record_batch(self, batch_size: int, wait_times: List[float]):
+        """Registra el tamaño de un lote de inferencia y la espera (en segundos) de cada pregunta"""
+        self.batch_size_histogram.observe(batch_size)
+        for wait_time in wait_times:
+            self.batch_wait_histogram.observe(wait_time * 1000)
+            self.stage_histograms["queue"].observe(wait_time * 1000)
     
     def reset(self):
-        self.total_requests = 0
-        self.successful_requests = 0
-        self.failed_requests = 0
-        self.avg_response_time = 0
-        self.last_reset = time.time()
+        with self._lock:
+            self.total_requests = 0
+            self.successful_requests = 0
+            self.failed_requests = 0
+            self.avg_response_time = 0
+            self.coalesced_requests = 0
+            self.max_queue_depth = self.queue_depth
+            self.shed_requests: Dict[str, int] = {}
+            self.last_reset = time.time()
+        for histogram in (
+            self.batch_size_histogram, self.batch_wait_histogram,
+            *self.stage_histograms.values(), *self.outcome_histograms.values()
+        ):
+            histogram.reset()
     
     def get_metrics(self) -> Dict[str, Any]:
-        return {
-            "total_requests": self.total_requests,
-            "successful_requests": self.successful_requests,
-            "failed_requests": self.failed_requests,
-            "avg_response_time": self.avg_response_time,
-            "uptime_since_reset": time.time() - self.last_reset
-        }
\ No newline at end of file
+        with self._lock:
+            result = {
+                "total_requests": self.total_requests,
+                "successful_requests": self.successful_requests,
+                "failed_requests": self.failed_requests,
+                "avg_response_time": self.avg_response_time,
+                "coalesced_requests": self.coalesced_requests,
+                "admission": {
+                    "queue_depth": self.queue_depth,
+                    "max_queue_depth": self.max_queue_depth,
+                    "shed": dict(self.shed_requests)
+                },
+                "uptime_since_reset": time.time() - self.last_reset
+            }
+        result["batching"] = {
+            "batch_size": self.batch_size_histogram.to_dict(),
+            "wait_time_ms": self.batch_wait_histogram.to_dict()
+        }
+        result["latency_ms"] = {
+            "stages": {stage: histogram.to_dict() for stage, histogram in self.stage_histograms.items()},
+            "outcomes": {outcome: histogram.to_dict() for outcome, histogram in self.outcome_histograms.items()}
+        }
+        return result
+    
+    def to_prometheus(self) -> str:
+        """Métricas en formato de texto de Prometheus (latencias en segundos)"""
+        with self._lock:
+            shed = dict(self.shed_requests)
+            queue_depth, coalesced = self.queue_depth, self.coalesced_requests
+        
+        lines = [
+            "# HELP qa_requests_total Peticiones de preguntas terminadas por resultado",
+            "# TYPE qa_requests_total counter"
+        ]
+        for outcome, histogram in self.outcome_histograms.items():
+            lines.append(f'qa_requests_total{{outcome="{outcome}"}} {histogram.snapshot()[1]}')
+        
+        lines += [
+            "# HELP qa_request_duration_seconds Latencia de las peticiones por resultado",
+            "# TYPE qa_request_duration_seconds histogram"
+        ]
+        for outcome, histogram in self.outcome_histograms.items():
+            lines += histogram.to_prometheus("qa_request_duration_seconds", f'outcome="{outcome}"', 0.001)
+        
+        lines += [
+            "# HELP qa_stage_duration_seconds Duración de cada etapa (las del modelo, por lote)",
+            "# TYPE qa_stage_duration_seconds histogram"
+        ]
+        for stage, histogram in self.stage_histograms.items():
+            lines += histogram.to_prometheus("qa_stage_duration_seconds", f'stage="{stage}"', 0.001)
+        
+        lines += [
+            "# HELP qa_batch_size Preguntas por lote de inferencia",
+            "# TYPE qa_batch_size histogram",
+            *self.batch_size_histogram.to_prometheus("qa_batch_size"),
+            "# HELP qa_inference_queue_depth Preguntas esperando inferencia",
+            "# TYPE qa_inference_queue_depth gauge",
+            f"qa_inference_queue_depth {queue_depth}",
+            "# HELP qa_shed_requests_total Preguntas rechazadas sin llegar al modelo",
+            "# TYPE qa_shed_requests_total counter",
+            *(f'qa_shed_requests_total{{reason="{reason}"}} {count}' for reason, count in sorted(shed.items())),
+            "# HELP qa_coalesced_requests_total Preguntas que compartieron una inferencia en curso",
+            "# TYPE qa_coalesced_requests_total counter",
+            f"qa_coalesced_requests_total {coalesced}"
+        ]
+        return "\n".join(lines) + "\n"
@@ -1,47 +1,349 @@
+import math
 import time
-from typing import Dict, Any, Optional
-from transformers import pipeline, Pipeline
-from app.config import logger
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, Any, List, Optional
+from app.config import logger, MAX_ANSWER_LENGTH, ONNX_DIR
+from app.services.profiling import InferenceProfiler
+from app.services.retrieval import RetrievedContext
+
+# torch y transformers se importan al cargar el modelo, no al importar el módulo
+if TYPE_CHECKING:
+    from transformers import Pipeline
+    from app.services.reader import SpanReader
+    from app.services.workers import InferenceWorkerPool
+
+_MAX_RELOAD_JOBS = 20
+
+class _ModelInstance:
+    """Pipeline, lector y pool de procesos de una carga concreta del modelo"""
+    
+    def __init__(
+        self,
+        qa_pipeline: Optional["Pipeline"],
+        reader: Optional["SpanReader"],
+        worker_pool: Optional["InferenceWorkerPool"]
+    ):
+        self.qa_pipeline = qa_pipeline
+        self.reader = reader
+        self.worker_pool = worker_pool
+        self.loaded_at = time.time() if qa_pipeline else None
+        # Lotes en curso; una instancia retirada se libera cuando llega a cero
+        self.in_flight = 0
+        self.retired = False
+    
+    def answer_batch(
+        self,
+        questions: List[str],
+        contexts: List[RetrievedContext],
+        timings: Optional[Dict[str, float]] = None
+    ) -> List[Dict[str, Any]]:
+        qa_pipeline = self.qa_pipeline
+        reader = self.reader
+        if qa_pipeline is None:
+            raise RuntimeError("El modelo no está disponible")
+        
+        results: List[Optional[Dict[str, Any]]] = [None] * len(questions)
+        
+        # Contextos con tokenización precalculada: solo se tokeniza la pregunta
+        encoded = [
+            i for i, context in enumerate(contexts)
+            if reader is not None and context.encoding is not None and context.encoding.tokenizer is reader.tokenizer
+        ]
+        if encoded:
+            answers = reader.answer_batch(
+                [(questions[i], contexts[i].encoding, contexts[i].passages) for i in encoded],
+                handle_impossible_answer=True,
+                max_answer_len=MAX_ANSWER_LENGTH,
+                timings=timings
+            )
+            for i, answer in zip(encoded, answers):
+                results[i] = answer
+        
+        # Resto: el pipeline tokeniza el texto reducido y se traducen las posiciones
+        pending = [i for i in range(len(questions)) if results[i] is None]
+        if pending:
+            started = time.perf_counter()
+            answers = qa_pipeline(
+                question=[questions[i] for i in pending],
+                context=[contexts[i].text for i in pending],
+                batch_size=len(pending),
+                handle_impossible_answer=True,
+                max_answer_len=MAX_ANSWER_LENGTH
+            )
+            # El pipeline devuelve un dict (no una lista) cuando el lote tiene un solo elemento
+            if isinstance(answers, dict):
+                answers = [answers]
+            for i, answer in zip(pending, answers):
+                if answer["answer"]:
+                    answer["start"] = contexts[i].to_document_offset(answer["start"])
+                    answer["end"] = contexts[i].to_document_offset(answer["end"])
+                results[i] = answer
+            # El pipeline no separa sus etapas: todo su tiempo cuenta como forward
+            if timings is not None:
+                timings["forward"] = timings.get("forward", 0.0) + time.perf_counter() - started
+        
+        return results
+    
+    def close(self):
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown()
+            self.worker_pool = None
+        self.qa_pipeline = None
+        self.reader = None
 
 class ModelManager:
-    def __init__(self, model_name: str, device: str):
+    def __init__(
+        self,
+        model_name: str,
+        device: str,
+        inference_workers: int = 1,
+        torch_threads: int = 0,
+        inference_processes: int = 0,
+        backend: str = "torch",
+        profiler: Optional[InferenceProfiler] = None,
+        window_search: str = "exhaustive",
+        early_exit_score: float = 1.0,
+        adaptive_windows: bool = False
+    ):
         self.model_name = model_name
         self.device = device
-        self.qa_pipeline = self._load_model()
-        self.model_loaded_at = time.time() if self.qa_pipeline else None
-        logger.info(f"Modelo cargado: {model_name} en dispositivo {device}")
+        self.backend = backend
+        # Cómo recorre el lector las ventanas del contexto (ver SpanReader); el pipeline siempre las lee todas
+        self.window_search = window_search
+        self.early_exit_score = early_exit_score
+        self.adaptive_windows = adaptive_windows
+        # Perfilado bajo demanda de los lotes (admin /profiling)
+        self.profiler = profiler
+        # Las sesiones de ONNX Runtime no se pueden pasar a otro proceso
+        self.inference_processes = inference_processes if device == "cpu" and backend != "onnx" else 0
+        if inference_processes and not self.inference_processes:
+            logger.warning("El pool de procesos de inferencia solo está disponible en CPU con torch; se usarán hilos")
+        # Con pool de procesos cada hilo solo despacha lotes, uno por proceso
+        self.inference_workers = max(1, self.inference_processes or inference_workers)
+        self.torch_threads = torch_threads
+        if torch_threads > 0:
+            import torch
+            # Es un ajuste de todo el proceso, no de cada hilo: todos los hilos de inferencia comparten el pool intra-op
+            torch.set_num_threads(torch_threads)
+        # Hilos dedicados a la inferencia, separados del threadpool de FastAPI
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.inference_workers,
+            thread_name_prefix="qa-inference"
+        )
+        # Instancia activa del modelo; /reload prepara otra en segundo plano y las intercambia
+        self._lock = threading.Lock()
+        self._reload_jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._reload_thread: Optional[threading.Thread] = None
+        self._active = self._create_instance()
+        logger.info(f"Modelo cargado: {model_name} en dispositivo {device} (backend {backend})")
     
-    def _load_model(self) -> Optional[Pipeline]:
+    def _create_instance(self) -> _ModelInstance:
+        qa_pipeline = self._load_model()
+        worker_pool = self._create_worker_pool(qa_pipeline)
+        reader = self._create_reader(qa_pipeline, worker_pool)
+        return _ModelInstance(qa_pipeline, reader, worker_pool)
+    
+    def _load_model(self) -> Optional["Pipeline"]:
         try:
+            from transformers import pipeline
+            from app.services.backends import load_qa_model
+            model, tokenizer = load_qa_model(
+                self.model_name, self.backend, self.device, self.torch_threads, ONNX_DIR
+            )
             return pipeline(
                 "question-answering", 
-                model=self.model_name, 
+                model=model, 
+                tokenizer=tokenizer,
                 device=0 if self.device == "cuda" else -1
             )
         except Exception as e:
             logger.error(f"Error al cargar el modelo {self.model_name}: {str(e)}", exc_info=True)
             return None
     
-    def get_pipeline(self) -> Optional[Pipeline]:
-        return self.qa_pipeline
+    def _create_worker_pool(self, qa_pipeline: Optional["Pipeline"]) -> Optional["InferenceWorkerPool"]:
+        """Crea los procesos de inferencia, que comparten los pesos del modelo recién cargado"""
+        if qa_pipeline is None or self.inference_processes <= 0:
+            return None
+        try:
+            from app.services.workers import InferenceWorkerPool
+            return InferenceWorkerPool(qa_pipeline.model, self.inference_processes, self.torch_threads)
+        except Exception as e:
+            logger.warning(f"No se pudo crear el pool de procesos de inferencia: {str(e)}")
+            return None
+    
+    def _create_reader(
+        self,
+        qa_pipeline: Optional["Pipeline"],
+        worker_pool: Optional["InferenceWorkerPool"]
+    ) -> Optional["SpanReader"]:
+        # El lector con contexto pre-tokenizado necesita un tokenizador rápido (offsets)
+        if qa_pipeline is None or not getattr(qa_pipeline.tokenizer, "is_fast", False):
+            return None
+        try:
+            from app.services.reader import SpanReader
+            return SpanReader(
+                qa_pipeline.model, qa_pipeline.tokenizer, qa_pipeline.device,
+                forward=worker_pool.forward if worker_pool else None,
+                search=self.window_search,
+                early_exit_score=self.early_exit_score,
+                adaptive_windows=self.adaptive_windows
+            )
+        except Exception as e:
+            logger.warning(f"No se pudo crear el lector con contexto pre-tokenizado: {str(e)}")
+            return None
+    
+    def _acquire(self) -> _ModelInstance:
+        with self._lock:
+            instance = self._active
+            instance.in_flight += 1
+        return instance
+    
+    def _release(self, instance: _ModelInstance):
+        with self._lock:
+            instance.in_flight -= 1
+            close = instance.retired and instance.in_flight == 0
+        if close:
+            instance.close()
+    
+    def get_pipeline(self) -> Optional["Pipeline"]:
+        return self._active.qa_pipeline
+    
+    def get_tokenizer(self):
+        """Tokenizador con el que se debe pre-tokenizar el contexto (None si no se usa)"""
+        reader = self._active.reader
+        return reader.tokenizer if reader else None
+    
+    def answer_batch(
+        self,
+        questions: List[str],
+        contexts: List[RetrievedContext],
+        timings: Optional[Dict[str, float]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Responde varias preguntas en un solo lote. Las posiciones devueltas
+        son relativas al documento completo. Si se pasa timings, se suman en
+        él los segundos de cada etapa del modelo.
+        """
+        # El lote termina en la instancia con la que empezó aunque entre tanto se cambie el modelo
+        instance = self._acquire()
+        try:
+            return instance.answer_batch(questions, contexts, timings)
+        finally:
+            self._release(instance)
+    
+    def submit_batch(
+        self,
+        questions: List[str],
+        contexts: List[RetrievedContext],
+        timings: Optional[Dict[str, float]] = None
+    ) -> Future:
+        """Encola un lote en el ejecutor de inferencia"""
+        profiler = self.profiler
+        if profiler is not None and profiler.active:
+            return self.executor.submit(profiler.run, self.answer_batch, len(questions), questions, contexts, timings)
+        return self.executor.submit(self.answer_batch, questions, contexts, timings)
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+        self._active.close()
     
     def is_available(self) -> bool:
-        return self.qa_pipeline is not None
+        return self._active.qa_pipeline is not None
+    
+    def reload_model(
+        self,
+        check_question: str,
+        check_context: RetrievedContext,
+        on_swap: Optional[Callable[[], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Inicia la recarga del modelo en segundo plano y devuelve el trabajo.
+        
+        El modelo nuevo se carga y se comprueba con check_question (lo que
+        además lo calienta) antes de sustituir al actual; si algo falla se
+        sigue usando el actual. on_swap se llama justo tras el intercambio.
+        """
+        with self._lock:
+            if self._reload_thread is not None and self._reload_thread.is_alive():
+                # Solo una recarga a la vez: se devuelve la que está en curso
+                return dict(next(reversed(self._reload_jobs.values())))
+            
+            job = {
+                "job_id": uuid.uuid4().hex,
+                "status": "loading",
+                "started_at": time.time(),
+                "finished_at": None,
+                "error": None
+            }
+            self._reload_jobs[job["job_id"]] = job
+            while len(self._reload_jobs) > _MAX_RELOAD_JOBS:
+                self._reload_jobs.popitem(last=False)
+            self._reload_thread = threading.Thread(
+                target=self._run_reload,
+                args=(job, check_question, check_context, on_swap),
+                name="qa-model-reload",
+                daemon=True
+            )
+            self._reload_thread.start()
+            return dict(job)
+    
+    def get_reload_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._reload_jobs.get(job_id)
+            return dict(job) if job else None
     
-    def reload_model(self) -> bool:
+    def _run_reload(
+        self,
+        job: Dict[str, Any],
+        check_question: str,
+        check_context: RetrievedContext,
+        on_swap: Optional[Callable[[], None]]
+    ):
+        instance = None
         try:
-            self.qa_pipeline = self._load_model()
-            if self.qa_pipeline:
-                self.model_loaded_at = time.time()
-            return self.is_available()
+            logger.info(f"Recarga del modelo {job['job_id']}: cargando {self.model_name}")
+            instance = self._create_instance()
+            if instance.qa_pipeline is None:
+                raise RuntimeError("No se pudo cargar el modelo")
+            
+            job["status"] = "checking"
+            result = instance.answer_batch([check_question], [check_context])[0]
+            if not math.isfinite(result["score"]) or not 0 <= result["start"] <= result["end"] <= len(check_context.document):
+                raise RuntimeError(f"Resultado inválido en la comprobación del modelo nuevo: {result}")
+            
+            with self._lock:
+                previous, self._active = self._active, instance
+                previous.retired = True
+                close = previous.in_flight == 0
+            # Las peticiones en curso terminan en la instancia anterior; se libera al acabar la última
+            if close:
+                previous.close()
+            instance = None
+            
+            if on_swap is not None:
+                on_swap()
+            job["status"] = "completed"
+            logger.info(f"Recarga del modelo {job['job_id']} completada")
         except Exception as e:
-            logger.error(f"Error al recargar el modelo: {str(e)}", exc_info=True)
-            return False
+            if instance is not None:
+                instance.close()
+            job["status"] = "failed"
+            job["error"] = str(e)
+            logger.error(f"Error al recargar el modelo ({job['job_id']}): {str(e)}", exc_info=True)
+        finally:
+            job["finished_at"] = time.time()
     
     def get_model_info(self) -> Dict[str, Any]:
         return {
             "name": self.model_name,
             "device": self.device,
+            "backend": self.backend,
             "available": self.is_available(),
-            "loaded_at": self.model_loaded_at
-        }
\ No newline at end of file
+            "inference_workers": self.inference_workers,
+            "inference_processes": self.inference_processes,
+            "loaded_at": self._active.loaded_at,
+            "window_search": self._active.reader.get_stats() if self._active.reader else None
+        }
@@ -0,0 +1,246 @@
+import cProfile
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from app.config import logger
+
+MODES = ("cprofile", "torch")
+
+# Límites de las pilas reconstruidas a partir de cProfile: profundidad y tiempo mínimo (s) de una rama
+_MAX_DEPTH = 64
+_MIN_BRANCH_SECONDS = 1e-5
+
+# Direcciones de memoria en los nombres de los eventos de torch ("... object at 0x7f...")
+_ADDRESS_RE = re.compile(r" at 0x[0-9a-f]+")
+
+class InferenceProfiler:
+    """
+    Perfilado bajo demanda de los lotes de inferencia (tokenización, forward
+    del modelo y decodificación de respuestas).
+    
+    Una sesión perfila las preguntas de los próximos lotes hasta sumar
+    max_requests o hasta que pasen seconds segundos, y acumula el resultado
+    como pilas colapsadas ("marco;marco;marco valor", en microsegundos),
+    el formato que leen flamegraph.pl y speedscope. sample_rate perfila solo
+    una fracción de los lotes. Se perfila un lote a la vez: los que coinciden
+    con otro perfilado corren sin perfilar.
+    
+    Sin sesión activa el único coste es comprobar el atributo active antes
+    de enviar cada lote al ejecutor. Con INFERENCE_PROCESSES el forward corre
+    en otros procesos y solo se ve como espera.
+    """
+    
+    def __init__(self):
+        self.active = False
+        self._lock = threading.Lock()
+        self._busy = threading.Lock()
+        self._reset_session(None, 0, 0, 1.0)
+    
+    def _reset_session(self, mode: Optional[str], max_requests: int, seconds: float, sample_rate: float):
+        self.mode = mode
+        self.max_requests = max_requests
+        self.sample_rate = sample_rate
+        self.started_at = time.time() if mode else None
+        self.ends_at = self.started_at + seconds if mode and seconds else None
+        self.finished_at = None
+        self.profiled_batches = 0
+        self.profiled_requests = 0
+        self.skipped_batches = 0
+        self.profiled_seconds = 0.0
+        self._stacks: Counter = Counter()
+        self._stats: Optional[pstats.Stats] = None
+    
+    def start(self, mode: str, max_requests: int = 0, seconds: float = 0, sample_rate: float = 1.0) -> bool:
+        """Inicia una sesión; devuelve False si ya hay una activa"""
+        if mode not in MODES:
+            raise ValueError(f"Modo de perfilado desconocido: {mode}")
+        with self._lock:
+            if self.active:
+                return False
+            self._reset_session(mode, max_requests, seconds, sample_rate)
+            self.active = True
+        logger.info(
+            f"Perfilado {mode} iniciado (preguntas={max_requests or 'sin límite'}, "
+            f"segundos={seconds or 'sin límite'}, muestreo={sample_rate})"
+        )
+        return True
+    
+    def stop(self):
+        with self._lock:
+            self._finish()
+    
+    def _finish(self):
+        if self.active:
+            self.active = False
+            self.finished_at = time.time()
+            logger.info(f"Perfilado {self.mode} terminado: {self.profiled_requests} preguntas en {self.profiled_batches} lotes")
+    
+    def _expire(self):
+        # Se llama con self._lock tomado
+        if self.active and self.ends_at is not None and time.time() >= self.ends_at:
+            self._finish()
+    
+    def _claim(self, batch_size: int) -> bool:
+        """Decide si este lote se perfila y lo descuenta de la sesión"""
+        with self._lock:
+            self._expire()
+            if not self.active or random.random() >= self.sample_rate:
+                return False
+            if not self._busy.acquire(blocking=False):
+                self.skipped_batches += 1
+                return False
+            self.profiled_batches += 1
+            self.profiled_requests += batch_size
+            if self.max_requests and self.profiled_requests >= self.max_requests:
+                self._finish()
+            return True
+    
+    def run(self, function: Callable, batch_size: int, *args):
+        """Ejecuta function(*args) (un lote de batch_size preguntas), perfilándola si le toca"""
+        if not self._claim(batch_size):
+            return function(*args)
+        try:
+            start = time.perf_counter()
+            if self.mode == "torch":
+                result, stacks = self._run_torch(function, args)
+            else:
+                result, stacks = self._run_cprofile(function, args)
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._stacks.update(stacks)
+                self.profiled_seconds += elapsed
+            return result
+        finally:
+            self._busy.release()
+    
+    def _run_cprofile(self, function: Callable, args: Tuple) -> Tuple[Any, Counter]:
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            result = function(*args)
+        finally:
+            profile.disable()
+        stats = pstats.Stats(profile)
+        stacks = _collapse_pstats(stats)
+        with self._lock:
+            if self._stats is None:
+                self._stats = stats
+            else:
+                self._stats.add(stats)
+        return result, stacks
+    
+    def _run_torch(self, function: Callable, args: Tuple) -> Tuple[Any, Counter]:
+        import torch
+        from torch.profiler import profile, ProfilerActivity
+        
+        options: Dict[str, Any] = {"activities": [ProfilerActivity.CPU], "with_stack": True}
+        try:
+            # Sin esta opción las versiones recientes no exportan las pilas de Python
+            options["experimental_config"] = torch._C._profiler._ExperimentalConfig(verbose=True)
+        except AttributeError:
+            pass
+        with profile(**options) as prof:
+            result = function(*args)
+        
+        # El perfilador también ve otros hilos (bucle de eventos, logging): solo cuentan
+        # los eventos bajo el marco del lote, y las pilas empiezan en él
+        code = function.__code__
+        marker = f"{os.path.basename(code.co_filename)}({code.co_firstlineno}): {code.co_name}"
+        stacks = Counter()
+        for event in prof.events():
+            frames = list(reversed(event.stack or ()))
+            roots = [i for i, frame in enumerate(frames) if frame.endswith(marker)]
+            value = int(event.self_cpu_time_total)
+            if roots and value > 0:
+                path = frames[roots[0]:] + [event.name]
+                stacks[";".join(_ADDRESS_RE.sub("", frame).replace(";", ",") for frame in path)] += value
+        return result, stacks
+    
+    def collapsed(self) -> str:
+        """Resultado acumulado en formato de pilas colapsadas"""
+        with self._lock:
+            stacks = dict(self._stacks)
+        return "".join(f"{stack} {value}\n" for stack, value in sorted(stacks.items()) if value > 0)
+    
+    def top_functions(self, limit: int = 30) -> List[Dict[str, Any]]:
+        """Funciones con más tiempo acumulado (solo en modo cprofile)"""
+        with self._lock:
+            if self._stats is None:
+                return []
+            entries = self._stats.stats.items()
+            top = sorted(entries, key=lambda entry: entry[1][3], reverse=True)[:limit]
+        return [
+            {
+                "function": _frame_name(function),
+                "calls": calls,
+                "self_ms": self_time * 1000,
+                "cumulative_ms": cumulative * 1000
+            }
+            for function, (_, calls, self_time, cumulative, _) in top
+        ]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire()
+            return {
+                "active": self.active,
+                "mode": self.mode,
+                "max_requests": self.max_requests,
+                "sample_rate": self.sample_rate,
+                "started_at": self.started_at,
+                "ends_at": self.ends_at,
+                "finished_at": self.finished_at,
+                "profiled_batches": self.profiled_batches,
+                "profiled_requests": self.profiled_requests,
+                "skipped_batches": self.skipped_batches,
+                "profiled_seconds": self.profiled_seconds,
+                "stacks": len(self._stacks)
+            }
+
+def _frame_name(function: Tuple[str, int, str]) -> str:
+    filename, line, name = function
+    # El formato colapsado separa los marcos con ";"
+    name = name.replace(";", ",")
+    if filename == "~":
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+def _collapse_pstats(stats: pstats.Stats) -> Counter:
+    """
+    Reconstruye pilas aproximadas a partir del grafo de llamadas de cProfile,
+    que solo guarda pares llamador-llamado: el tiempo de cada función se
+    reparte entre sus llamadores en proporción al tiempo que aportó cada uno.
+    """
+    callees: Dict[Tuple, List[Tuple[Tuple, float]]] = {}
+    roots = []
+    for function, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            roots.append(function)
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((function, edge[3]))
+    
+    stacks = Counter()
+    
+    def walk(function: Tuple, path: List[str], on_path: set, fraction: float):
+        self_time = stats.stats[function][2]
+        path = path + [_frame_name(function)]
+        value = int(self_time * fraction * 1e6)
+        if value > 0:
+            stacks[";".join(path)] += value
+        if len(path) >= _MAX_DEPTH:
+            return
+        for callee, edge_cumulative in callees.get(function, ()):
+            callee_cumulative = stats.stats[callee][3]
+            # Las ramas despreciables se omiten: el número de caminos crece muy rápido
+            if callee in on_path or fraction * edge_cumulative < _MIN_BRANCH_SECONDS:
+                continue
+            walk(callee, path, on_path | {callee}, fraction * edge_cumulative / callee_cumulative)
+    
+    for root in roots:
+        walk(root, [], {root}, 1.0)
+    return stacks
@@ -0,0 +1,357 @@
+import time
+import threading
+import numpy as np
+import torch
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from app.config import logger
+from app.services.encoding import ContextEncoding
+from app.services.retrieval import Passage
+
+SEARCH_MODES = ("exhaustive", "early_exit", "parity")
+
+# Recibe los trozos de un lote (arrays de entrada del modelo) y devuelve sus logits de inicio y fin
+ForwardFn = Callable[[List[Dict[str, np.ndarray]]], List[Tuple[np.ndarray, np.ndarray]]]
+
+def _masked_softmax(logits: np.ndarray, allowed: np.ndarray) -> np.ndarray:
+    masked = np.where(allowed, logits, -10000.0)
+    probabilities = np.exp(masked - masked.max())
+    return probabilities / probabilities.sum()
+
+class _PairTemplate:
+    """Tokens especiales que el tokenizador coloca alrededor de (pregunta, contexto)"""
+    
+    def __init__(self, tokenizer):
+        probe = tokenizer("a", "b", return_token_type_ids=True)
+        ids = probe["input_ids"]
+        types = probe.get("token_type_ids") or [0] * len(ids)
+        sequence_ids = probe.sequence_ids()
+        
+        question = [i for i, s in enumerate(sequence_ids) if s == 0]
+        context = [i for i, s in enumerate(sequence_ids) if s == 1]
+        self.prefix = ids[:question[0]]
+        self.middle = ids[question[-1] + 1:context[0]]
+        self.suffix = ids[context[-1] + 1:]
+        self.prefix_types = types[:question[0]]
+        self.middle_types = types[question[-1] + 1:context[0]]
+        self.suffix_types = types[context[-1] + 1:]
+        self.question_type = types[question[0]]
+        self.context_type = types[context[0]]
+    
+    def build(self, question_ids: List[int], context_ids: List[int]) -> Tuple[List[int], List[int], int]:
+        input_ids = self.prefix + question_ids + self.middle + context_ids + self.suffix
+        token_types = (
+            self.prefix_types
+            + [self.question_type] * len(question_ids)
+            + self.middle_types
+            + [self.context_type] * len(context_ids)
+            + self.suffix_types
+        )
+        context_offset = len(self.prefix) + len(question_ids) + len(self.middle)
+        return input_ids, token_types, context_offset
+
+class SpanReader:
+    """
+    Extrae respuestas usando la tokenización del contexto ya calculada:
+    por petición solo se tokeniza la pregunta.
+    """
+    
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        device,
+        max_windows_per_forward: int = 32,
+        forward: Optional[ForwardFn] = None,
+        search: str = "exhaustive",
+        early_exit_score: float = 1.0,
+        adaptive_windows: bool = False
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_windows_per_forward = max_windows_per_forward
+        # Por defecto el modelo se ejecuta en este proceso; el pool de procesos aporta su propia función
+        self.forward = forward or self._forward_local
+        self.template = _PairTemplate(tokenizer)
+        self.use_token_types = "token_type_ids" in tokenizer.model_input_names
+        # exhaustive: todas las ventanas; early_exit: por prioridad hasta una respuesta con early_exit_score;
+        # parity: responde como exhaustive y compara con early_exit
+        if search not in SEARCH_MODES:
+            raise ValueError(f"Modo de búsqueda desconocido: {search}")
+        self.search = search
+        self.early_exit_score = early_exit_score
+        self.adaptive_windows = adaptive_windows
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "questions": 0,
+            "windows": 0,
+            "windows_read": 0,
+            "early_exits": 0,
+            "parity_checks": 0,
+            "parity_mismatches": 0
+        }
+    
+    def answer_batch(
+        self,
+        items: List[Tuple[str, ContextEncoding, List[Passage]]],
+        handle_impossible_answer: bool = True,
+        max_answer_len: int = 15,
+        timings: Optional[Dict[str, float]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Responde cada (pregunta, codificación, pasajes recuperados) leyendo
+        las ventanas de todo el lote juntas.
+        
+        Si se pasa timings, suma en él los segundos de tokenization, forward y postprocess.
+        """
+        started = time.perf_counter()
+        question_ids = self.tokenizer(
+            [question for question, _, _ in items],
+            add_special_tokens=False,
+            truncation=True,
+            max_length=max(encoding.max_question_len for _, encoding, _ in items)
+        )["input_ids"]
+        question_ids = [q_ids[:encoding.max_question_len] for (_, encoding, _), q_ids in zip(items, question_ids)]
+        clock = {"tokenization": time.perf_counter() - started, "forward": 0.0}
+        
+        stats = {"questions": len(items), "windows": 0, "windows_read": 0, "early_exits": 0}
+        if self.search == "exhaustive":
+            results = self._search_exhaustive(items, question_ids, handle_impossible_answer, max_answer_len, clock, stats)
+        elif self.search == "early_exit":
+            results = self._search_early_exit(items, question_ids, handle_impossible_answer, max_answer_len, clock, stats)
+        else:
+            # Se sirve la respuesta exhaustiva; las ventanas contadas son las que habría leído early_exit.
+            # Se leen las mismas ventanas que early_exit: las diferencias se deben solo a la salida temprana
+            results = self._search_exhaustive(items, question_ids, handle_impossible_answer, max_answer_len, clock, {
+                "windows": 0, "windows_read": 0
+            }, adaptive_windows=self.adaptive_windows)
+            fast = self._search_early_exit(items, question_ids, handle_impossible_answer, max_answer_len, clock, stats)
+            stats["parity_checks"] = len(items)
+            stats["parity_mismatches"] = 0
+            for (question, _, _), exact, result in zip(items, results, fast):
+                if (exact["answer"], exact["start"], exact["end"]) != (result["answer"], result["start"], result["end"]):
+                    stats["parity_mismatches"] += 1
+                    logger.warning(
+                        "Búsqueda con salida temprana distinta de la exhaustiva para '%s': '%s' (%d-%d) frente a '%s' (%d-%d)",
+                        question, result["answer"], result["start"], result["end"],
+                        exact["answer"], exact["start"], exact["end"],
+                        extra={"log_type": "parity_mismatch"}
+                    )
+        
+        with self._stats_lock:
+            for key, value in stats.items():
+                self._stats[key] += value
+        
+        if timings is not None:
+            timings["tokenization"] = timings.get("tokenization", 0.0) + clock["tokenization"]
+            timings["forward"] = timings.get("forward", 0.0) + clock["forward"]
+            timings["postprocess"] = timings.get("postprocess", 0.0) + (
+                time.perf_counter() - started - clock["tokenization"] - clock["forward"]
+            )
+        return results
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["search"] = self.search
+        stats["early_exit_score"] = self.early_exit_score
+        stats["adaptive_windows"] = self.adaptive_windows
+        stats["windows_saved"] = 1 - stats["windows_read"] / stats["windows"] if stats["windows"] else 0
+        return stats
+    
+    def _search_exhaustive(
+        self,
+        items: List[Tuple[str, ContextEncoding, List[Passage]]],
+        question_ids: List[List[int]],
+        handle_impossible_answer: bool,
+        max_answer_len: int,
+        clock: Dict[str, float],
+        stats: Dict[str, int],
+        adaptive_windows: bool = False
+    ) -> List[Dict[str, Any]]:
+        """Lee todas las ventanas de los pasajes en un único paso hacia adelante por lote"""
+        start = time.perf_counter()
+        features = [
+            self._feature(item_index, q_ids, encoding, window)
+            for item_index, ((_, encoding, passages), q_ids) in enumerate(zip(items, question_ids))
+            for window in encoding.windows_for(passages, len(q_ids) if adaptive_windows else None)
+        ]
+        clock["tokenization"] += time.perf_counter() - start
+        
+        candidates: List[List[Dict[str, Any]]] = [[] for _ in items]
+        null_scores: List[List[float]] = [[] for _ in items]
+        self._read(items, features, max_answer_len, candidates, null_scores, clock)
+        stats["windows"] += len(features)
+        stats["windows_read"] += len(features)
+        return self._best_answers(candidates, null_scores, handle_impossible_answer)
+    
+    def _search_early_exit(
+        self,
+        items: List[Tuple[str, ContextEncoding, List[Passage]]],
+        question_ids: List[List[int]],
+        handle_impossible_answer: bool,
+        max_answer_len: int,
+        clock: Dict[str, float],
+        stats: Dict[str, int]
+    ) -> List[Dict[str, Any]]:
+        """
+        Lee las ventanas por orden de prioridad (tokens de la pregunta que
+        contienen) en rondas de 1, 2, 4... ventanas por pregunta, y deja de
+        leer las de una pregunta en cuanto tiene un tramo con early_exit_score.
+        Cada tramo puntúa por sí solo (probabilidad de inicio por la de fin
+        dentro de su ventana): con early_exit_score >= 0.5 el tramo es más
+        probable que todos los demás de su ventana juntos, aunque otra ventana
+        sin leer aún podría tener uno mejor (el modo parity mide cuántas veces).
+        Con adaptive_windows, las ventanas se adaptan a la longitud de la pregunta.
+        """
+        start = time.perf_counter()
+        queues = []
+        for (_, encoding, passages), q_ids in zip(items, question_ids):
+            question_tokens = set(q_ids)
+            windows = encoding.windows_for(passages, len(q_ids) if self.adaptive_windows else None)
+            # sorted es estable: a igual prioridad se conserva el orden del documento
+            queues.append(sorted(
+                windows, key=lambda window: -len(question_tokens.intersection(encoding.input_ids[window[0]:window[1]]))
+            ))
+            stats["windows"] += len(encoding.windows_for(passages))
+        clock["tokenization"] += time.perf_counter() - start
+        
+        candidates: List[List[Dict[str, Any]]] = [[] for _ in items]
+        null_scores: List[List[float]] = [[] for _ in items]
+        pending = list(range(len(items)))
+        round_size = 1
+        while pending:
+            start = time.perf_counter()
+            features = []
+            for item_index in pending:
+                windows, queues[item_index] = queues[item_index][:round_size], queues[item_index][round_size:]
+                features.extend(
+                    self._feature(item_index, question_ids[item_index], items[item_index][1], window) for window in windows
+                )
+            clock["tokenization"] += time.perf_counter() - start
+            
+            self._read(items, features, max_answer_len, candidates, null_scores, clock)
+            stats["windows_read"] += len(features)
+            
+            remaining = []
+            for item_index in pending:
+                if any(answer["score"] >= self.early_exit_score for answer in candidates[item_index]):
+                    if queues[item_index]:
+                        stats["early_exits"] += 1
+                elif queues[item_index]:
+                    remaining.append(item_index)
+            pending = remaining
+            round_size *= 2
+        return self._best_answers(candidates, null_scores, handle_impossible_answer)
+    
+    def _feature(self, item_index: int, q_ids: List[int], encoding: ContextEncoding, window: Tuple[int, int]):
+        input_ids, token_types, context_offset = self.template.build(q_ids, encoding.input_ids[window[0]:window[1]])
+        return item_index, window, input_ids, token_types, context_offset
+    
+    def _read(
+        self,
+        items: List[Tuple[str, ContextEncoding, List[Passage]]],
+        features: List[Tuple[int, Tuple[int, int], List[int], List[int], int]],
+        max_answer_len: int,
+        candidates: List[List[Dict[str, Any]]],
+        null_scores: List[List[float]],
+        clock: Dict[str, float]
+    ):
+        """Pasa las ventanas por el modelo y añade los tramos candidatos de cada pregunta"""
+        start = time.perf_counter()
+        logits = self._forward([(feature[2], feature[3]) for feature in features])
+        clock["forward"] += time.perf_counter() - start
+        for (item_index, window, input_ids, _, context_offset), (start_logits, end_logits) in zip(features, logits):
+            null_scores[item_index].append(self._decode_window(
+                items[item_index][1], window, input_ids, context_offset,
+                start_logits, end_logits, max_answer_len, candidates[item_index]
+            ))
+    
+    @staticmethod
+    def _best_answers(
+        candidates: List[List[Dict[str, Any]]],
+        null_scores: List[List[float]],
+        handle_impossible_answer: bool
+    ) -> List[Dict[str, Any]]:
+        results = []
+        for answers, item_null_scores in zip(candidates, null_scores):
+            if handle_impossible_answer and item_null_scores:
+                answers.append({"score": min(item_null_scores), "start": 0, "end": 0, "answer": ""})
+            if not answers:
+                answers.append({"score": 0.0, "start": 0, "end": 0, "answer": ""})
+            results.append(max(answers, key=lambda answer: answer["score"]))
+        return results
+    
+    def _forward(self, inputs: List[Tuple[List[int], List[int]]]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        pad_id = self.tokenizer.pad_token_id or 0
+        chunks = []
+        model_inputs = []
+        for chunk_start in range(0, len(inputs), self.max_windows_per_forward):
+            chunk = inputs[chunk_start:chunk_start + self.max_windows_per_forward]
+            length = max(len(input_ids) for input_ids, _ in chunk)
+            arrays = {
+                "input_ids": np.array([ids + [pad_id] * (length - len(ids)) for ids, _ in chunk], dtype=np.int64),
+                "attention_mask": np.array([[1] * len(ids) + [0] * (length - len(ids)) for ids, _ in chunk], dtype=np.int64)
+            }
+            if self.use_token_types:
+                arrays["token_type_ids"] = np.array(
+                    [types + [0] * (length - len(types)) for _, types in chunk], dtype=np.int64
+                )
+            chunks.append(chunk)
+            model_inputs.append(arrays)
+        
+        outputs = []
+        for chunk, (start_logits, end_logits) in zip(chunks, self.forward(model_inputs)):
+            for row, (ids, _) in enumerate(chunk):
+                outputs.append((start_logits[row, :len(ids)], end_logits[row, :len(ids)]))
+        return outputs
+    
+    def _forward_local(self, model_inputs: List[Dict[str, np.ndarray]]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        logits = []
+        for arrays in model_inputs:
+            with torch.inference_mode():
+                output = self.model(**{name: torch.from_numpy(array).to(self.device) for name, array in arrays.items()})
+            logits.append((output.start_logits.float().cpu().numpy(), output.end_logits.float().cpu().numpy()))
+        return logits
+    
+    def _decode_window(
+        self,
+        encoding: ContextEncoding,
+        window: Tuple[int, int],
+        input_ids: List[int],
+        context_offset: int,
+        start_logits: np.ndarray,
+        end_logits: np.ndarray,
+        max_answer_len: int,
+        answers: List[Dict[str, Any]]
+    ) -> float:
+        """Añade a answers el mejor tramo de la ventana y devuelve su puntuación de respuesta vacía"""
+        context_end = context_offset + window[1] - window[0]
+        allowed = np.zeros(len(input_ids), dtype=bool)
+        allowed[context_offset:context_end] = True
+        # El token CLS se mantiene en la normalización (indica preguntas sin respuesta)
+        if self.tokenizer.cls_token_id is not None:
+            allowed |= np.array(input_ids) == self.tokenizer.cls_token_id
+        
+        start = _masked_softmax(start_logits, allowed)
+        end = _masked_softmax(end_logits, allowed)
+        
+        null_score = float(start[0] * end[0])
+        start[:context_offset] = 0.0
+        end[:context_offset] = 0.0
+        start[context_end:] = 0.0
+        end[context_end:] = 0.0
+        
+        # Como el pipeline de transformers con top_k=1: solo el mejor tramo de cada ventana, sin sumar
+        # puntuaciones entre tramos ni ventanas (el score sigue siendo una probabilidad entre 0 y 1)
+        scores = np.tril(np.triu(np.outer(start, end)), max_answer_len - 1)
+        start_token, end_token = np.unravel_index(int(np.argmax(scores)), scores.shape)
+        score = float(scores[start_token, end_token])
+        if score > 0:
+            start_char = encoding.char_starts[window[0] + int(start_token) - context_offset]
+            end_char = encoding.char_ends[window[0] + int(end_token) - context_offset]
+            answers.append({
+                "score": score, "start": start_char, "end": end_char,
+                "answer": encoding.document[start_char:end_char]
+            })
+        return null_score
@@ -0,0 +1,182 @@
+import re
+import math
+from bisect import bisect_right
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+from app.services.text import fold_text
+
+_WORD_RE = re.compile(r"\w+")
+_PARAGRAPH_BREAK_RE = re.compile(r"\n\s*\n")
+
+def _stem(word: str) -> str:
+    # Reducción mínima de plurales ("teléfonos" -> "telefono")
+    return word[:-1] if len(word) > 3 and word.endswith("s") else word
+
+def tokenize(text: str) -> List[str]:
+    return [_stem(word) for word in _WORD_RE.findall(fold_text(text))]
+
+class Passage:
+    __slots__ = ("index", "start", "end", "text")
+    
+    def __init__(self, index: int, start: int, end: int, text: str):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.text = text
+
+def _paragraph_spans(text: str) -> List[Tuple[int, int]]:
+    spans = []
+    position = 0
+    for separator in _PARAGRAPH_BREAK_RE.finditer(text + "\n\n"):
+        chunk = text[position:separator.start()]
+        if chunk.strip():
+            start = position + len(chunk) - len(chunk.lstrip())
+            end = position + len(chunk.rstrip())
+            spans.append((start, end))
+        position = separator.end()
+    return spans
+
+def _split_long_span(text: str, start: int, end: int, max_chars: int) -> List[Tuple[int, int]]:
+    spans = []
+    while end - start > max_chars:
+        window = text[start:start + max_chars]
+        # Cortar preferiblemente al final de una oración, si no en un espacio
+        cut = max(window.rfind(". "), window.rfind("\n"))
+        if cut < max_chars // 2:
+            cut = window.rfind(" ")
+        if cut <= 0:
+            cut = max_chars - 1
+        spans.append((start, start + cut + 1))
+        start += cut + 1
+        while start < end and text[start].isspace():
+            start += 1
+    if start < end:
+        spans.append((start, end))
+    return spans
+
+def split_passages(text: str, max_chars: int = 500) -> List[Passage]:
+    """Divide el texto en pasajes de hasta max_chars caracteres respetando los párrafos"""
+    spans: List[Tuple[int, int]] = []
+    for start, end in _paragraph_spans(text):
+        spans.extend(_split_long_span(text, start, end, max_chars))
+    
+    merged: List[Tuple[int, int]] = []
+    for start, end in spans:
+        if merged and end - merged[-1][0] <= max_chars:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    
+    return [Passage(i, start, end, text[start:end]) for i, (start, end) in enumerate(merged)]
+
+class RetrievedContext:
+    """Contexto reducido a los pasajes recuperados, con el mapa de offsets al documento completo"""
+    
+    def __init__(
+        self,
+        document: str,
+        passages: List[Passage],
+        encoding=None,
+        separator: str = "\n\n",
+        version: int = 0
+    ):
+        self.document = document
+        self.passages = sorted(passages, key=lambda p: p.index)
+        # Versión del contexto con la que se recuperaron los pasajes
+        self.version = version
+        # Tokenización precalculada del documento (ContextEncoding), si está disponible
+        self.encoding = encoding
+        # (inicio en el texto reducido, inicio en el documento, longitud)
+        self.segments: List[Tuple[int, int, int]] = []
+        
+        # Los pasajes consecutivos se unen con el texto original que los separa
+        runs: List[List[int]] = []
+        for passage in self.passages:
+            if runs and runs[-1][2] == passage.index - 1:
+                runs[-1][1] = passage.end
+                runs[-1][2] = passage.index
+            else:
+                runs.append([passage.start, passage.end, passage.index])
+        
+        parts = []
+        position = 0
+        for doc_start, doc_end, _ in runs:
+            if parts:
+                parts.append(separator)
+                position += len(separator)
+            self.segments.append((position, doc_start, doc_end - doc_start))
+            parts.append(document[doc_start:doc_end])
+            position += doc_end - doc_start
+        self.text = "".join(parts)
+        self._segment_starts = [segment[0] for segment in self.segments]
+    
+    def to_document_offset(self, position: int) -> int:
+        """Convierte una posición del texto reducido en una posición del documento completo"""
+        if not self.segments:
+            return position
+        reduced_start, doc_start, length = self.segments[max(0, bisect_right(self._segment_starts, position) - 1)]
+        return doc_start + min(max(0, position - reduced_start), length)
+
+class PassageIndex:
+    """Índice BM25 en memoria sobre los pasajes de un documento"""
+    
+    def __init__(
+        self,
+        document: str,
+        max_chars: int = 500,
+        k1: float = 1.5,
+        b: float = 0.75,
+        version: int = 0,
+        previous: Optional["PassageIndex"] = None
+    ):
+        self.document = document
+        self.passages = split_passages(document, max_chars)
+        self.k1 = k1
+        self.b = b
+        self.version = version
+        self.encoding = None
+        
+        # Los pasajes que no cambiaron respecto al índice anterior reutilizan su análisis
+        reusable = previous._terms if previous is not None else {}
+        self._terms: Dict[str, Counter] = {}
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.lengths: List[int] = []
+        for passage in self.passages:
+            terms = reusable.get(passage.text)
+            if terms is None:
+                terms = Counter(tokenize(passage.text))
+            self._terms[passage.text] = terms
+            self.lengths.append(sum(terms.values()))
+            for term, frequency in terms.items():
+                self.postings[term].append((passage.index, frequency))
+        
+        total = len(self.passages)
+        self.avg_length = sum(self.lengths) / total if total else 0
+        self.idf = {
+            term: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+    
+    def search(self, query: str, top_k: int) -> List[Tuple[Passage, float]]:
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for index, frequency in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[index] / (self.avg_length or 1))
+                scores[index] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(self.passages[index], score) for index, score in ranked]
+    
+    def retrieve(self, query: str, top_k: int) -> RetrievedContext:
+        """Devuelve el contexto formado por los top_k pasajes más relevantes para la pregunta"""
+        if top_k <= 0 or len(self.passages) <= top_k:
+            return RetrievedContext(self.document, self.passages, self.encoding, version=self.version)
+        
+        passages = [passage for passage, _ in self.search(query, top_k)]
+        if not passages:
+            # Sin coincidencias léxicas: se usan los primeros pasajes del documento
+            passages = self.passages[:top_k]
+        return RetrievedContext(self.document, passages, self.encoding, version=self.version)
@@ -0,0 +1,48 @@
+import json
+from typing import Any, Dict
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(data: Any) -> bytes:
+    """JSON compacto en UTF-8 (con orjson si está instalado)"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def encode_response(response: Dict[str, Any]) -> bytes:
+    """
+    Codifica una vez una respuesta de la API para guardarla en caché.
+    
+    response_time se omite: es propio de cada petición y se añade al servir
+    con with_response_time.
+    """
+    return dumps({key: value for key, value in response.items() if key != "response_time"})
+
+def merge(*objects: bytes) -> bytes:
+    """Une objetos JSON ya codificados en uno solo (sin claves repetidas entre ellos)"""
+    return b"{" + b",".join(data[1:-1] for data in objects if len(data) > 2) + b"}"
+
+def with_response_time(body: bytes, seconds: float) -> bytes:
+    """Añade response_time a una respuesta codificada por encode_response, sin volver a codificarla"""
+    return b"%s,\"response_time\":%r}" % (body[:-1], seconds)
+
+class FastJSONResponse(JSONResponse):
+    """
+    Respuesta JSON compacta. Si recibe bytes ya codificados los envía tal
+    cual; devolverla desde un endpoint evita además que FastAPI valide el
+    contenido contra el response_model.
+    """
+    
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
@@ -0,0 +1,276 @@
+import time
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from app.config import logger
+from app.services.cache import CacheBackend
+from app.services.serialization import encode_response, loads
+from app.services.text import normalize_question
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS namespaces (
+    namespace TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS responses (
+    namespace TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    generation INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    question TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (namespace, fingerprint, generation, key)
+);
+CREATE INDEX IF NOT EXISTS responses_created_at ON responses (namespace, created_at);
+"""
+
+# Solo se sirven las filas de la generación vigente del corpus: limpiar es subir la generación
+_SELECT = """
+SELECT r.response FROM responses r
+JOIN namespaces n ON n.namespace = r.namespace AND n.generation = r.generation
+WHERE r.namespace = ? AND r.fingerprint = ? AND r.key = ? AND r.created_at > ?
+"""
+
+_INSERT = """
+INSERT OR REPLACE INTO responses (namespace, fingerprint, generation, key, question, response, size, created_at)
+SELECT ?, ?, generation, ?, ?, ?, ?, ? FROM namespaces WHERE namespace = ?
+"""
+
+# Cada cuántas escrituras se aplican los límites de entradas y bytes
+_PRUNE_EVERY = 32
+
+# Formato de las respuestas guardadas; forma parte de la huella, así que al cambiarlo
+# las filas escritas por versiones anteriores dejan de servirse
+_FORMAT = 2
+
+class SharedResponseCache(CacheBackend):
+    """
+    Caché de respuestas en SQLite (modo WAL) compartida por todos los
+    workers del nodo: una respuesta calculada por un proceso la sirven todos,
+    y /clear-cache o /reload la vacían para todos.
+    
+    Las entradas se guardan bajo una huella del modelo y del contexto, de
+    modo que un worker nunca sirve respuestas calculadas con otro contexto,
+    aunque todavía no haya recargado el archivo. Las de otras huellas no se
+    borran al cambiar de contexto (durante una actualización escalonada otro
+    worker puede seguir usándolas): caducan por tiempo o se expulsan por los
+    límites de entradas y bytes, que se aplican quitando las más antiguas.
+    Los aciertos y fallos se cuentan por proceso.
+    """
+    
+    blocking = True
+    
+    def __init__(
+        self,
+        path: str,
+        namespace: str,
+        context_manager,
+        model_key: str = "",
+        timeout: int = 3600,
+        max_entries: int = 1000,
+        max_bytes: int = 16 * 1024 * 1024
+    ):
+        self.path = Path(path)
+        self.namespace = namespace
+        self.context_manager = context_manager
+        self.model_key = model_key
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.version = 0
+        self.fingerprint = self._fingerprint()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Todas las conexiones abiertas (una por hilo) para cerrarlas juntas
+        self._connections: List[sqlite3.Connection] = []
+        self._writes = 0
+        self.reset_stats()
+        
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connection() as connection:
+            connection.executescript(_SCHEMA)
+            connection.execute("INSERT OR IGNORE INTO namespaces (namespace) VALUES (?)", (namespace,))
+    
+    def _connection(self) -> sqlite3.Connection:
+        # Una conexión por hilo: el bucle de eventos y los hilos de trabajo no comparten cursores
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(str(self.path), timeout=10, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+    
+    def _fingerprint(self) -> str:
+        digest = hashlib.sha256(b"%d\0%s\0" % (_FORMAT, self.model_key.encode("utf-8")))
+        digest.update(self.context_manager.get_context().encode("utf-8"))
+        return digest.hexdigest()
+    
+    def _lookup(self, key: str) -> Optional[bytes]:
+        row = self._connection().execute(
+            _SELECT, (self.namespace, self.fingerprint, key, time.time() - self.timeout)
+        ).fetchone()
+        return row[0] if row else None
+    
+    def get_encoded(self, question: str) -> Optional[bytes]:
+        try:
+            body = self._lookup(normalize_question(question))
+        except sqlite3.Error as e:
+            logger.warning(f"Error al leer la caché compartida: {str(e)}")
+            body = None
+        if body is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return body
+    
+    def contains(self, question: str) -> bool:
+        try:
+            return self._lookup(normalize_question(question)) is not None
+        except sqlite3.Error:
+            return False
+    
+    def set(self, question: str, response: Dict[str, Any], version: Optional[int] = None):
+        if version is not None and version < self.version:
+            # Respuesta calculada con un contexto que ya cambió
+            return
+        self._insert([(normalize_question(question), question, time.time(), response)])
+    
+    def _insert(self, entries: List[Tuple[str, str, float, Dict[str, Any]]]):
+        rows = []
+        for key, question, created_at, response in entries:
+            # Se guarda como BLOB: se lee ya listo para enviar
+            data = encode_response(response)
+            size = len(key.encode("utf-8")) + len(data)
+            if size <= self.max_bytes:
+                rows.append((self.namespace, self.fingerprint, key, question, data, size, created_at, self.namespace))
+        if not rows:
+            return
+        try:
+            with self._connection() as connection:
+                connection.executemany(_INSERT, rows)
+        except sqlite3.Error as e:
+            logger.warning(f"Error al escribir en la caché compartida: {str(e)}")
+            return
+        
+        with self._lock:
+            self._writes += len(rows)
+            prune = self._writes >= _PRUNE_EVERY
+            if prune:
+                self._writes = 0
+        if prune:
+            self._prune()
+    
+    def clear(self):
+        """Vacía la caché del corpus para todos los workers"""
+        try:
+            with self._connection() as connection:
+                connection.execute(
+                    "UPDATE namespaces SET generation = generation + 1 WHERE namespace = ?", (self.namespace,)
+                )
+                connection.execute("DELETE FROM responses WHERE namespace = ?", (self.namespace,))
+        except sqlite3.Error as e:
+            logger.error(f"Error al limpiar la caché compartida: {str(e)}", exc_info=True)
+    
+    def invalidate(self, version: int):
+        """Pasa a la huella del contexto actual; las entradas de otros contextos dejan de servirse"""
+        with self._lock:
+            if version <= self.version:
+                return
+            self.version = version
+            fingerprint = self._fingerprint()
+            if fingerprint != self.fingerprint:
+                self.invalidations += 1
+            self.fingerprint = fingerprint
+    
+    def clean_expired(self):
+        self._prune()
+    
+    def export_entries(self) -> List[Tuple[str, str, float, int, Dict[str, Any]]]:
+        rows = self._connection().execute(
+            "SELECT r.key, r.question, r.created_at, r.response FROM responses r "
+            "JOIN namespaces n ON n.namespace = r.namespace AND n.generation = r.generation "
+            "WHERE r.namespace = ? AND r.fingerprint = ? AND r.created_at > ? ORDER BY r.created_at",
+            (self.namespace, self.fingerprint, time.time() - self.timeout)
+        ).fetchall()
+        return [(key, question, created_at, 0, loads(response)) for key, question, created_at, response in rows]
+    
+    def import_entries(self, entries: List[Tuple[str, str, float, int, Dict[str, Any]]]) -> int:
+        now = time.time()
+        fresh = [
+            (key, question, timestamp, response)
+            for key, question, timestamp, _, response in entries
+            if now - timestamp < self.timeout and not self.contains(question)
+        ]
+        self._insert(fresh)
+        return len(fresh)
+    
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def get_stats(self) -> Dict[str, Any]:
+        try:
+            entries, size = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses WHERE namespace = ? AND fingerprint = ?",
+                (self.namespace, self.fingerprint)
+            ).fetchone()
+        except sqlite3.Error:
+            entries, size = None, None
+        lookups = self.hits + self.misses
+        return {
+            "backend": "sqlite",
+            "path": str(self.path),
+            "entries": entries,
+            "size_bytes": size,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "context_version": self.version
+        }
+    
+    def close(self):
+        """Cierra las conexiones de todos los hilos (se llama al descargar el corpus o al apagar)"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                connection.close()
+            except sqlite3.Error as e:
+                logger.warning(f"Error al cerrar la caché compartida: {str(e)}")
+        self._local.connection = None
+    
+    def _prune(self):
+        """Borra lo caducado o de generaciones vaciadas y aplica los límites expulsando lo más antiguo"""
+        try:
+            with self._connection() as connection:
+                # No se filtra por huella: las filas de otros contextos pueden ser de workers que aún no recargaron
+                connection.execute(
+                    "DELETE FROM responses WHERE namespace = ? AND (created_at <= ? "
+                    "OR generation < (SELECT generation FROM namespaces WHERE namespace = ?))",
+                    (self.namespace, time.time() - self.timeout, self.namespace)
+                )
+                evicted = connection.execute(
+                    "DELETE FROM responses WHERE rowid IN ("
+                    "SELECT rowid FROM (SELECT rowid, "
+                    "ROW_NUMBER() OVER (ORDER BY created_at DESC) AS position, "
+                    "SUM(size) OVER (ORDER BY created_at DESC) AS total "
+                    "FROM responses WHERE namespace = ?) "
+                    "WHERE position > ? OR total > ?)",
+                    (self.namespace, self.max_entries, self.max_bytes)
+                ).rowcount
+            self.evictions += max(0, evicted)
+        except sqlite3.Error as e:
+            logger.warning(f"Error al depurar la caché compartida: {str(e)}")
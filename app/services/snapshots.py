@@ -0,0 +1,187 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from app.config import logger
+from app.services.corpora import Corpus
+from app.services.text import normalize_question
+
+_FORMAT = 1
+
+class CacheSnapshots:
+    """
+    Copias en disco de las cachés de respuestas, para no empezar en frío tras
+    un reinicio o un despliegue.
+    
+    Cada corpus se guarda en <directory>/<corpus>.json.gz cada interval
+    segundos (si cambió) y al apagar, y se restaura al cargarse. El archivo
+    registra el modelo y un hash del contexto: si alguno no coincide con el
+    actual, las respuestas se descartan y sus preguntas solo se usan para
+    recalentar la caché una vez cargado el modelo.
+    """
+    
+    def __init__(self, directory: str, model_key: str, interval: float = 300):
+        self.directory = Path(directory)
+        self.model_key = model_key
+        self.interval = interval
+        self.restored = 0
+        self.discarded = 0
+        self.saves = 0
+        # Preguntas de cada corpus según el último snapshot, las más consultadas primero
+        self._history: Dict[str, List[str]] = {}
+        self._saved_state: Dict[str, Any] = {}
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.directory.mkdir(parents=True, exist_ok=True)
+    
+    def path_for(self, name: str) -> Path:
+        return self.directory / f"{name}.json.gz"
+    
+    @staticmethod
+    def context_hash(corpus: Corpus) -> str:
+        return hashlib.sha256(corpus.context_manager.get_context().encode("utf-8")).hexdigest()
+    
+    def history(self, name: str) -> List[str]:
+        return list(self._history.get(name, ()))
+    
+    def restore(self, corpus: Corpus) -> int:
+        """Carga el snapshot del corpus en su caché si sigue siendo válido; devuelve las entradas restauradas"""
+        path = self.path_for(corpus.name)
+        if not path.exists():
+            return 0
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except Exception as e:
+            logger.warning(f"No se pudo leer el snapshot de caché {path}: {str(e)}")
+            return 0
+        
+        entries = snapshot.get("entries", [])
+        self._history[corpus.name] = [entry[1] for entry in sorted(entries, key=lambda entry: entry[3], reverse=True)]
+        
+        if (
+            snapshot.get("format") != _FORMAT
+            or snapshot.get("model") != self.model_key
+            or snapshot.get("context_hash") != self.context_hash(corpus)
+        ):
+            self.discarded += len(entries)
+            logger.info(f"Snapshot de caché de {corpus.name} descartado: cambió el modelo o el contexto")
+            return 0
+        
+        restored = corpus.cache.import_entries(entries)
+        self.restored += restored
+        logger.info(f"Caché de {corpus.name} restaurada desde disco: {restored} respuestas")
+        return restored
+    
+    def save(self, corpus: Corpus) -> bool:
+        """Escribe el snapshot del corpus si la caché cambió desde el último guardado"""
+        entries = corpus.cache.export_entries()
+        state = (len(entries), sum(entry[3] for entry in entries), max((entry[2] for entry in entries), default=0))
+        if not entries or self._saved_state.get(corpus.name) == state:
+            return False
+        
+        snapshot = {
+            "format": _FORMAT,
+            "model": self.model_key,
+            "context_hash": self.context_hash(corpus),
+            "saved_at": time.time(),
+            "entries": entries
+        }
+        path = self.path_for(corpus.name)
+        tmp_path = path.with_name(path.name + ".tmp")
+        try:
+            # Se escribe aparte y se reemplaza: nunca queda un snapshot a medias
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"Error al guardar el snapshot de caché de {corpus.name}: {str(e)}", exc_info=True)
+            return False
+        
+        self._saved_state[corpus.name] = state
+        self.saves += 1
+        return True
+    
+    def save_all(self, corpora: Iterable[Corpus]):
+        for corpus in corpora:
+            self.save(corpus)
+    
+    def start(self, get_corpora: Callable[[], Iterable[Corpus]]):
+        """Guarda periódicamente los corpus devueltos por get_corpora"""
+        if self.interval <= 0:
+            return
+        
+        def run():
+            while not self._stopped.wait(self.interval):
+                self.save_all(get_corpora())
+        
+        self._thread = threading.Thread(target=run, name="qa-cache-snapshots", daemon=True)
+        self._thread.start()
+    
+    def stop(self, corpora: Iterable[Corpus]):
+        """Detiene los guardados periódicos y hace un último guardado"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.save_all(corpora)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "directory": str(self.directory),
+            "restored": self.restored,
+            "discarded": self.discarded,
+            "saves": self.saves
+        }
+
+def warm_up_cache(
+    corpus: Corpus,
+    questions: Iterable[str],
+    batch_scheduler,
+    build_response: Callable[[Dict[str, Any], str, float], Dict[str, Any]],
+    min_score: float,
+    limit: int
+) -> int:
+    """
+    Responde en segundo plano las preguntas frecuentes que no estén en la
+    caché del corpus y guarda las respuestas; devuelve cuántas se cachearon.
+    """
+    pending, seen = [], set()
+    for question in questions:
+        key = normalize_question(question)
+        if key and key not in seen and not corpus.cache.contains(question):
+            seen.add(key)
+            pending.append(question)
+        if len(pending) >= limit:
+            break
+    
+    warmed = 0
+    # Por tandas del tamaño de un lote: el tráfico real no espera detrás de todo el recalentamiento
+    for i in range(0, len(pending), batch_scheduler.max_batch_size):
+        chunk = pending[i:i + batch_scheduler.max_batch_size]
+        start_time = time.time()
+        contexts = [corpus.context_manager.retrieve(question) for question in chunk]
+        futures = []
+        for question, context in zip(chunk, contexts):
+            try:
+                futures.append(batch_scheduler.submit_when_free(question, context))
+            except Exception as e:
+                # Con la cola llena se omite la pregunta, no el resto del recalentamiento
+                logger.warning(f"No se pudo recalentar la pregunta '{question}': {str(e)}")
+                futures.append(None)
+        for question, context, future in zip(chunk, contexts, futures):
+            if future is None:
+                continue
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.warning(f"No se pudo recalentar la pregunta '{question}': {str(e)}")
+                continue
+            if result["score"] < min_score:
+                continue
+            corpus.cache.set(question, build_response(result, context.document, time.time() - start_time), context.version)
+            warmed += 1
+    return warmed
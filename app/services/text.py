@@ -0,0 +1,13 @@
+import re
+import unicodedata
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]|_")
+
+def fold_text(text: str) -> str:
+    """Elimina tildes y diacríticos y normaliza mayúsculas ("Dónde" -> "donde")"""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+def normalize_question(question: str) -> str:
+    """Forma canónica de una pregunta: "¿Dónde queda System Plus ?" -> "donde queda system plus" """
+    return " ".join(_PUNCTUATION_RE.sub(" ", fold_text(question)).split())
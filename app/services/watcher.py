@@ -0,0 +1,87 @@
+import os
+import threading
+from pathlib import Path
+from typing import Optional, Tuple
+from app.config import logger
+
+class ContextWatcher:
+    """
+    Vigila el archivo de contexto en segundo plano y avisa al ContextManager
+    cuando cambia. Usa inotify (vía watchdog) si está instalado y, si no,
+    consulta la fecha de modificación del archivo cada interval segundos.
+    """
+    
+    def __init__(self, context_manager, interval: float = 2.0, debounce: float = 0.2):
+        self.context_manager = context_manager
+        self.path = Path(context_manager.context_path).resolve()
+        self.interval = interval
+        # Los editores suelen escribir en varios pasos: se espera a que terminen
+        self.debounce = debounce
+        self.mode = None
+        self._observer = None
+        self._changed = threading.Event()
+        self._stopped = threading.Event()
+        self._last_stat = self._stat()
+        self._thread = threading.Thread(target=self._run, name="qa-context-watcher", daemon=True)
+    
+    def start(self):
+        self._observer = self._start_observer()
+        self.mode = "inotify" if self._observer is not None else "polling"
+        self._thread.start()
+        logger.info(f"Vigilando cambios en {self.path} ({self.mode})")
+    
+    def stop(self):
+        self._stopped.set()
+        self._changed.set()
+        if self._observer is not None:
+            self._observer.stop()
+        self._thread.join(timeout=5)
+    
+    def _start_observer(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return None
+        
+        watcher = self
+        
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                # Se vigila la carpeta: el archivo puede reemplazarse con un rename
+                paths = (event.src_path, getattr(event, "dest_path", ""))
+                if any(path and Path(os.fsdecode(path)).resolve() == watcher.path for path in paths):
+                    watcher._changed.set()
+        
+        try:
+            observer = Observer()
+            observer.schedule(_Handler(), str(self.path.parent), recursive=False)
+            observer.start()
+            return observer
+        except Exception as e:
+            logger.warning(f"No se pudo iniciar la vigilancia por eventos, se usará sondeo: {str(e)}")
+            return None
+    
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = self.path.stat()
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+    
+    def _run(self):
+        while not self._stopped.is_set():
+            if self._changed.wait(self.interval):
+                self._stopped.wait(self.debounce)
+                self._changed.clear()
+            elif self._observer is not None or self._stat() == self._last_stat:
+                continue
+            if self._stopped.is_set():
+                break
+            
+            self._last_stat = self._stat()
+            try:
+                if self.context_manager.refresh():
+                    logger.info(f"Contexto recargado desde el archivo (versión {self.context_manager.version})")
+            except Exception as e:
+                logger.error(f"Error al recargar el contexto modificado: {str(e)}", exc_info=True)
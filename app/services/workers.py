@@ -0,0 +1,219 @@
+import os
+import time
+import signal
+import itertools
+import threading
+from multiprocessing.connection import wait
+from concurrent.futures import Future
+from typing import Dict, List, Tuple
+import numpy as np
+import torch
+import torch.multiprocessing
+from app.config import logger, INFERENCE_PROCESS_PREFIX
+
+def _worker_main(model, cores: List[int], torch_threads: int, connection):
+    # El proceso principal gestiona Ctrl+C y el cierre de los workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(torch_threads or max(1, len(cores)))
+    
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        task_id, inputs = task
+        try:
+            with torch.inference_mode():
+                output = model(**{name: torch.from_numpy(array) for name, array in inputs.items()})
+            connection.send((task_id, output.start_logits.float().numpy(), output.end_logits.float().numpy(), None))
+        except Exception as e:
+            connection.send((task_id, None, None, f"{type(e).__name__}: {str(e)}"))
+
+class _Worker:
+    __slots__ = ("index", "process", "connection", "send_lock", "pending")
+    
+    def __init__(self, index: int, process, connection):
+        self.index = index
+        self.process = process
+        self.connection = connection
+        self.send_lock = threading.Lock()
+        self.pending: Dict[int, Future] = {}
+
+class InferenceWorkerPool:
+    """
+    Procesos de inferencia que comparten los pesos del modelo: los tensores
+    se pasan a memoria compartida y cada proceso recibe el modelo por esos
+    descriptores, sin copiarlos. Los lotes llegan ya tokenizados por un
+    canal IPC local propio de cada proceso.
+    
+    Los procesos se arrancan con spawn, nunca con fork: al crearse el pool
+    (o reemplazar uno caído) el proceso principal ya tiene hilos (bucle de
+    eventos, ejecutores, logging, OpenMP) y un fork podría heredar alguno de
+    sus locks tomado y bloquearse.
+    """
+    
+    def __init__(self, model, num_workers: int, torch_threads: int = 0):
+        self.model = model.eval()
+        # Una sola vez: los procesos que se arranquen después reciben los mismos tensores
+        self.model.share_memory()
+        self.num_workers = num_workers
+        self.torch_threads = torch_threads
+        self._mp = torch.multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        # Índices de los procesos caídos mientras se arranca su reemplazo
+        self._respawning = set()
+        self._task_ids = itertools.count()
+        self._stopped = threading.Event()
+        
+        available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+        per_worker = len(available) // num_workers
+        self._cores = [available[i * per_worker:(i + 1) * per_worker] for i in range(num_workers)]
+        self._workers = [self._spawn(i) for i in range(num_workers)]
+        
+        self._collector = threading.Thread(target=self._collect_results, name="qa-worker-results", daemon=True)
+        self._collector.start()
+        logger.info(f"Pool de inferencia iniciado: {num_workers} procesos, núcleos {self._cores}")
+    
+    def _spawn(self, index: int) -> _Worker:
+        parent_end, child_end = self._mp.Pipe()
+        process = self._mp.Process(
+            target=_worker_main,
+            args=(self.model, self._cores[index], self.torch_threads, child_end),
+            # El nombre identifica al proceso al importar la configuración (logging reducido)
+            name=f"{INFERENCE_PROCESS_PREFIX}{index}",
+            daemon=True
+        )
+        process.start()
+        child_end.close()
+        return _Worker(index, process, parent_end)
+    
+    def submit(self, inputs: Dict[str, np.ndarray]) -> Future:
+        future: Future = Future()
+        task_id = next(self._task_ids)
+        with self._lock:
+            if self._stopped.is_set():
+                raise RuntimeError("El pool de inferencia se ha detenido")
+            workers = [worker for worker in self._workers if worker.index not in self._respawning]
+            if not workers:
+                raise RuntimeError("Los procesos de inferencia se están reiniciando")
+            # Se envía al proceso con menos trabajo pendiente
+            worker = min(workers, key=lambda w: len(w.pending))
+            worker.pending[task_id] = future
+        try:
+            with worker.send_lock:
+                worker.connection.send((task_id, inputs))
+        except (OSError, ValueError) as e:
+            with self._lock:
+                worker.pending.pop(task_id, None)
+            future.set_exception(RuntimeError(f"No se pudo enviar el lote al proceso de inferencia: {str(e)}"))
+        return future
+    
+    def forward(self, chunks: List[Dict[str, np.ndarray]]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Reparte los trozos de un lote entre los procesos y espera todos los logits"""
+        futures = [self.submit(chunk) for chunk in chunks]
+        return [future.result() for future in futures]
+    
+    def _collect_results(self):
+        last_check = time.monotonic()
+        while not self._stopped.is_set():
+            if time.monotonic() - last_check >= 1:
+                self._check_workers()
+                last_check = time.monotonic()
+            
+            with self._lock:
+                workers = {
+                    worker.connection: worker for worker in self._workers if worker.index not in self._respawning
+                }
+            try:
+                ready = wait(list(workers), timeout=1)
+            except (OSError, ValueError):
+                # Conexión cerrada durante el apagado o un reinicio
+                continue
+            for connection in ready:
+                worker = workers[connection]
+                try:
+                    task_id, start_logits, end_logits, error = connection.recv()
+                except (EOFError, OSError):
+                    # El proceso terminó: se reemplaza en la siguiente vuelta
+                    last_check = 0
+                    break
+                with self._lock:
+                    future = worker.pending.pop(task_id, None)
+                if future is None:
+                    continue
+                if error:
+                    future.set_exception(RuntimeError(f"Error en el proceso de inferencia: {error}"))
+                else:
+                    future.set_result((start_logits, end_logits))
+    
+    def _check_workers(self):
+        with self._lock:
+            if self._stopped.is_set():
+                return
+            dead = [
+                worker for worker in self._workers
+                if worker.index not in self._respawning and not worker.process.is_alive()
+            ]
+            self._respawning.update(worker.index for worker in dead)
+            failed = [future for worker in dead for future in worker.pending.values()]
+            for worker in dead:
+                worker.pending.clear()
+        if not dead:
+            return
+        
+        for worker in dead:
+            logger.error(f"El proceso de inferencia {worker.index} terminó inesperadamente; reiniciando")
+            worker.connection.close()
+        for future in failed:
+            future.set_exception(RuntimeError("Un proceso de inferencia terminó inesperadamente"))
+        # Arrancar un proceso lleva tiempo: fuera del lock, los demás siguen recibiendo lotes y devolviendo resultados
+        threading.Thread(target=self._respawn, args=(dead,), name="qa-worker-respawn", daemon=True).start()
+    
+    def _respawn(self, dead: List[_Worker]):
+        for worker in dead:
+            try:
+                replacement = self._spawn(worker.index)
+            except Exception as e:
+                # Sigue marcado como caído: se reintenta en la siguiente comprobación
+                logger.error(f"No se pudo reiniciar el proceso de inferencia {worker.index}: {str(e)}", exc_info=True)
+                replacement = None
+            with self._lock:
+                self._respawning.discard(worker.index)
+                stopped = self._stopped.is_set()
+                if replacement is not None and not stopped:
+                    self._workers[worker.index] = replacement
+            if replacement is not None and stopped:
+                # El pool se detuvo mientras arrancaba
+                replacement.connection.close()
+                replacement.process.join(timeout=5)
+                if replacement.process.is_alive():
+                    replacement.process.terminate()
+            elif replacement is not None:
+                logger.info(f"Proceso de inferencia {worker.index} reiniciado")
+    
+    def shutdown(self):
+        with self._lock:
+            self._stopped.set()
+            workers = list(self._workers)
+        for worker in workers:
+            try:
+                with worker.send_lock:
+                    worker.connection.send(None)
+            except (OSError, ValueError):
+                pass
+        for worker in workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.connection.close()
+            for future in worker.pending.values():
+                if not future.done():
+                    future.set_exception(RuntimeError("El pool de inferencia se ha detenido"))
+        logger.info("Pool de inferencia detenido")
+    
+    def is_alive(self) -> bool:
+        return not self._stopped.is_set() and any(worker.process.is_alive() for worker in self._workers)
@@ -0,0 +1,38 @@
+"""Utilidades compartidas por los benchmarks (sin importar la aplicación)."""
+import statistics
+from typing import Dict, List
+
+DEFAULT_QUESTIONS = [
+    "¿Dónde queda System Plus?",
+    "¿Cuál es la dirección?",
+    "¿Cuál es el teléfono?",
+    "¿Cuál es el correo electrónico?",
+    "¿Cuál es el sitio web oficial?",
+    "¿En qué año fue fundada la institución?",
+    "¿Qué programas técnicos ofrecen?",
+    "¿Qué cursos libres hay?",
+    "¿Qué diplomados ofrecen?",
+    "¿Qué modalidades de estudio tienen?",
+    "¿Cómo se llama la plataforma virtual?",
+    "¿Cuál es el horario de atención entre semana?",
+    "¿Atienden los sábados?",
+    "¿Cómo se llama el programa para víctimas del conflicto?",
+    "¿En qué barrio está ubicada?",
+    "¿Preparan para el ICFES?",
+]
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """Resumen de latencias en milisegundos"""
+    if not latencies:
+        return {}
+    return {
+        "mean": statistics.mean(latencies),
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "max": max(latencies)
+    }
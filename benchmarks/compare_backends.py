@@ -0,0 +1,134 @@
+"""
+Compara los backends de inferencia (torch, torch-int8, onnx) sobre el contexto del servicio.
+
+Para cada backend mide la latencia por pregunta, el throughput por lotes y la
+concordancia de las respuestas con el primer backend de la lista (por defecto
+torch en fp32), de modo que el cambio de backend sea una decisión medida.
+
+Uso:
+    python -m benchmarks.compare_backends
+    python -m benchmarks.compare_backends --backends torch torch-int8 --repeat 5
+    python -m benchmarks.compare_backends --questions preguntas.txt --json resultados.json
+"""
+import argparse
+import json
+import statistics
+import time
+from collections import Counter
+from typing import Dict, Any, List
+
+from app.config import MODEL_NAME, CONTEXT_PATH
+from app.services.backends import BACKENDS
+from app.services.context import ContextManager
+from app.services.model import ModelManager
+from app.services.text import normalize_question
+from benchmarks.common import DEFAULT_QUESTIONS, percentile
+
+def _token_f1(prediction: str, reference: str) -> float:
+    predicted, expected = normalize_question(prediction).split(), normalize_question(reference).split()
+    if not predicted and not expected:
+        return 1.0
+    common = sum((Counter(predicted) & Counter(expected)).values())
+    if common == 0:
+        return 0.0
+    precision, recall = common / len(predicted), common / len(expected)
+    return 2 * precision * recall / (precision + recall)
+
+def run_backend(backend: str, args, context_manager: ContextManager) -> Dict[str, Any]:
+    model_manager = ModelManager(args.model, "cpu", torch_threads=args.threads, backend=backend)
+    if not model_manager.is_available():
+        raise RuntimeError(f"No se pudo cargar el modelo con el backend {backend}")
+    context_manager.set_tokenizer(model_manager.get_tokenizer())
+    contexts = [context_manager.retrieve(question) for question in args.question_list]
+    
+    try:
+        # Calentamiento: la primera inferencia incluye inicializaciones perezosas
+        model_manager.answer_batch(args.question_list[:1], contexts[:1])
+        
+        latencies = []
+        answers = []
+        for _ in range(args.repeat):
+            answers = []
+            for question, context in zip(args.question_list, contexts):
+                start = time.perf_counter()
+                answers.extend(model_manager.answer_batch([question], [context]))
+                latencies.append((time.perf_counter() - start) * 1000)
+        
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for i in range(0, len(contexts), args.batch_size):
+                model_manager.answer_batch(args.question_list[i:i + args.batch_size], contexts[i:i + args.batch_size])
+        elapsed = time.perf_counter() - start
+    finally:
+        model_manager.shutdown()
+    
+    return {
+        "backend": backend,
+        "latency_ms": {
+            "mean": statistics.mean(latencies),
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95)
+        },
+        "throughput_qps": len(contexts) * args.repeat / elapsed,
+        "answers": answers
+    }
+
+def compare(reference: List[Dict[str, Any]], answers: List[Dict[str, Any]]) -> Dict[str, float]:
+    """Concordancia de las respuestas de un backend con las del backend de referencia"""
+    pairs = list(zip(reference, answers))
+    return {
+        "exact_match": sum(a["answer"] == b["answer"] for a, b in pairs) / len(pairs),
+        "same_span": sum((a["start"], a["end"]) == (b["start"], b["end"]) for a, b in pairs) / len(pairs),
+        "token_f1": statistics.mean(_token_f1(b["answer"], a["answer"]) for a, b in pairs),
+        "max_score_diff": max(abs(a["score"] - b["score"]) for a, b in pairs)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara latencia, throughput y respuestas de los backends de inferencia")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS),
+                        help="Backends a medir; el primero es la referencia de concordancia")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--context", default=CONTEXT_PATH)
+    parser.add_argument("--questions", help="Archivo con una pregunta por línea")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=0, help="Hilos de inferencia (0 = por defecto)")
+    parser.add_argument("--json", help="Guardar los resultados completos en este archivo")
+    args = parser.parse_args()
+    
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            args.question_list = [line.strip() for line in f if line.strip()]
+    else:
+        args.question_list = DEFAULT_QUESTIONS
+    
+    context_manager = ContextManager(args.context)
+    results = [run_backend(backend, args, context_manager) for backend in args.backends]
+    reference = results[0]
+    for result in results:
+        result["agreement"] = compare(reference["answers"], result["answers"])
+    
+    print(f"\nModelo: {args.model} | preguntas: {len(args.question_list)} | repeticiones: {args.repeat}")
+    print(f"Referencia de concordancia: {reference['backend']}\n")
+    print(f"{'backend':<12}{'p50 ms':>9}{'p95 ms':>9}{'media ms':>10}{'preg/s':>9}{'exacta':>9}{'F1':>7}{'Δscore':>9}")
+    for result in results:
+        latency, agreement = result["latency_ms"], result["agreement"]
+        print(
+            f"{result['backend']:<12}{latency['p50']:>9.1f}{latency['p95']:>9.1f}{latency['mean']:>10.1f}"
+            f"{result['throughput_qps']:>9.1f}{agreement['exact_match']:>9.0%}{agreement['token_f1']:>7.2f}"
+            f"{agreement['max_score_diff']:>9.4f}"
+        )
+    
+    # Preguntas en las que un backend responde distinto a la referencia
+    for result in results[1:]:
+        for question, expected, answer in zip(args.question_list, reference["answers"], result["answers"]):
+            if expected["answer"] != answer["answer"]:
+                print(f"\n[{result['backend']}] {question}\n  referencia: {expected['answer']!r}\n  obtenida:   {answer['answer']!r}")
+    
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"model": args.model, "questions": args.question_list, "results": results}, f,
+                      ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
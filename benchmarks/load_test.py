@@ -0,0 +1,313 @@
+"""
+Pruebas de carga reproducibles del servicio de preguntas y respuestas.
+
+Levanta la aplicación (en el mismo proceso o con uvicorn en local) sobre una
+copia temporal del contexto y mide throughput y latencias p50/p95/p99 para
+cada combinación de escenario, tamaño de contexto y concurrencia:
+
+- cache_hit: preguntas ya respondidas, servidas desde la caché
+- cache_miss: preguntas siempre distintas, todas pasan por el modelo
+- mixed: una fracción --hit-ratio de aciertos de caché y el resto fallos
+
+Los tamaños de contexto son copias de context/context.txt repetidas N veces,
+cargadas como corpus independientes. Con --stub se usa un modelo diminuto
+generado localmente, así que todo funciona sin conexión. Los resultados se
+guardan en JSON para comparar ejecuciones con --compare.
+
+Uso:
+    python -m benchmarks.load_test --stub
+    python -m benchmarks.load_test --stub --scenarios cache_miss --concurrency 1 8 32 --json base.json
+    python -m benchmarks.load_test --server --context-scales 1 4 16 --json nuevo.json
+    python -m benchmarks.load_test --compare base.json nuevo.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from benchmarks.common import DEFAULT_QUESTIONS, latency_summary
+
+PROJECT_ROOT = Path(__file__).parent.parent
+SCENARIOS = ("cache_hit", "cache_miss", "mixed")
+ADMIN_KEY = "benchmark-admin-key"
+
+def prepare_environment(args, workdir: Path) -> Dict[str, str]:
+    """Variables QA_* que aíslan el servicio en workdir (no se toca el contexto real)"""
+    context_path = workdir / "context.txt"
+    shutil.copyfile(args.context, context_path)
+    
+    model = args.model
+    if args.stub:
+        from benchmarks.stub_model import build_stub_model
+        context = context_path.read_text(encoding="utf-8")
+        model = build_stub_model(str(workdir / "stub-model"), [context, *args.question_list], args.seed)
+    
+    env = {
+        "QA_CONTEXT_PATH": str(context_path),
+        "QA_CORPORA_DIR": str(workdir / "corpora"),
+        "QA_FEEDBACK_DB_PATH": str(workdir / "feedback.db"),
+        "QA_CACHE_SHARED_PATH": str(workdir / "response_cache.db"),
+        "QA_FAQ_DIR": str(workdir / "faq"),
+        "QA_ADMIN_API_KEY": ADMIN_KEY,
+        "QA_CONTEXT_WATCH_INTERVAL": "0",
+        "QA_CORPORA_MEMORY_BUDGET": str(64 * 1024 ** 3),
+        "QA_CONFIDENCE_THRESHOLD": str(args.confidence_threshold),
+        "QA_LOG_LEVEL": args.log_level,
+        "QA_LOG_FILE": ""
+    }
+    if model:
+        env["QA_MODEL_NAME"] = model
+    return env
+
+@contextlib.asynccontextmanager
+async def in_process_client(env: Dict[str, str]) -> AsyncIterator["httpx.AsyncClient"]:
+    """Cliente contra la aplicación en este mismo proceso (ASGI, sin red)"""
+    import httpx
+    
+    # La configuración se lee al importar la aplicación
+    os.environ.update(env)
+    from app.main import app
+    
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            yield client
+
+@contextlib.asynccontextmanager
+async def server_client(env: Dict[str, str]) -> AsyncIterator["httpx.AsyncClient"]:
+    """Cliente HTTP contra un uvicorn local lanzado para la prueba"""
+    import httpx
+    
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=str(PROJECT_ROOT),
+        env={**os.environ, **env}
+    )
+    try:
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None, limits=limits) as client:
+            yield client
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+async def wait_ready(client, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"El servicio no estuvo listo en {timeout:.0f}s")
+
+async def create_scaled_corpora(client, context: str, scales: List[int]) -> Dict[int, Dict[str, Any]]:
+    """Crea un corpus por tamaño de contexto con el texto original repetido"""
+    corpora = {}
+    for scale in scales:
+        name = "default" if scale == 1 else f"scale_{scale}"
+        text = "\n\n".join([context] * scale)
+        if scale != 1:
+            response = await client.post(
+                "/context", params={"corpus": name}, json={"context": text}, headers={"X-API-Key": ADMIN_KEY}
+            )
+            response.raise_for_status()
+        corpora[scale] = {"corpus": name, "context_chars": len(text)}
+    return corpora
+
+def build_workload(scenario: str, questions: List[str], requests: int, hit_ratio: float, rng: random.Random) -> List[str]:
+    """Preguntas a enviar: repetidas (aciertos) o con un sufijo único (fallos de caché)"""
+    workload = []
+    for i in range(requests):
+        hit = scenario == "cache_hit" or (scenario == "mixed" and rng.random() < hit_ratio)
+        question = questions[i % len(questions)] if hit else rng.choice(questions)
+        workload.append(question if hit else f"{question} consulta {i} {rng.randrange(10 ** 9)}")
+    return workload
+
+async def run_cell(client, corpus: str, workload: List[str], concurrency: int) -> Dict[str, Any]:
+    """Envía el workload con concurrency clientes simultáneos y mide cada petición"""
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    pending = iter(workload)
+    
+    async def worker():
+        for question in pending:
+            start = time.perf_counter()
+            try:
+                status = (await client.post("/qa", json={"question": question, "corpus": corpus})).status_code
+            except Exception:
+                status = "error"
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+    
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": len(workload),
+        "errors": sum(count for status, count in statuses.items() if status != "200"),
+        "status_counts": statuses,
+        "elapsed_s": elapsed,
+        "throughput_rps": len(workload) / elapsed,
+        "latency_ms": latency_summary(latencies)
+    }
+
+async def run_benchmark(args, env: Dict[str, str]) -> List[Dict[str, Any]]:
+    client_factory = server_client if args.server else in_process_client
+    headers = {"X-API-Key": ADMIN_KEY}
+    results = []
+    async with client_factory(env) as client:
+        await wait_ready(client, args.ready_timeout)
+        context = Path(env["QA_CONTEXT_PATH"]).read_text(encoding="utf-8")
+        corpora = await create_scaled_corpora(client, context, args.context_scales)
+        
+        for scale in args.context_scales:
+            corpus = corpora[scale]["corpus"]
+            for scenario in args.scenarios:
+                for concurrency in args.concurrency:
+                    # Misma semilla por celda: el mismo workload en cada ejecución
+                    rng = random.Random(f"{args.seed}-{scenario}-{scale}-{concurrency}")
+                    workload = build_workload(scenario, args.question_list, args.requests, args.hit_ratio, rng)
+                    
+                    await client.post("/clear-cache", params={"corpus": corpus}, headers=headers)
+                    if scenario != "cache_miss":
+                        # Calentamiento: deja las preguntas base en la caché
+                        for question in args.question_list:
+                            await client.post("/qa", json={"question": question, "corpus": corpus})
+                    
+                    cell = await run_cell(client, corpus, workload, concurrency)
+                    cell.update({
+                        "scenario": scenario,
+                        "context_scale": scale,
+                        "context_chars": corpora[scale]["context_chars"],
+                        "concurrency": concurrency
+                    })
+                    results.append(cell)
+                    print_row(cell)
+    return results
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=str(PROJECT_ROOT), capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def print_header():
+    print(f"{'escenario':<12}{'contexto':>10}{'conc.':>7}{'pet/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errores':>9}")
+
+def print_row(cell: Dict[str, Any]):
+    latency = cell["latency_ms"]
+    print(
+        f"{cell['scenario']:<12}{cell['context_scale']:>9}x{cell['concurrency']:>7}{cell['throughput_rps']:>10.1f}"
+        f"{latency['p50']:>9.1f}{latency['p95']:>9.1f}{latency['p99']:>9.1f}{cell['errors']:>9}"
+    )
+
+def compare_runs(baseline_path: str, candidate_path: str):
+    """Variación de throughput y latencias entre dos ejecuciones guardadas con --json"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(candidate_path, "r", encoding="utf-8") as f:
+        candidate = json.load(f)
+    
+    def key(cell):
+        return cell["scenario"], cell["context_scale"], cell["concurrency"]
+    
+    reference = {key(cell): cell for cell in baseline["results"]}
+    print(f"Base: {baseline['meta'].get('commit')} | nuevo: {candidate['meta'].get('commit')}\n")
+    print(f"{'escenario':<12}{'contexto':>10}{'conc.':>7}{'pet/s':>10}{'p50':>9}{'p95':>9}{'p99':>9}")
+    
+    def delta(new: float, old: float) -> str:
+        return f"{(new - old) / old:+.0%}" if old else "n/a"
+    
+    for cell in candidate["results"]:
+        old = reference.get(key(cell))
+        if old is None:
+            continue
+        print(
+            f"{cell['scenario']:<12}{cell['context_scale']:>9}x{cell['concurrency']:>7}"
+            f"{delta(cell['throughput_rps'], old['throughput_rps']):>10}"
+            + "".join(
+                f"{delta(cell['latency_ms'][p], old['latency_ms'][p]):>9}" for p in ("p50", "p95", "p99")
+            )
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="Pruebas de carga del servicio de preguntas y respuestas")
+    parser.add_argument("--stub", action="store_true", help="Usar un modelo diminuto generado localmente (sin descargas)")
+    parser.add_argument("--model", help="Modelo a usar (por defecto QA_MODEL_NAME)")
+    parser.add_argument("--server", action="store_true", help="Lanzar uvicorn en local en vez de llamar a la app en proceso")
+    parser.add_argument("--context", default=str(PROJECT_ROOT / "context" / "context.txt"))
+    parser.add_argument("--context-scales", nargs="+", type=int, default=[1, 4],
+                        help="Veces que se repite el contexto en cada corpus de prueba")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="Peticiones por combinación")
+    parser.add_argument("--hit-ratio", type=float, default=0.8, help="Fracción de aciertos de caché en mixed")
+    parser.add_argument("--questions", help="Archivo con una pregunta por línea")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--confidence-threshold", type=float, default=0.0)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--ready-timeout", type=float, default=600)
+    parser.add_argument("--json", help="Guardar los resultados en este archivo")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NUEVO"), help="Comparar dos resultados guardados")
+    args = parser.parse_args()
+    
+    if args.compare:
+        compare_runs(*args.compare)
+        return
+    
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            args.question_list = [line.strip() for line in f if line.strip()]
+    else:
+        args.question_list = DEFAULT_QUESTIONS
+    
+    workdir = Path(tempfile.mkdtemp(prefix="qa-benchmark-"))
+    try:
+        env = prepare_environment(args, workdir)
+        print(f"Modelo: {env.get('QA_MODEL_NAME', 'por defecto')} | modo: {'uvicorn' if args.server else 'en proceso'}\n")
+        print_header()
+        results = asyncio.run(run_benchmark(args, env))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    
+    if args.json:
+        meta = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": git_commit(),
+            "model": "stub" if args.stub else env.get("QA_MODEL_NAME"),
+            "mode": "server" if args.server else "in-process",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "requests": args.requests,
+            "hit_ratio": args.hit_ratio,
+            "seed": args.seed,
+            "questions": args.question_list
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Modelo de preguntas y respuestas diminuto y aleatorio para los benchmarks.
+
+Se construye localmente (sin descargas) a partir del vocabulario del
+contexto: las respuestas no tienen sentido, pero recorre el mismo camino que
+el modelo real (tokenizador rápido, pipeline, lector pre-tokenizado), de modo
+que sirve para medir el servicio sin depender de la red.
+
+Uso:
+    python -m benchmarks.stub_model /tmp/qa-stub
+"""
+import argparse
+import re
+from pathlib import Path
+from typing import Iterable
+
+from benchmarks.common import DEFAULT_QUESTIONS
+
+_SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+
+def build_stub_model(directory: str, texts: Iterable[str], seed: int = 0, dim: int = 32, layers: int = 2) -> str:
+    """Guarda en directory un DistilBERT aleatorio con vocabulario sacado de texts; devuelve la ruta"""
+    import torch
+    from transformers import DistilBertConfig, DistilBertForQuestionAnswering, DistilBertTokenizerFast
+    
+    path = Path(directory)
+    if (path / "config.json").exists():
+        return str(path)
+    path.mkdir(parents=True, exist_ok=True)
+    
+    words = set()
+    for text in texts:
+        words.update(re.findall(r"\w+|[^\w\s]", text.lower()))
+    vocab_file = path / "vocab.txt"
+    vocab_file.write_text("\n".join(_SPECIAL_TOKENS + sorted(words)), encoding="utf-8")
+    
+    tokenizer = DistilBertTokenizerFast(vocab_file=str(vocab_file), do_lower_case=True, strip_accents=False)
+    tokenizer.save_pretrained(str(path))
+    
+    # Misma semilla, mismos pesos: los resultados de dos ejecuciones son comparables
+    torch.manual_seed(seed)
+    config = DistilBertConfig(
+        vocab_size=len(tokenizer), dim=dim, hidden_dim=dim * 2, n_layers=layers, n_heads=2,
+        max_position_embeddings=512
+    )
+    DistilBertForQuestionAnswering(config).save_pretrained(str(path))
+    return str(path)
+
+def main():
+    from app.config import CONTEXT_PATH
+    
+    parser = argparse.ArgumentParser(description="Crea un modelo de preguntas y respuestas diminuto sin descargas")
+    parser.add_argument("directory")
+    parser.add_argument("--context", default=CONTEXT_PATH)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    with open(args.context, "r", encoding="utf-8") as f:
+        context = f.read()
+    print(build_stub_model(args.directory, [context, *DEFAULT_QUESTIONS], args.seed))
+
+if __name__ == "__main__":
+    main()
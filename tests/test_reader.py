@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from transformers import BertTokenizerFast
+from app.services.encoding import ContextEncoding
+from app.services.reader import SpanReader
+from app.services.retrieval import PassageIndex
+
+WORDS = ["la", "empresa", "ofrece", "cursos", "de", "diseño", "programación", "en", "línea", "y", "soporte", "técnico", "sede", "bogotá", "teléfono", "dónde", "qué", "queda"]
+DOCUMENT = "\n\n".join(
+    " ".join(WORDS[(paragraph * 7 + word) % len(WORDS)] for word in range(40)) for paragraph in range(6)
+)
+
+def make_tokenizer() -> BertTokenizerFast:
+    # Vocabulario mínimo escrito en disco: la prueba no descarga ningún modelo
+    vocab_path = os.path.join(tempfile.mkdtemp(), "vocab.txt")
+    with open(vocab_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS))
+    return BertTokenizerFast(vocab_file=vocab_path, do_lower_case=False, strip_accents=False)
+
+def fake_forward(model_inputs):
+    """Logits deterministas que dependen solo de cada token y su posición (no del relleno ni del lote)"""
+    logits = []
+    for arrays in model_inputs:
+        ids = arrays["input_ids"].astype(np.float32)
+        positions = np.arange(ids.shape[1], dtype=np.float32)
+        logits.append((np.sin(ids * 1.3 + positions * 0.7) * 4, np.cos(ids * 0.9 + positions * 0.4) * 4))
+    return logits
+
+class ParityTest(unittest.TestCase):
+    def setUp(self):
+        self.tokenizer = make_tokenizer()
+        index = PassageIndex(DOCUMENT, max_chars=200)
+        self.passages = index.passages
+        # Ventanas pequeñas para que el documento se lea en varias
+        self.encoding = ContextEncoding(0, DOCUMENT, self.passages, self.tokenizer, max_seq_len=48, doc_stride=12, max_question_len=16)
+    
+    def check_parity(self, adaptive_windows: bool):
+        reader = SpanReader(
+            None, self.tokenizer, "cpu",
+            max_windows_per_forward=4,
+            forward=fake_forward,
+            search="parity",
+            # Ningún tramo llega a esta puntuación: early_exit lee todas las ventanas
+            early_exit_score=2.0,
+            adaptive_windows=adaptive_windows
+        )
+        questions = ["¿Dónde queda la sede?", "teléfono", "¿Qué cursos de diseño ofrece la empresa en línea?"]
+        reader.answer_batch([(question, self.encoding, self.passages) for question in questions])
+        stats = reader.get_stats()
+        self.assertGreater(stats["windows"], len(questions))
+        self.assertEqual(stats["early_exits"], 0)
+        self.assertEqual(stats["parity_checks"], len(questions))
+        self.assertEqual(stats["parity_mismatches"], 0)
+    
+    def test_parity_without_early_exit(self):
+        self.check_parity(adaptive_windows=False)
+    
+    def test_parity_without_early_exit_adaptive_windows(self):
+        self.check_parity(adaptive_windows=True)
+
+if __name__ == "__main__":
+    unittest.main()